@@ -1,17 +1,19 @@
-from meteostat import Point, Hourly
-from datetime import datetime
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import argparse
 import pandas as pd
 import os
 
+# (latitude, longitude, elevation in m)
 cities = {
-    "ahmedabad": {"coords": Point(23.0225, 72.5714, 53), "timezone": "Asia/Kolkata"},
-    "mumbai": {"coords": Point(19.0760, 72.8777, 14), "timezone": "Asia/Kolkata"},
-    "delhi": {"coords": Point(28.7041, 77.1025, 216), "timezone": "Asia/Kolkata"},
-    "bengaluru": {"coords": Point(12.9716, 77.5946, 920), "timezone": "Asia/Kolkata"}
+    "ahmedabad": {"coords": (23.0225, 72.5714, 53), "timezone": "Asia/Kolkata"},
+    "mumbai": {"coords": (19.0760, 72.8777, 14), "timezone": "Asia/Kolkata"},
+    "delhi": {"coords": (28.7041, 77.1025, 216), "timezone": "Asia/Kolkata"},
+    "bengaluru": {"coords": (12.9716, 77.5946, 920), "timezone": "Asia/Kolkata"}
 }
 
+# First hour fetched when a city has no CSV yet (or with --full)
 start = datetime(2020, 1, 1)
-end = datetime.now()
 
 rename_map = {
     "time": "Timestamp",
@@ -20,32 +22,180 @@ rename_map = {
     "wspd": "Wind Speed (km/h)",
     "wdir": "Wind Direction (°)"
 }
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Cities are fetched concurrently; the work is network-bound
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(len(cities))))
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
-def process_weather_data(city_name, city_info):
-    # Fetch hourly weather data for the city
-    data = Hourly(city_info['coords'], start, end, timezone=city_info['timezone']).fetch()
 
-    # If no data is returned, exit the function
-    if data.empty:
-        return
+class MeteostatSource:
+    """Hourly observations from Meteostat (imported on first use)."""
+
+    def fetch(self, city_name, city_info, start, end):
+        from meteostat import Point, Hourly
+        return Hourly(Point(*city_info['coords']), start, end, timezone=city_info['timezone']).fetch()
+
+
+class CsvFileSource:
+    """Local stand-in for Meteostat: ``<directory>/<city>.csv`` with a ``time`` column.
+
+    Columns may use Meteostat's names (``temp``, ``rhum``, ...) or the app's
+    names; only rows between ``start`` and ``end`` are returned.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, city_name, city_info, start, end):
+        path = os.path.join(self.directory, f"{city_name}.csv")
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        data = pd.read_csv(path)
+        time_col = "time" if "time" in data.columns else rename_map["time"]
+        data[time_col] = pd.to_datetime(data[time_col])
+        data = data[(data[time_col] >= start) & (data[time_col] <= end)]
+        return data.set_index(time_col)
 
-    # Reset index and fill missing values
-    data.reset_index(inplace=True)
-    data.fillna(method='ffill', inplace=True)
-    data.fillna(method='bfill', inplace=True)
-    # Rename columns and format the Timestamp column
+
+def read_last_row(filename):
+    """Last row of a city CSV as a Series, or None if there is no usable file.
+
+    Only the end of the file is read, so the cost does not grow with the history.
+    """
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 4096))
+        lines = f.read().decode('utf-8', errors='ignore').splitlines()
+    columns = list(rename_map.values())
+    for line in reversed(lines):
+        values = line.split(',')
+        try:
+            timestamp = datetime.strptime(values[0], TIMESTAMP_FORMAT)
+        except ValueError:
+            continue
+        if len(values) != len(columns):
+            continue
+        return pd.Series([timestamp] + [float(v) if v else None for v in values[1:]], index=columns)
+    return None
+
+
+def clean_weather_data(data, last_row=None):
+    """Rename, gap-fill and format fetched observations like a full refresh.
+
+    Gaps are forward-filled, continuing from ``last_row`` (the last row already
+    in the CSV) on incremental fetches, and back-filled only at the very start
+    of a new file. Trailing hours with no observation at all are dropped so
+    they are fetched again on the next run instead of being stored as copies
+    of the last value.
+    """
+    data = data.reset_index()
     data.rename(columns={col: rename_map.get(col, col) for col in data.columns}, inplace=True)
     data = data[list(rename_map.values())]
-    data['Timestamp'] = pd.to_datetime(data['Timestamp']).dt.strftime('%Y-%m-%d %H:%M:%S')
+    data['Timestamp'] = pd.to_datetime(data['Timestamp'])
+    if getattr(data['Timestamp'].dt, 'tz', None) is not None:
+        # Meteostat returns local, timezone-aware times; the CSVs store local wall time
+        data['Timestamp'] = data['Timestamp'].dt.tz_localize(None)
+
+    value_cols = [col for col in data.columns if col != 'Timestamp']
+    observed = data[value_cols].notna().any(axis=1)
+    if not observed.any():
+        return data.iloc[0:0]
+    data = data.loc[:observed[observed].index[-1]]
 
-    # Save the processed data to a CSV file
+    if last_row is not None:
+        data = pd.concat([last_row.to_frame().T, data], ignore_index=True).ffill().iloc[1:]
+    else:
+        data = data.ffill().bfill()
+    data['Timestamp'] = pd.to_datetime(data['Timestamp']).dt.strftime(TIMESTAMP_FORMAT)
+    data[value_cols] = data[value_cols].astype(float)
+    return data
+
+
+def process_weather_data(city_name, city_info, source, end, full=False):
+    """Fetch the hours after the city's high-water mark and append them to its CSV.
+
+    Returns the number of rows written.
+    """
     filename = os.path.join(script_dir, f"{city_name}.csv")
-    data.to_csv(filename, index=False)
+    # The high-water mark is the last stored hour; only later hours are fetched
+    last_row = None if full else read_last_row(filename)
+    high_water_mark = last_row['Timestamp'] if last_row is not None else None
+    fetch_start = high_water_mark + timedelta(hours=1) if high_water_mark else start
+    if fetch_start > end:
+        print(f"✅ {city_name}: up to date (last row {high_water_mark}).")
+        return 0
+
+    data = source.fetch(city_name, city_info, fetch_start, end)
+    # If no data is returned, leave the file untouched
+    if data.empty:
+        print(f"⚠️ {city_name}: no new data after {high_water_mark or start}.")
+        return 0
+
+    if high_water_mark is None:
+        data = clean_weather_data(data)
+        if data.empty:
+            return 0
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        data.to_csv(tmp_filename, index=False)
+        os.replace(tmp_filename, filename)
+        print(f"✅ {city_name}: wrote {len(data)} rows.")
+        return len(data)
+
+    data = clean_weather_data(data, last_row=last_row)
+    # Never re-append hours that are already stored
+    data = data[pd.to_datetime(data['Timestamp']) > high_water_mark]
+    if data.empty:
+        print(f"✅ {city_name}: no new observations after {high_water_mark}.")
+        return 0
+
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        f.seek(max(0, size - 1))
+        needs_newline = f.read(1) not in (b'\n', b'')
+    try:
+        with open(filename, 'a', newline='') as f:
+            if needs_newline:
+                f.write('\n')
+            data.to_csv(f, index=False, header=False)
+    except Exception:
+        # Don't leave half an append behind
+        with open(filename, 'r+b') as f:
+            f.truncate(size)
+        raise
+    print(f"✅ {city_name}: appended {len(data)} rows after {high_water_mark}.")
+    return len(data)
+
+
+def update_all_cities(source=None, city_names=None, full=False, end=None):
+    """Bring every city CSV up to date, fetching cities concurrently."""
+    source = source or MeteostatSource()
+    end = end or datetime.now()
+    city_names = city_names or list(cities)
+    with ThreadPoolExecutor(max_workers=max(1, min(INGEST_WORKERS, len(city_names)))) as executor:
+        futures = {
+            city_name: executor.submit(process_weather_data, city_name, cities[city_name], source, end, full)
+            for city_name in city_names
+        }
+    results = {}
+    for city_name, future in futures.items():
+        try:
+            results[city_name] = future.result()
+        except Exception as e:
+            print(f"❌ {city_name}: {e}")
+            results[city_name] = None
+    return results
+
 
-# Process weather data for each city in the dictionary
-for city_name, city_info in cities.items():
-    process_weather_data(city_name, city_info)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch new hourly observations and append them to the city CSVs.")
+    parser.add_argument("--cities", default=",".join(cities), help="Comma-separated city names")
+    parser.add_argument("--full", action="store_true", help=f"Refetch everything since {start:%Y-%m-%d} and rewrite the CSVs")
+    parser.add_argument("--source-dir", help="Read observations from <dir>/<city>.csv instead of Meteostat")
+    args = parser.parse_args()
 
-print("Data processing completed successfully.")
+    source = CsvFileSource(args.source_dir) if args.source_dir else MeteostatSource()
+    update_all_cities(source, args.cities.split(","), full=args.full)
+    print("Data processing completed successfully.")
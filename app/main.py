@@ -1,17 +1,76 @@
-from fastapi import FastAPI, HTTPException, Query
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Response, Header
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 import pandas as pd
 from datetime import datetime, timedelta
 import numpy as np
 import os
-from typing import Optional
+import json
+import time
+import logging
+import threading
+from typing import Optional, List
+from pydantic import BaseModel
 
-from app.ml.predict import make_predictions
-from app.ml.ensemble import predict_ensemble, BASE_MODEL_NAMES
-from app.utils.preprocess import TARGET_FEATURES, TIMESTAMP_COL
-from app.ml.evaluate import load_model_metrics, get_all_metrics, evaluate_ensemble
+from app.ml.ensemble import BASE_MODEL_NAMES, ALL_MODEL_NAMES
+from app.utils.preprocess import TARGET_FEATURES, TIMESTAMP_COL, history_store
+from app.utils.work_queue import BoundedExecutor, SingleFlight, QueueFullError, DeadlineExceeded
+from app.utils import telemetry
+from app.utils.serialize import (
+    format_records, iter_ndjson, forecast_to_columnar, forecast_to_arrow, flatten_metrics,
+    table_to_columnar, table_to_arrow, arrow_available,
+    NDJSON_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE, ARROW_MEDIA_TYPE,
+)
+from app.ml.evaluate import (
+    save_model_metrics, metrics_path, evaluate_ensemble,
+    ensemble_holdout_metrics, stale_holdout_members, holdout_predictions_path, METRICS_DIRS,
+)
+from app.ml.metrics_index import metrics_indexes
+from app.ml.registry import model_registry
+from app.ml.forecast_cache import forecast_cache, get_forecast, get_base_forecasts, precompute_forecasts
+from app.ml.predict import calculate_extended_periods
+
+ALLOWED_CITIES = os.getenv("WEATHER_CITIES", "ahmedabad,mumbai,delhi,bengaluru").split(",")
+# Set PRELOAD_MODELS=1 to unpickle every model at startup instead of on first request
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "0") == "1"
+# Set PRECOMPUTE_FORECASTS=1 to fill the forecast cache in the background at startup
+PRECOMPUTE_FORECASTS = os.getenv("PRECOMPUTE_FORECASTS", "0") == "1"
+# Prediction work is offloaded to a bounded pool; requests beyond workers + queue get a 503
+PREDICT_EXECUTOR = os.getenv("PREDICT_EXECUTOR", "thread")  # "thread" or "process"
+PREDICT_WORKERS = int(os.getenv("PREDICT_WORKERS", "4"))
+PREDICT_QUEUE_SIZE = int(os.getenv("PREDICT_QUEUE_SIZE", "16"))
+PREDICT_TIMEOUT_SECONDS = float(os.getenv("PREDICT_TIMEOUT_SECONDS", "120"))
+PREDICT_RETRY_AFTER_SECONDS = os.getenv("PREDICT_RETRY_AFTER_SECONDS", "5")
+# Set PREDICT_COALESCE=0 to compute every /predict request separately, even
+# when an identical one is already running
+PREDICT_COALESCE = os.getenv("PREDICT_COALESCE", "1") == "1"
+# Largest number of queries accepted by one POST /predict/batch
+PREDICT_BATCH_MAX_QUERIES = int(os.getenv("PREDICT_BATCH_MAX_QUERIES", "100"))
+# Metrics only change when models are trained; browsers may reuse them this long, then revalidate with the ETag
+METRICS_CACHE_CONTROL = f"public, max-age={int(os.getenv('METRICS_MAX_AGE_SECONDS', '60'))}"
+# Per-request messages are logged at DEBUG; set LOG_LEVEL=DEBUG to see them
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+predict_executor = BoundedExecutor(max_workers=PREDICT_WORKERS, max_queue=PREDICT_QUEUE_SIZE, kind=PREDICT_EXECUTOR)
+# Identical concurrent /predict requests share one computation
+predict_flights = SingleFlight()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if PRELOAD_MODELS:
+        loaded = model_registry.preload(ALLOWED_CITIES, ALL_MODEL_NAMES)
+        logger.info("Preloaded %d models in %.2fs", loaded, model_registry.stats()["load_time_seconds"])
+    if PRECOMPUTE_FORECASTS:
+        threading.Thread(target=precompute_forecasts, args=(ALLOWED_CITIES,), daemon=True).start()
+    yield
+    predict_executor.shutdown()
 
-app = FastAPI(title="Weather Forecast API")
+app = FastAPI(title="Weather Forecast API", lifespan=lifespan)
 
 origins = [
     "http://localhost",
@@ -36,146 +95,452 @@ def filter_by_day(df: pd.DataFrame, day_of_week: int) -> pd.DataFrame:
     df[TIMESTAMP_COL] = pd.to_datetime(df[TIMESTAMP_COL])
     return df[df[TIMESTAMP_COL].dt.dayofweek == day_of_week].copy()
 
-@app.get("/predict")
-async def get_prediction(
-    city: str = Query(..., description="City name (e.g., ahmedabad)"),
-    model_name: str = Query(..., description=f"Model name (e.g., {' / '.join(BASE_MODEL_NAMES)} / Ensemble)"),
-    forecast_type: str = Query(..., description="Forecast duration ('48h', '1week' or '2weeks')"),
-    day_of_week: Optional[int] = Query(None, description="Day of week (0=Mon, 6=Sun) - only if forecast_type is '1week' or '2weeks'"),
-    # Prophet-specific parameters
-    prophet_extended: Optional[str] = Query(None, description="Extended forecast period for Prophet (1month, 3months, 6months, 1year)"),
-    include_bounds: Optional[bool] = Query(False, description="Include Prophet's uncertainty bounds")
-):
-    allowed_cities = ["ahmedabad", "mumbai", "delhi", "bengaluru"]
-    allowed_models = BASE_MODEL_NAMES + ["Ensemble"]
-    allowed_forecast_types = ["48h", "1week", "2weeks"]
-    allowed_prophet_extended = ["1month", "3months", "6months", "1year", None]
+# Media types selectable through the Accept header, by response format
+RESPONSE_FORMATS = {
+    "json": "application/json",
+    "ndjson": NDJSON_MEDIA_TYPE,
+    "columnar": COLUMNAR_MEDIA_TYPE,
+    "arrow": ARROW_MEDIA_TYPE,
+}
+# Formats encoded to bytes on the executor and sent as-is
+BINARY_ENCODERS = {
+    "columnar": (forecast_to_columnar, table_to_columnar),
+    "arrow": (forecast_to_arrow, table_to_arrow),
+}
 
-    # Validation checks
-    if city not in allowed_cities:
-        raise HTTPException(status_code=400, detail=f"Invalid city. Allowed: {', '.join(allowed_cities)}")
+def negotiate_format(format_param, accept_header):
+    """Pick the response format: explicit ?format= wins, then the Accept header, then JSON."""
+    if format_param:
+        return format_param
+    if accept_header:
+        for media_range in accept_header.split(","):
+            media_type = media_range.split(";")[0].strip()
+            for name, format_media_type in RESPONSE_FORMATS.items():
+                if media_type == format_media_type:
+                    return name
+    return "json"
+
+def resolve_format(format_param, accept_header, allowed):
+    """Validate ?format= and negotiate the response format, raising 400/406 for unusable ones."""
+    if format_param and format_param not in allowed:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Allowed: {', '.join(allowed)}")
+    response_format = negotiate_format(format_param, accept_header)
+    if response_format not in allowed:
+        response_format = "json"
+    if response_format == "arrow" and not arrow_available():
+        raise HTTPException(status_code=406, detail="Arrow responses require pyarrow, which is not installed on the server.")
+    return response_format
+
+ALLOWED_FORECAST_TYPES = {"48h": 48, "1week": 168, "2weeks": 336}
+ALLOWED_PROPHET_EXTENDED = ["1month", "3months", "6months", "1year"]
+
+def validate_prediction_query(city, model_name, forecast_type, day_of_week, prophet_extended, include_bounds):
+    """Check one /predict query, raising a 400 for invalid ones; returns the forecast length in hours."""
+    allowed_models = ALL_MODEL_NAMES + ["Ensemble"]
+    if city not in ALLOWED_CITIES:
+        raise HTTPException(status_code=400, detail=f"Invalid city. Allowed: {', '.join(ALLOWED_CITIES)}")
     if model_name not in allowed_models:
         raise HTTPException(status_code=400, detail=f"Invalid model name. Allowed: {', '.join(allowed_models)}")
-    if forecast_type not in allowed_forecast_types:
-        raise HTTPException(status_code=400, detail=f"Invalid forecast type. Allowed: {', '.join(allowed_forecast_types)}")
+    if forecast_type not in ALLOWED_FORECAST_TYPES:
+        raise HTTPException(status_code=400, detail=f"Invalid forecast type. Allowed: {', '.join(ALLOWED_FORECAST_TYPES)}")
     if forecast_type == "48h" and day_of_week is not None:
         raise HTTPException(status_code=400, detail="Day of week selection is only valid for '1week' or '2weeks' forecast type.")
     if day_of_week is not None and not (0 <= day_of_week <= 6):
         raise HTTPException(status_code=400, detail="Invalid day_of_week. Must be between 0 (Monday) and 6 (Sunday).")
-    if prophet_extended and prophet_extended not in allowed_prophet_extended:
-        raise HTTPException(status_code=400, detail=f"Invalid prophet_extended. Allowed: {', '.join([p for p in allowed_prophet_extended if p])}")
+    if prophet_extended and prophet_extended not in ALLOWED_PROPHET_EXTENDED:
+        raise HTTPException(status_code=400, detail=f"Invalid prophet_extended. Allowed: {', '.join(ALLOWED_PROPHET_EXTENDED)}")
     if prophet_extended and model_name != "Prophet":
         raise HTTPException(status_code=400, detail="Extended forecasting is only available with the Prophet model.")
     if include_bounds and model_name != "Prophet":
         raise HTTPException(status_code=400, detail="Uncertainty bounds are only available with the Prophet model.")
+    return ALLOWED_FORECAST_TYPES[forecast_type]
 
-    # Determine forecast length
-    hours_to_predict = 48 if forecast_type == "48h" else 168 if forecast_type == "1week" else 336
+@app.get("/predict")
+async def get_prediction(
+    response: Response,
+    city: str = Query(..., description="City name (e.g., ahmedabad)"),
+    model_name: str = Query(..., description=f"Model name (e.g., {' / '.join(ALL_MODEL_NAMES)} / Ensemble)"),
+    forecast_type: str = Query(..., description="Forecast duration ('48h', '1week' or '2weeks')"),
+    day_of_week: Optional[int] = Query(None, description="Day of week (0=Mon, 6=Sun) - only if forecast_type is '1week' or '2weeks'"),
+    # Prophet-specific parameters
+    prophet_extended: Optional[str] = Query(None, description="Extended forecast period for Prophet (1month, 3months, 6months, 1year)"),
+    include_bounds: Optional[bool] = Query(False, description="Include Prophet's uncertainty bounds"),
+    format: Optional[str] = Query(None, description="Response format: 'json' (default), 'ndjson' (streamed, one row per line), 'columnar' (column arrays) or 'arrow' (Arrow IPC stream). Also selectable via the Accept header."),
+    accept: Optional[str] = Header(None),
+):
+    hours_to_predict = validate_prediction_query(city, model_name, forecast_type, day_of_week, prophet_extended, include_bounds)
+    response_format = resolve_format(format, accept, RESPONSE_FORMATS)
 
+    logger.debug("Received request: city=%s, model=%s, type=%s, day=%s, prophet_extended=%s, include_bounds=%s",
+                 city, model_name, forecast_type, day_of_week, prophet_extended, include_bounds)
+    labels = (city, model_name, str(calculate_extended_periods(prophet_extended) or hours_to_predict))
+    start = time.perf_counter()
+    status = 200
     try:
-        print(f"Received request: city={city}, model={model_name}, type={forecast_type}, day={day_of_week}, prophet_extended={prophet_extended}, include_bounds={include_bounds}")
-        
-        if model_name == "Ensemble":
-            # Ensemble doesn't support Prophet extensions
-            df_predictions = predict_ensemble(city, hours_to_predict)
+        # CPU-bound work runs on the prediction executor so the event loop stays responsive
+        args = (city, model_name, forecast_type, hours_to_predict, day_of_week, prophet_extended, include_bounds, response_format)
+        if PREDICT_COALESCE:
+            # Requests asking for the same response bytes share one computation
+            key = (city, model_name, hours_to_predict, day_of_week, prophet_extended or None, bool(include_bounds), response_format)
+            (result, headers, trace), leader = await predict_flights.run(
+                key, predict_executor.run, build_prediction, *args, timeout=PREDICT_TIMEOUT_SECONDS)
         else:
-            # Pass Prophet-specific parameters when applicable
-            df_predictions = make_predictions(
-                city, 
-                model_name, 
-                hours_to_predict,
-                include_bounds=include_bounds,
-                prophet_extended=prophet_extended
-            )
+            result, headers, trace = await predict_executor.run(build_prediction, *args, timeout=PREDICT_TIMEOUT_SECONDS)
+            leader = True
+        headers = dict(headers)
+        if leader:
+            # Recorded here rather than in the worker, so process workers report too
+            telemetry.record(trace)
+        else:
+            headers["X-Coalesced"] = "1"
+        if response_format == "ndjson":
+            return StreamingResponse(timed_ndjson(result, labels), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+        if response_format in BINARY_ENCODERS:
+            return Response(content=result, media_type=RESPONSE_FORMATS[response_format], headers=headers)
+        response.headers.update(headers)
+        return result
 
-        if df_predictions.empty:
-            raise HTTPException(status_code=500, detail="Prediction generation failed or returned empty results.")
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    except QueueFullError as e:
+        status = 503
+        logger.warning("Rejected request: %s", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": PREDICT_RETRY_AFTER_SECONDS})
+    except DeadlineExceeded as e:
+        status = 504
+        logger.warning("Error: %s", e)
+        raise HTTPException(status_code=504, detail=str(e))
+    except FileNotFoundError as e:
+        status = 404
+        logger.warning("Error: %s", e)
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        status = 500
+        logger.error("Error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+    except Exception as e:
+        status = 500
+        logger.exception("Unexpected Error: %s", e)
+        raise HTTPException(status_code=500, detail=f"An internal server error occurred: {str(e)}")
+    finally:
+        telemetry.observe_request(labels, status, time.perf_counter() - start)
+
+def timed_ndjson(df, labels):
+    """Stream NDJSON rows, recording the time spent encoding them (not sending them)."""
+    chunks = iter_ndjson(df)
+    seconds = 0.0
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        seconds += time.perf_counter() - start
+        if chunk is None:
+            break
+        yield chunk
+    telemetry.observe(labels, "serialize", seconds)
+
+def build_prediction(city, model_name, forecast_type, hours_to_predict, day_of_week, prophet_extended, include_bounds, response_format="json"):
+    """Compute the /predict response body, extra headers and stage timings (runs on the prediction executor).
+
+    For streamed formats the (filtered) forecast DataFrame is returned instead of records.
+    """
+    horizon = calculate_extended_periods(prophet_extended) or hours_to_predict
+    with telemetry.tracing(city, model_name, horizon) as trace:
+        result, headers = _build_prediction(city, model_name, forecast_type, hours_to_predict, day_of_week,
+                                            prophet_extended, include_bounds, response_format)
+    return result, headers, trace
+
+def _build_prediction(city, model_name, forecast_type, hours_to_predict, day_of_week, prophet_extended, include_bounds, response_format):
+    headers = {}
+    # Served from the forecast cache; shorter horizons are slices of the cached 2-week forecast
+    df_predictions = get_forecast(
+        city,
+        model_name,
+        hours_to_predict,
+        include_bounds=include_bounds,
+        prophet_extended=prophet_extended
+    )
 
-        df_predictions[TIMESTAMP_COL] = df_predictions[TIMESTAMP_COL].dt.strftime('%Y-%m-%d %H:%M:%S')
+    if df_predictions.empty:
+        raise HTTPException(status_code=500, detail="Prediction generation failed or returned empty results.")
 
-        if forecast_type in ["1week", "2weeks"] and day_of_week is not None:
+    if "ensemble_members" in df_predictions.attrs:
+        # e.g. "LightGBM=ok:0.41s, Prophet=timeout:60.00s"
+        headers["X-Ensemble-Members"] = ", ".join(
+            f"{m['model']}={m['status']}" + (f":{m['seconds']:.2f}s" if m["seconds"] is not None else "")
+            for m in df_predictions.attrs["ensemble_members"]
+        )
+
+    if forecast_type in ["1week", "2weeks"] and day_of_week is not None:
+        with telemetry.span("postprocess"):
             df_predictions = filter_by_day(df_predictions, day_of_week)
-            if df_predictions.empty:
-                print(f"Warning: No predictions found for day_of_week={day_of_week} within the forecast period.")
-                return []
+        if df_predictions.empty:
+            logger.warning("No predictions found for day_of_week=%s within the forecast period.", day_of_week)
+
+    if response_format == "ndjson":
+        # Rows are formatted lazily while the response streams
+        return df_predictions, headers
+    with telemetry.span("serialize"):
+        if response_format in BINARY_ENCODERS:
+            encode_forecast, _ = BINARY_ENCODERS[response_format]
+            return encode_forecast(df_predictions), headers
+        return format_records(df_predictions), headers
+
+class PredictionQuery(BaseModel):
+    city: str
+    model_name: str
+    forecast_type: str
+    day_of_week: Optional[int] = None
+    prophet_extended: Optional[str] = None
+    include_bounds: bool = False
+
+class BatchPredictionRequest(BaseModel):
+    queries: List[PredictionQuery]
+
+@app.post("/predict/batch")
+async def post_batch_prediction(request: BatchPredictionRequest):
+    """Answer many /predict queries with one planned computation.
+
+    Results come back in query order, each with its own status: invalid or
+    failing queries do not fail the batch.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="At least one query is required.")
+    if len(request.queries) > PREDICT_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"Too many queries. At most {PREDICT_BATCH_MAX_QUERIES} per batch.")
+
+    results = [None] * len(request.queries)
+    valid = []  # (position, query fields, hours to predict)
+    for position, query in enumerate(request.queries):
+        fields = query.model_dump()
+        try:
+            valid.append((position, fields, validate_prediction_query(**fields)))
+        except HTTPException as e:
+            results[position] = {"query": fields, "status": e.status_code, "error": e.detail}
+
+    labels = ("batch", "batch", "batch")
+    start = time.perf_counter()
+    status = 200
+    try:
+        if valid:
+            computed, trace = await predict_executor.run(build_batch_prediction, valid, timeout=PREDICT_TIMEOUT_SECONDS)
+            telemetry.record(trace)
+            for (position, _, _), result in zip(valid, computed):
+                results[position] = result
+        return {"results": results}
 
-        result = df_predictions.round(2).to_dict(orient='records')
+    except QueueFullError as e:
+        status = 503
+        logger.warning("Rejected batch: %s", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": PREDICT_RETRY_AFTER_SECONDS})
+    except DeadlineExceeded as e:
+        status = 504
+        logger.warning("Error: %s", e)
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        status = 500
+        logger.exception("Unexpected Error: %s", e)
+        raise HTTPException(status_code=500, detail=f"An internal server error occurred: {str(e)}")
+    finally:
+        telemetry.observe_request(labels, status, time.perf_counter() - start)
+
+def build_batch_prediction(queries):
+    """Compute the /predict/batch results for validated queries (runs on the prediction executor).
+
+    ``queries`` holds ``(position, query fields, hours to predict)``. Every
+    plain query is served from one 2-week forecast per (city, model): those
+    are planned together by ``get_base_forecasts``, so each history and
+    model is loaded once and an Ensemble reuses member forecasts of the same
+    batch. Prophet queries with extended periods or bounds take the
+    single-query path.
+    """
+    with telemetry.tracing("batch", "batch", "batch") as trace:
+        plain = {(q["city"], q["model_name"]) for _, q, _ in queries
+                 if not q["prophet_extended"] and not q["include_bounds"]}
+        with telemetry.span("batch_plan"):
+            base_forecasts = get_base_forecasts(sorted(plain))
+        results = [_batch_result(query, hours, base_forecasts) for _, query, hours in queries]
+    return results, trace
+
+def _batch_result(query, hours_to_predict, base_forecasts):
+    try:
+        if query["prophet_extended"] or query["include_bounds"]:
+            df_predictions = get_forecast(query["city"], query["model_name"], hours_to_predict,
+                                          include_bounds=query["include_bounds"], prophet_extended=query["prophet_extended"])
+        else:
+            base = base_forecasts[(query["city"], query["model_name"])]
+            if isinstance(base, Exception):
+                raise base
+            df_predictions = base.head(hours_to_predict).copy()
+        if df_predictions.empty:
+            return {"query": query, "status": 500, "error": "Prediction generation failed or returned empty results."}
+
+        result = {"query": query, "status": 200}
+        if "ensemble_members" in df_predictions.attrs:
+            result["ensemble_members"] = df_predictions.attrs["ensemble_members"]
+        if query["forecast_type"] in ["1week", "2weeks"] and query["day_of_week"] is not None:
+            with telemetry.span("postprocess"):
+                df_predictions = filter_by_day(df_predictions, query["day_of_week"])
+        with telemetry.span("serialize"):
+            result["predictions"] = format_records(df_predictions)
         return result
 
+    except DeadlineExceeded:
+        raise
     except FileNotFoundError as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=404, detail=str(e))
+        logger.warning("Error: %s", e)
+        return {"query": query, "status": 404, "error": str(e)}
     except ValueError as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+        logger.error("Error: %s", e)
+        return {"query": query, "status": 500, "error": f"Prediction error: {str(e)}"}
     except Exception as e:
-        print(f"Unexpected Error: {e}")
-        raise HTTPException(status_code=500, detail=f"An internal server error occurred: {str(e)}")
+        logger.exception("Unexpected Error: %s", e)
+        return {"query": query, "status": 500, "error": f"An internal server error occurred: {str(e)}"}
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Weather Forecast API!"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Latency histograms and cache counters in Prometheus text format."""
+    stats = {
+        "model_registry": model_registry.stats(),
+        "forecast_cache": forecast_cache.stats(),
+        "history_store": history_store.stats(),
+        "predict_coalescing": predict_flights.stats(),
+    }
+    gauges = {
+        f"weather_{component}_{name}": (f"{component} {name} (see /stats).", value)
+        for component, component_stats in stats.items()
+        for name, value in component_stats.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+    gauges["weather_profiles_written"] = ("Slow-request profiles written by the sampling profiler.", telemetry.profiler.profiles_written)
+    return PlainTextResponse(telemetry.render_prometheus(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats")
+async def get_stats():
+    """Runtime cache statistics for the prediction path."""
+    return {
+        "model_registry": model_registry.stats(),
+        "forecast_cache": forecast_cache.stats(),
+        "history_store": history_store.stats(),
+        "predict_executor": predict_executor.stats(),
+        "predict_coalescing": predict_flights.stats(),
+        "metrics_index": {evaluation: index.stats() for evaluation, index in metrics_indexes.items()},
+    }
+
+# /model-metrics has no row stream, so NDJSON is not offered there
+METRICS_RESPONSE_FORMATS = {name: RESPONSE_FORMATS[name] for name in ("json", "columnar", "arrow")}
+
+# Cities whose Ensemble holdout predictions are being regenerated in the background
+_ensemble_regenerations = set()
+_ensemble_regenerations_lock = threading.Lock()
+
+def _regenerate_ensemble_metrics(city):
+    try:
+        evaluate_ensemble(city)
+        logger.info("Regenerated Ensemble metrics for %s", city)
+    except Exception as e:
+        logger.error("Error regenerating Ensemble metrics for %s: %s", city, e)
+    finally:
+        with _ensemble_regenerations_lock:
+            _ensemble_regenerations.discard(city)
+
+def update_ensemble_metrics(city):
+    """Bring the stored Ensemble holdout metrics up to date with the members' saved predictions.
+
+    Scoring the saved arrays takes milliseconds and is done inline whenever a
+    member's predictions are newer than the stored Ensemble metrics. Members
+    with no predictions from their current model are predicted by a
+    background thread (one per city at a time). Returns True while that
+    regeneration is needed, i.e. the metrics may still be missing members.
+    """
+    stale = stale_holdout_members(city)
+    if stale:
+        with _ensemble_regenerations_lock:
+            start = city not in _ensemble_regenerations
+            _ensemble_regenerations.add(city)
+        if start:
+            logger.info("Regenerating holdout predictions of %s for %s in the background...", ", ".join(stale), city)
+            threading.Thread(target=_regenerate_ensemble_metrics, args=(city,), daemon=True).start()
+
+    metrics_file = metrics_path(city, "Ensemble")
+    saved_at = os.path.getmtime(metrics_file) if os.path.exists(metrics_file) else None
+    newest_member = max(
+        (os.path.getmtime(path) for path in (holdout_predictions_path(city, name) for name in BASE_MODEL_NAMES)
+         if os.path.exists(path)),
+        default=None,
+    )
+    if newest_member is not None and (saved_at is None or newest_member > saved_at):
+        metrics = ensemble_holdout_metrics(city)
+        if metrics is not None:
+            save_model_metrics(city, "Ensemble", metrics)
+            metrics_indexes["holdout"].refresh(force=True)
+    return bool(stale)
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of If-None-Match against our ETag, as RFC 9110 prescribes for GET."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def encode_metrics(metrics, city, model_name, response_format):
+    if response_format == "json":
+        # Same encoding as FastAPI's JSONResponse
+        return json.dumps(metrics, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+    # Tabular formats always use the {city: {model: ...}} nesting
+    metrics_by_city = {city: {model_name: metrics}} if city and model_name else metrics
+    _, encode_table = BINARY_ENCODERS[response_format]
+    return encode_table(flatten_metrics(metrics_by_city))
+
 @app.get("/model-metrics")
 async def get_model_metrics(
     city: Optional[str] = Query(None, description="City name (e.g., ahmedabad). If not provided, returns metrics for all cities."),
-    model_name: Optional[str] = Query(None, description="Model name. If not provided, returns metrics for all models.")
+    model_name: Optional[str] = Query(None, description="Model name. If not provided, returns metrics for all models."),
+    format: Optional[str] = Query(None, description="Response format: 'json' (default, nested), 'columnar' or 'arrow' (one row per city/model/feature). Also selectable via the Accept header."),
+    evaluation: str = Query("holdout", description="'holdout' (one-step-ahead test split, default) or 'backtest' (rolling-origin multi-step forecasts, with error by horizon hour)."),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
 ):
-    allowed_cities = ["ahmedabad", "mumbai", "delhi", "bengaluru"]
-    allowed_models = BASE_MODEL_NAMES + ["Ensemble"]
+    allowed_cities = ALLOWED_CITIES
+    allowed_models = ALL_MODEL_NAMES + ["Ensemble"]
     
     # Validate parameters if provided
     if city and city not in allowed_cities:
         raise HTTPException(status_code=400, detail=f"Invalid city. Allowed: {', '.join(allowed_cities)}")
     if model_name and model_name not in allowed_models:
         raise HTTPException(status_code=400, detail=f"Invalid model name. Allowed: {', '.join(allowed_models)}")
+    if evaluation not in METRICS_DIRS:
+        raise HTTPException(status_code=400, detail=f"Invalid evaluation. Allowed: {', '.join(METRICS_DIRS)}")
+    response_format = resolve_format(format, accept, METRICS_RESPONSE_FORMATS)
     
     try:
-        # Special handling for Ensemble model
-        if city and model_name == "Ensemble":
-            metrics_file = os.path.join(os.path.dirname(__file__), 'metrics', f"{city}_Ensemble_metrics.json")
-            
-            # If metrics don't exist, generate them
-            if not os.path.exists(metrics_file):
-                print(f"Generating Ensemble metrics for {city}...")
-                metrics = evaluate_ensemble(city)
-                return metrics
-            
-            # Load existing metrics
-            metrics = load_model_metrics(city, "Ensemble")
-            if not metrics:
-                print(f"Regenerating Ensemble metrics for {city}...")
-                metrics = evaluate_ensemble(city)
-            return metrics
-            
-        # If both city and model are specified, return specific metrics
-        if city and model_name:
-            metrics = load_model_metrics(city, model_name)
-            if not metrics:
-                raise HTTPException(status_code=404, detail=f"No metrics found for {model_name} in {city}")
-            return metrics
-        
-        # Otherwise return all metrics or filtered metrics
-        all_metrics = get_all_metrics()
-        
-        # Filter by city if provided
-        if city:
-            if city not in all_metrics:
-                return {}
-            return {city: all_metrics[city]}
-        
-        # Filter by model if provided
-        if model_name:
-            filtered_metrics = {}
-            for city_name, models in all_metrics.items():
-                if model_name in models:
-                    if city_name not in filtered_metrics:
-                        filtered_metrics[city_name] = {}
-                    filtered_metrics[city_name][model_name] = models[model_name]
-            return filtered_metrics
-        
-        # Return all metrics if no filters
-        return all_metrics
+        regenerating = False
+        if city and model_name == "Ensemble" and evaluation == "holdout":
+            # Reads and writes metrics files, so keep it off the event loop
+            regenerating = await run_in_threadpool(update_ensemble_metrics, city)
+        index = metrics_indexes[evaluation]
+        metrics, etag = index.select(city, model_name)
+        if metrics is None and regenerating:
+            raise HTTPException(
+                status_code=503,
+                detail=f"Ensemble metrics for {city} are being generated; retry shortly.",
+                headers={"Retry-After": PREDICT_RETRY_AFTER_SECONDS},
+            )
+        if metrics is None:
+            raise HTTPException(status_code=404, detail=f"No {evaluation} metrics found for {model_name} in {city}")
+
+        etag = f'"{etag}-{response_format}"'
+        headers = {"ETag": etag, "Cache-Control": METRICS_CACHE_CONTROL, "Vary": "Accept"}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        body = index.encoded(etag, lambda: encode_metrics(metrics, city, model_name, response_format))
+        return Response(content=body, media_type=RESPONSE_FORMATS[response_format], headers=headers)
         
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error retrieving model metrics: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error retrieving model metrics: {str(e)}")
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import joblib
+from app.ml.registry import MODELS_DIR, model_registry
+from app.ml.flat_forest import save_forest, MMAP_MODELS_ON_PUBLISH
+
+# Every published model is kept as models/versions/<city>_<model>.v<N>.pkl;
+# the live <city>_<model>.pkl is a hard link to the active version
+VERSIONS_DIR = os.path.join(MODELS_DIR, 'versions')
+MODEL_KEEP_VERSIONS = int(os.getenv("MODEL_KEEP_VERSIONS", "3"))
+
+
+def meta_path(city_name, model_name):
+    return os.path.join(MODELS_DIR, f"{city_name}_{model_name}.meta.json")
+
+
+def version_path(city_name, model_name, version):
+    return os.path.join(VERSIONS_DIR, f"{city_name}_{model_name}.v{version}.pkl")
+
+
+def load_model_meta(city_name, model_name):
+    """Metadata of the live model (version, trained_through, ...), or None if unknown."""
+    try:
+        with open(meta_path(city_name, model_name)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def _swap_live_model(city_name, model_name, artifact):
+    """Point the live .pkl at ``artifact`` in one os.replace.
+
+    The server's model registry sees the new file on its next lookup; a reader
+    never observes a partially written model.
+    """
+    live_path = model_registry.model_path(city_name, model_name)
+    tmp_path = f"{live_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(artifact, tmp_path)
+    except OSError:
+        # Filesystems without hard links get a copy instead
+        with open(artifact, "rb") as src, open(tmp_path, "wb") as dst:
+            while chunk := src.read(1024 * 1024):
+                dst.write(chunk)
+    os.replace(tmp_path, live_path)
+
+
+def publish_model(model, city_name, model_name, **meta):
+    """Save ``model`` as a new version and make it the live model.
+
+    ``meta`` (e.g. ``trained_through``, ``kind``) is stored alongside the
+    version number. Returns the new version number.
+    """
+    os.makedirs(VERSIONS_DIR, exist_ok=True)
+    previous = load_model_meta(city_name, model_name) or {}
+    version = max([previous.get("version", 0)] + list_versions(city_name, model_name)) + 1
+    artifact = version_path(city_name, model_name, version)
+    tmp_path = f"{artifact}.{os.getpid()}.tmp"
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, artifact)
+    _write_json(f"{artifact[:-len('.pkl')]}.meta.json", {**meta, "version": version})
+    if MMAP_MODELS_ON_PUBLISH:
+        # Written before the swap and keyed to the version file the live .pkl will link to,
+        # so the server's first load of the new model already memory-maps it
+        save_forest(model, model_registry.model_path(city_name, model_name), source_path=artifact)
+
+    _swap_live_model(city_name, model_name, artifact)
+    _write_json(meta_path(city_name, model_name), {**meta, "version": version, "published_at": time.time()})
+    prune_versions(city_name, model_name)
+    return version
+
+
+def list_versions(city_name, model_name):
+    """Version numbers stored for a city/model, oldest first."""
+    prefix = f"{city_name}_{model_name}.v"
+    versions = []
+    if os.path.isdir(VERSIONS_DIR):
+        for filename in os.listdir(VERSIONS_DIR):
+            if filename.startswith(prefix) and filename.endswith(".pkl"):
+                number = filename[len(prefix):-len(".pkl")]
+                if number.isdigit():
+                    versions.append(int(number))
+    return sorted(versions)
+
+
+def activate_version(city_name, model_name, version):
+    """Switch the live model back (or forward) to a stored version."""
+    artifact = version_path(city_name, model_name, version)
+    if not os.path.exists(artifact):
+        raise FileNotFoundError(f"Model version not found: {artifact}")
+    try:
+        with open(f"{artifact[:-len('.pkl')]}.meta.json") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        meta = {"version": version}
+    _swap_live_model(city_name, model_name, artifact)
+    _write_json(meta_path(city_name, model_name), {**meta, "published_at": time.time()})
+    print(f"✅ {city_name} {model_name} now serves version {version}")
+
+
+def prune_versions(city_name, model_name, keep=MODEL_KEEP_VERSIONS):
+    active = (load_model_meta(city_name, model_name) or {}).get("version")
+    versions = list_versions(city_name, model_name)
+    for version in versions[:-keep] if keep > 0 else []:
+        if version == active:
+            continue
+        artifact = version_path(city_name, model_name, version)
+        for path in (artifact, f"{artifact[:-len('.pkl')]}.meta.json"):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,296 @@
+import os
+import json
+import time
+import argparse
+from functools import partial
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from app.utils.preprocess import load_data, prepare_data_for_training, TARGET_FEATURES, LAG_FEATURES
+from app.ml.ensemble import BASE_MODEL_NAMES, ALL_MODEL_NAMES
+from app.ml.registry import model_registry, MODELS_DIR
+from app.ml.forecaster import BatchRecursiveForecaster, clip_predictions, EPOCH, HOUR
+from app.ml.predict import is_prophet_model, _prophet_forecast_arrays
+from app.ml.evaluate import calculate_metrics, metrics_path, BACKTEST_METRICS_DIR
+from app.ml.train_models import CITIES, build_model
+from app.ml.train_scheduler import run_training_jobs, TRAIN_CPU_BUDGET, TRAIN_MAX_PARALLEL_JOBS
+import warnings
+
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+# Hours forecast from every origin (the longest forecast the API serves by default)
+BACKTEST_HORIZON_HOURS = int(os.getenv("BACKTEST_HORIZON_HOURS", "336"))
+# Number of forecast origins and the spacing between them; the defaults cover
+# the last year of history with one origin per week
+BACKTEST_ORIGINS = int(os.getenv("BACKTEST_ORIGINS", "52"))
+BACKTEST_STRIDE_HOURS = int(os.getenv("BACKTEST_STRIDE_HOURS", "168"))
+# Progress of the current backtest run, used to resume after a crash
+BACKTEST_STATE_FILE = os.path.join(MODELS_DIR, '.backtest_state.json')
+# Horizons shown in the printed summary (all horizons are stored)
+SUMMARY_HORIZONS = [1, 6, 12, 24, 48, 168, 336]
+
+
+def backtest_origins(n_rows, horizon, n_origins, stride, min_history):
+    """Row positions of the forecast origins, oldest first.
+
+    The last origin is the last row with ``horizon`` observed hours after it;
+    the others step back ``stride`` hours each. Origins with fewer than
+    ``min_history`` rows up to and including them are dropped.
+    """
+    last = n_rows - 1 - horizon
+    origins = last - stride * np.arange(n_origins)[::-1]
+    return origins[origins >= min_history - 1]
+
+
+def origin_windows(values, origins, size):
+    """The ``size`` rows ending at each origin, as (n_origins, size, n_targets), without copying the history."""
+    windows = sliding_window_view(values, size, axis=0)  # (n_rows - size + 1, n_targets, size)
+    return windows[origins - size + 1].transpose(0, 2, 1)
+
+
+def observed_targets(values, epoch_hours, origins, horizon):
+    """Observed values for hours 1..horizon after each origin, NaN where an hour is missing."""
+    targets = epoch_hours[origins][:, None] + np.arange(1, horizon + 1)
+    positions = np.minimum(np.searchsorted(epoch_hours, targets), len(epoch_hours) - 1)
+    actual = values[positions]
+    actual[epoch_hours[positions] != targets] = np.nan
+    return actual
+
+
+def forecast_origins(model, values, timestamps, epoch_hours, origins, horizon, lag_features=LAG_FEATURES):
+    """(n_origins, horizon, n_targets) forecasts, each made from the history up to its origin.
+
+    Lag-feature models advance every origin in lock-step through the batched
+    recursive forecaster: one ``predict`` over n_origins rows per hour. Prophet
+    depends only on the timestamp, so every distinct target hour is predicted once.
+    """
+    if is_prophet_model(model):
+        targets = epoch_hours[origins][:, None] + np.arange(1, horizon + 1)
+        hours, inverse = np.unique(targets, return_inverse=True)
+        columns = _prophet_forecast_arrays(model, EPOCH + pd.to_timedelta(hours, unit='h'), include_bounds=False)
+        predictions = np.column_stack([columns[feature] for feature in TARGET_FEATURES])
+        return clip_predictions(predictions[inverse.reshape(targets.shape)])
+
+    forecaster = BatchRecursiveForecaster.from_windows(
+        model, origin_windows(values, origins, lag_features + 1), timestamps[origins], lag_features=lag_features,
+    )
+    return np.stack(forecaster.forecast_arrays(horizon)).astype(np.float64)
+
+
+def horizon_metrics(actual, predictions):
+    """Per-feature error at each horizon hour, averaged over the origins."""
+    errors = predictions - actual
+    by_horizon = {"hours": list(range(1, actual.shape[1] + 1))}
+    for i, feature in enumerate(TARGET_FEATURES):
+        feature_errors = errors[:, :, i]
+        by_horizon[feature] = {
+            "mae": np.nanmean(np.abs(feature_errors), axis=0),
+            "rmse": np.sqrt(np.nanmean(feature_errors ** 2, axis=0)),
+            "bias": np.nanmean(feature_errors, axis=0),
+        }
+    return by_horizon
+
+
+def _to_builtin(value):
+    if isinstance(value, dict):
+        return {key: _to_builtin(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_to_builtin(item) for item in value]
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+def backtest_report(actual, predictions, **config):
+    """Backtest metrics in the layout of the holdout metrics files.
+
+    The per-feature and ``overall`` entries pool every (origin, hour) pair;
+    ``by_horizon`` holds the error curves and ``backtest`` the run's settings.
+    """
+    flat_actual = actual.reshape(-1, len(TARGET_FEATURES))
+    flat_predictions = predictions.reshape(-1, len(TARGET_FEATURES))
+    observed = ~np.isnan(flat_actual).any(axis=1)
+    report = calculate_metrics(flat_actual[observed], flat_predictions[observed])
+    report["by_horizon"] = horizon_metrics(actual, predictions)
+    report["backtest"] = {**config, "scored_hours": int(observed.sum()), "created_at": time.time()}
+    return _to_builtin(report)
+
+
+def predictions_path(city, model_name):
+    return os.path.join(BACKTEST_METRICS_DIR, f"{city}_{model_name}_backtest.npz")
+
+
+def save_backtest(city, model_name, report, origins=None, actual=None, predictions=None):
+    """Write the metrics JSON (and the raw forecasts, used for the ensemble) atomically."""
+    os.makedirs(BACKTEST_METRICS_DIR, exist_ok=True)
+    if predictions is not None:
+        path = predictions_path(city, model_name)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, origins=origins, actual=actual, predictions=predictions)
+        os.replace(tmp_path, path)
+    path = metrics_path(city, model_name, "backtest")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f, indent=4)
+    os.replace(tmp_path, path)
+    return path
+
+
+def backtest_city_model(city, model_name, n_jobs=None, horizon=BACKTEST_HORIZON_HOURS,
+                        n_origins=BACKTEST_ORIGINS, stride=BACKTEST_STRIDE_HOURS, live_model=False):
+    """Backtest one model on one city and save the results.
+
+    By default the model is trained (with the production settings) on the
+    history before the first origin only, so no origin is scored by a model
+    that has seen the hours it forecasts. ``live_model=True`` scores the
+    deployed model instead; it is faster but in-sample for most origins.
+    Returns ``{"action": ..., "error": ..., "mae": ...}``.
+    """
+    try:
+        df = load_data(city)
+    except FileNotFoundError as e:
+        print(f"❌ Error loading data for {city}: {e}")
+        return {"action": "skipped", "error": str(e)}
+    values = df[TARGET_FEATURES].to_numpy(dtype=np.float64)
+    timestamps = df.index
+    epoch_hours = ((timestamps - EPOCH) // HOUR).to_numpy(dtype=np.int64)
+
+    min_history = LAG_FEATURES + 1 if live_model else max(LAG_FEATURES + 1, 24 * 30)
+    origins = backtest_origins(len(df), horizon, n_origins, stride, min_history)
+    if len(origins) == 0:
+        message = f"not enough history for a {horizon}h backtest"
+        print(f"⚠️ {city}: {message}")
+        return {"action": "skipped", "error": message}
+    first_origin = timestamps[origins[0]]
+
+    try:
+        if live_model:
+            model = model_registry.get(city, model_name)
+        else:
+            X, y = prepare_data_for_training(city, lag_features=LAG_FEATURES)
+            train_rows = X.index <= first_origin
+            print(f"Training {model_name} for {city} on {train_rows.sum()} rows up to {first_origin}...")
+            model = build_model(model_name, n_jobs=n_jobs).fit(X[train_rows], y[train_rows])
+            del X, y
+
+        print(f"Backtesting {model_name} for {city}: {len(origins)} origins x {horizon}h...")
+        predictions = forecast_origins(model, values, timestamps, epoch_hours, origins, horizon)
+    except Exception as e:
+        print(f"❌ Error backtesting {model_name} for {city}: {e}")
+        return {"action": "failed", "error": str(e)}
+
+    actual = observed_targets(values, epoch_hours, origins, horizon)
+    report = backtest_report(
+        actual, predictions,
+        origins=len(origins), horizon_hours=horizon, stride_hours=stride,
+        first_origin=str(first_origin), last_origin=str(timestamps[origins[-1]]),
+        trained_through=None if live_model else str(first_origin), live_model=live_model,
+    )
+    path = save_backtest(city, model_name, report, epoch_hours[origins], actual, predictions)
+    print(f"✅ Saved backtest metrics to {path} (overall MAE {report['overall']['mae']:.3f})")
+    return {"action": "backtested", "error": None, "mae": report["overall"]["mae"]}
+
+
+def _backtest_job(city, model_name, n_jobs, **options):
+    return backtest_city_model(city, model_name, n_jobs=n_jobs, **options)
+
+
+def backtest_ensemble(city, model_names=BASE_MODEL_NAMES):
+    """Score the average of the members' saved backtest forecasts, like the live ensemble.
+
+    Only members backtested with the same origins and horizon are averaged.
+    """
+    members = {}
+    for model_name in model_names:
+        path = predictions_path(city, model_name)
+        if os.path.exists(path):
+            with np.load(path) as stored:
+                members[model_name] = {key: stored[key] for key in stored.files}
+    if not members:
+        return None
+
+    # Use the origin set of the most recently backtested member
+    latest = max(members, key=lambda name: os.path.getmtime(predictions_path(city, name)))
+    reference = members[latest]
+    used = [
+        name for name, member in members.items()
+        if np.array_equal(member["origins"], reference["origins"])
+        and member["predictions"].shape == reference["predictions"].shape
+    ]
+    predictions = np.mean([members[name]["predictions"] for name in used], axis=0)
+    member_config = load_backtest_config(city, latest)
+    report = backtest_report(reference["actual"], predictions, **{**member_config, "members": used})
+    path = save_backtest(city, "Ensemble", report)
+    print(f"✅ Saved Ensemble backtest metrics for {city} ({len(used)} members) to {path}")
+    return report
+
+
+def load_backtest_config(city, model_name):
+    try:
+        with open(metrics_path(city, model_name, "backtest")) as f:
+            config = json.load(f).get("backtest", {})
+    except (FileNotFoundError, ValueError):
+        return {}
+    return {key: value for key, value in config.items() if key not in ("scored_hours", "created_at")}
+
+
+def print_backtest_summary(city, model_name, report):
+    horizons = report["by_horizon"]["hours"]
+    shown = [h for h in SUMMARY_HORIZONS if h <= len(horizons)]
+    print(f"\n{city} {model_name}: MAE by horizon hour")
+    print(f"{'feature':<22}" + "".join(f"{f'+{h}h':>9}" for h in shown))
+    for feature in TARGET_FEATURES:
+        mae = report["by_horizon"][feature]["mae"]
+        print(f"{feature:<22}" + "".join(f"{'' if mae[h - 1] is None else f'{mae[h - 1]:.2f}':>9}" for h in shown))
+
+
+def backtest_all_models(cities=CITIES, model_names=ALL_MODEL_NAMES, horizon=BACKTEST_HORIZON_HOURS,
+                        n_origins=BACKTEST_ORIGINS, stride=BACKTEST_STRIDE_HOURS, live_model=False,
+                        cpu_budget=TRAIN_CPU_BUDGET, max_parallel_jobs=TRAIN_MAX_PARALLEL_JOBS, resume=True):
+    """Backtest every city x model pair through the training scheduler, then the ensembles."""
+    jobs = [(city, model_name) for city in cities for model_name in model_names]
+    report = run_training_jobs(
+        partial(_backtest_job, horizon=horizon, n_origins=n_origins, stride=stride, live_model=live_model),
+        jobs,
+        BACKTEST_STATE_FILE,
+        cpu_budget=cpu_budget,
+        max_parallel_jobs=max_parallel_jobs,
+        resume=resume,
+    )
+    for city in cities:
+        backtest_ensemble(city)
+        for model_name in list(model_names) + ["Ensemble"]:
+            path = metrics_path(city, model_name, "backtest")
+            if os.path.exists(path):
+                with open(path) as f:
+                    print_backtest_summary(city, model_name, json.load(f))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rolling-origin backtest of the recursive multi-step forecasts.")
+    parser.add_argument("--cities", default=",".join(CITIES))
+    parser.add_argument("--models", default=",".join(ALL_MODEL_NAMES))
+    parser.add_argument("--horizon", type=int, default=BACKTEST_HORIZON_HOURS, help="Hours forecast from each origin")
+    parser.add_argument("--origins", type=int, default=BACKTEST_ORIGINS, help="Number of forecast origins")
+    parser.add_argument("--stride", type=int, default=BACKTEST_STRIDE_HOURS, help="Hours between origins")
+    parser.add_argument("--live-models", action="store_true",
+                        help="Score the deployed models instead of training on the history before the first origin")
+    parser.add_argument("--cpu-budget", type=int, default=TRAIN_CPU_BUDGET)
+    parser.add_argument("--max-parallel-jobs", type=int, default=TRAIN_MAX_PARALLEL_JOBS)
+    parser.add_argument("--fresh", action="store_true", help="Ignore the state of an interrupted run")
+    args = parser.parse_args()
+
+    backtest_all_models(
+        args.cities.split(","),
+        args.models.split(","),
+        horizon=args.horizon,
+        n_origins=args.origins,
+        stride=args.stride,
+        live_model=args.live_models,
+        cpu_budget=args.cpu_budget,
+        max_parallel_jobs=args.max_parallel_jobs,
+        resume=not args.fresh,
+    )
@@ -1,33 +1,262 @@
 import pandas as pd
 import numpy as np
 import os
-from app.ml.predict import make_predictions, TARGET_FEATURES, TIMESTAMP_COL # Reuse prediction logic
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from app.ml.predict import make_predictions_with_prophet, load_model, is_prophet_model, TARGET_FEATURES, TIMESTAMP_COL # Reuse prediction logic
+from app.ml.forecaster import RecursiveForecaster, BatchRecursiveForecaster
+from app.utils.preprocess import load_data, LAG_FEATURES
+from app.utils.work_queue import check_deadline, remaining_time, deadline_scope, DeadlineExceeded
+from app.utils import telemetry
 
 # List of base models used for the ensemble
 BASE_MODEL_NAMES = ["LightGBM", "CatBoost", "ExtraTrees", "XGBoost", "HistGradientBoosting", "Prophet"]
+# Models served on their own but not averaged into the ensemble
+STANDALONE_MODEL_NAMES = ["Direct"]
+ALL_MODEL_NAMES = BASE_MODEL_NAMES + STANDALONE_MODEL_NAMES
 
-def predict_ensemble(city_name, hours_to_predict=48):
-    """Generates predictions from all base models and averages them."""
-    all_predictions = []
-    print(f"Starting ensemble prediction for {city_name} for {hours_to_predict} hours.")
+# Worker processes used to run ensemble members in parallel (0 = run them in the request process)
+ENSEMBLE_WORKERS = int(os.getenv("ENSEMBLE_WORKERS", "0"))
+# Members still running this many seconds after they started stop at their next
+# forecast step and are dropped from the ensemble
+ENSEMBLE_MEMBER_TIMEOUT_SECONDS = float(os.getenv("ENSEMBLE_MEMBER_TIMEOUT_SECONDS", "60"))
 
+_executor = None
+_executor_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+def _collect(predictions, city_name, model_name, df_pred):
+    if df_pred.empty:
+        logger.warning("Received empty predictions from %s for %s. Excluding from ensemble.", model_name, city_name)
+        return False
+    predictions[model_name] = df_pred
+    return True
+
+def _forecast_member(city_name, model_name, hours_to_predict, df_history):
+    """Forecast one ensemble member from an already loaded history window.
+
+    Runs inside the ensemble worker processes, which keep their own model registry warm.
+    """
+    start = time.perf_counter()
+    model = load_model(city_name, model_name)
+    if model_name == "Prophet" or is_prophet_model(model):
+        df_pred = make_predictions_with_prophet(model, city_name, hours_to_predict, df_history=df_history)
+    else:
+        df_pred = RecursiveForecaster(model, df_history, lag_features=LAG_FEATURES).forecast(hours_to_predict)
+    return df_pred, time.perf_counter() - start
+
+def _run_member(city_name, model_name, hours_to_predict, df_history, member_timeout, request_deadline):
+    """Forecast one member in a worker, stopping ``member_timeout`` seconds after it started.
+
+    The timeout counts from here rather than from submission, so members queued
+    behind busy workers keep their full budget. A member past it raises
+    DeadlineExceeded at its next forecast step, which frees the worker.
+    """
+    start = time.time()
+    with deadline_scope(request_deadline), deadline_scope(start + member_timeout):
+        # Don't start a member whose request already gave up while it was queued
+        check_deadline()
+        try:
+            return _forecast_member(city_name, model_name, hours_to_predict, df_history)
+        except DeadlineExceeded:
+            raise DeadlineExceeded(f"Stopped after {time.time() - start:.2f}s")
+
+def _init_worker(threads):
+    # Split the cores between workers so parallel members don't oversubscribe OpenMP
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: forking a threaded server process is unsafe with OpenMP-backed model libraries
+            threads = max(1, (os.cpu_count() or 1) // ENSEMBLE_WORKERS)
+            _executor = ProcessPoolExecutor(
+                max_workers=ENSEMBLE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(threads,),
+            )
+        return _executor
+
+def _reset_executor(executor):
+    """Retire ``executor``; the next ensemble starts a fresh pool (no-op if already replaced)."""
+    global _executor
+    with _executor_lock:
+        if _executor is not executor:
+            return
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+def _run_members_parallel(city_name, hours_to_predict, df_history, member_timeout):
+    """Fan the members out over the process pool; members running past their timeout are dropped."""
+    member_predictions, report = {}, []
+    pool_broken = False
+    executor = _get_executor()
+    request_remaining = remaining_time()
+    request_deadline = time.time() + request_remaining if request_remaining is not None else None
+    futures = {}
+    for model_name in BASE_MODEL_NAMES:
+        futures[executor.submit(_run_member, city_name, model_name, hours_to_predict, df_history,
+                                member_timeout, request_deadline)] = model_name
+
+    # Members stop themselves at their own timeout; only the request's deadline bounds the wait here
+    done, not_done = wait(futures, timeout=request_remaining)
+    for future, model_name in futures.items():
+        if future in not_done:
+            future.cancel()
+            logger.warning("%s for %s did not finish before the request deadline. Excluding from ensemble.", model_name, city_name)
+            report.append({"model": model_name, "status": "timeout", "seconds": None})
+            continue
+        try:
+            df_pred, seconds = future.result()
+        except DeadlineExceeded as e:
+            logger.warning("%s for %s did not finish within %ss. Excluding from ensemble.", model_name, city_name, member_timeout)
+            report.append({"model": model_name, "status": "timeout", "seconds": None, "error": str(e)})
+            continue
+        except FileNotFoundError:
+            logger.warning("Model file for %s in %s not found. Skipping.", model_name, city_name)
+            report.append({"model": model_name, "status": "missing", "seconds": None})
+            continue
+        except BrokenProcessPool as e:
+            pool_broken = True
+            logger.error("Ensemble worker pool failed while running %s for %s: %s", model_name, city_name, e)
+            report.append({"model": model_name, "status": "error", "seconds": None, "error": str(e)})
+            continue
+        except Exception as e:
+            logger.error("Error getting predictions from %s for %s: %s", model_name, city_name, e)
+            report.append({"model": model_name, "status": "error", "seconds": None, "error": str(e)})
+            continue
+        ok = _collect(member_predictions, city_name, model_name, df_pred)
+        report.append({"model": model_name, "status": "ok" if ok else "empty", "seconds": seconds})
+
+    if pool_broken or not_done:
+        # Members still running past the request deadline are stuck between deadline checks:
+        # later requests get a fresh pool instead of queueing behind them
+        _reset_executor(executor)
+    return member_predictions, report
+
+def _run_members_in_process(city_name, hours_to_predict, df_history, member_timeout):
+    """Run the members in this process: tree models in lock-step, then Prophet.
+
+    The lock-step batch and each remaining member get ``member_timeout``
+    seconds from when they start; one past it stops at its next forecast step
+    and is reported as a timeout. Only the request's own deadline aborts the run.
+    """
+    member_predictions, report = {}, []
+    tree_models = []
     for model_name in BASE_MODEL_NAMES:
         try:
-            print(f"Generating predictions using: {model_name}")
-            df_pred = make_predictions(city_name, model_name, hours_to_predict)
-            if not df_pred.empty:
-                df_pred.set_index(TIMESTAMP_COL, inplace=True)
-                all_predictions.append(df_pred)
-            else:
-                print(f"⚠️ Received empty predictions from {model_name} for {city_name}. Excluding from ensemble.")
+            model = load_model(city_name, model_name)
         except FileNotFoundError:
-            print(f"⚠️ Model file for {model_name} in {city_name} not found. Skipping.")
+            logger.warning("Model file for %s in %s not found. Skipping.", model_name, city_name)
+            report.append({"model": model_name, "status": "missing", "seconds": None})
+            continue
+        except Exception as e:
+            # e.g. a corrupt or unpicklable file: drop this member, not the whole ensemble
+            logger.error("Error loading %s for %s: %s", model_name, city_name, e)
+            report.append({"model": model_name, "status": "error", "seconds": None, "error": str(e)})
+            continue
+        if model_name == "Prophet" or is_prophet_model(model):
+            continue
+        tree_models.append((model_name, model))
+
+    if tree_models:
+        try:
+            logger.debug("Generating lock-step predictions using: %s", ", ".join(name for name, _ in tree_models))
+            start = time.perf_counter()
+            with deadline_scope(time.time() + member_timeout):
+                forecaster = BatchRecursiveForecaster([(model, df_history) for _, model in tree_models], lag_features=LAG_FEATURES)
+                batch = forecaster.forecast(hours_to_predict)
+            seconds = time.perf_counter() - start
+            for (model_name, _), df_pred in zip(tree_models, batch):
+                ok = _collect(member_predictions, city_name, model_name, df_pred)
+                # Lock-step members share one run, so each reports the batch time
+                report.append({"model": model_name, "status": "ok" if ok else "empty", "seconds": seconds})
+        except DeadlineExceeded as e:
+            # Outside the member scope this only raises if the request itself is out of time
+            check_deadline()
+            logger.warning("Lock-step members for %s did not finish within %ss. Excluding them from ensemble.", city_name, member_timeout)
+            for model_name, _ in tree_models:
+                report.append({"model": model_name, "status": "timeout", "seconds": None, "error": str(e)})
+        except Exception as e:
+            # Fall back to one model at a time so a single failing member is skipped
+            logger.error("Batch prediction failed for %s (%s). Retrying members individually.", city_name, e)
+
+    # Prophet, plus any tree model left over from a failed batch
+    pending = [m for m in BASE_MODEL_NAMES if m not in member_predictions
+               and not any(r["model"] == m for r in report)]
+    for model_name in pending:
+        check_deadline()
+        try:
+            logger.debug("Generating predictions using: %s", model_name)
+            with deadline_scope(time.time() + member_timeout):
+                df_pred, seconds = _forecast_member(city_name, model_name, hours_to_predict, df_history)
+            ok = _collect(member_predictions, city_name, model_name, df_pred)
+            report.append({"model": model_name, "status": "ok" if ok else "empty", "seconds": seconds})
+        except DeadlineExceeded as e:
+            check_deadline()
+            logger.warning("%s for %s did not finish within %ss. Excluding from ensemble.", model_name, city_name, member_timeout)
+            report.append({"model": model_name, "status": "timeout", "seconds": None, "error": str(e)})
         except Exception as e:
-            print(f"❌ Error getting predictions from {model_name} for {city_name}: {e}")
+            logger.error("Error getting predictions from %s for %s: %s", model_name, city_name, e)
+            report.append({"model": model_name, "status": "error", "seconds": None, "error": str(e)})
+    return member_predictions, report
+
+def predict_ensemble(city_name, hours_to_predict=48, member_timeout=None):
+    """Generates predictions from all base models and averages them.
+
+    The city history is loaded once and shared by every member. With
+    ENSEMBLE_WORKERS > 0 the members run in parallel worker processes,
+    otherwise in this process. Either way, any member not finished
+    ``member_timeout`` seconds after it started is left out (it stops at its
+    next forecast step). The returned frame's ``attrs["ensemble_members"]``
+    lists each member's status and run time.
+    """
+    logger.debug("Starting ensemble prediction for %s for %d hours.", city_name, hours_to_predict)
+    if member_timeout is None:
+        member_timeout = ENSEMBLE_MEMBER_TIMEOUT_SECONDS
+
+    with telemetry.span("history_load"):
+        df_history = load_data(city_name, tail=LAG_FEATURES + 1)
+    if df_history.empty:
+        raise ValueError(f"No historical data found for {city_name} to make predictions.")
 
-    if not all_predictions:
+    if ENSEMBLE_WORKERS > 0:
+        member_predictions, report = _run_members_parallel(city_name, hours_to_predict, df_history, member_timeout)
+    else:
+        member_predictions, report = _run_members_in_process(city_name, hours_to_predict, df_history, member_timeout)
+    report.sort(key=lambda r: BASE_MODEL_NAMES.index(r["model"]))
+    trace = telemetry.current_trace()
+    if trace is not None:
+        # Members may run in worker processes; their own run times are what the report holds
+        for r in report:
+            if r["seconds"] is not None:
+                trace.add(f"member:{r['model']}", r["seconds"])
+
+    if not member_predictions:
         raise ValueError(f"No base model predictions could be generated for ensemble in {city_name}.")
 
+    with telemetry.span("postprocess"):
+        ensemble_df = average_member_predictions(member_predictions)
+    ensemble_df.attrs["ensemble_members"] = report
+    logger.debug("Finished ensemble prediction. Averaged %d models: %s", len(member_predictions),
+                 ", ".join(f"{r['model']}={r['status']}" for r in report))
+    return ensemble_df
+
+def average_member_predictions(member_predictions):
+    """Average member prediction frames (keyed by model name) per timestamp."""
+    # Average in BASE_MODEL_NAMES order regardless of which path produced each member
+    all_predictions = [
+        member_predictions[m].set_index(TIMESTAMP_COL)
+        for m in BASE_MODEL_NAMES if m in member_predictions
+    ]
+
     # Concatenate predictions along a new axis (axis=0 stacks rows, axis=1 stacks columns)
     # We want to average across models for the same timestamp and feature.
     # Use pd.concat and then groupby index (timestamp) and mean.
@@ -39,6 +268,4 @@ def predict_ensemble(city_name, hours_to_predict=48):
 
     # Ensure column order
     ensemble_df = ensemble_df[[TIMESTAMP_COL] + TARGET_FEATURES]
-
-    print(f"Finished ensemble prediction. Averaged {len(all_predictions)} models.")
-    return ensemble_df
\ No newline at end of file
+    return ensemble_df
@@ -3,14 +3,21 @@ import numpy as np
 import os
 import json
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
-from sklearn.model_selection import train_test_split
 from app.utils.preprocess import TARGET_FEATURES, prepare_data_for_training
 from app.ml.ensemble import BASE_MODEL_NAMES 
-import joblib
+from app.ml.registry import model_registry
 
-METRICS_DIR = os.path.join(os.path.dirname(__file__), '..', 'metrics')
-MODELS_DIR = os.path.join(os.path.dirname(__file__), '..', 'models')
+METRICS_DIR = os.getenv("WEATHER_METRICS_DIR", os.path.join(os.path.dirname(__file__), '..', 'metrics'))
 os.makedirs(METRICS_DIR, exist_ok=True)
+# Rolling-origin backtest results (app/ml/backtest.py) use the same file layout one level down
+BACKTEST_METRICS_DIR = os.path.join(METRICS_DIR, 'backtest')
+# Evaluation kind -> directory of its {city}_{model}_metrics.json files
+METRICS_DIRS = {"holdout": METRICS_DIR, "backtest": BACKTEST_METRICS_DIR}
+METRICS_SUFFIX = '_metrics.json'
+# Each evaluated model's predictions on the holdout rows, so ensembles are scored without re-predicting
+HOLDOUT_PREDICTIONS_DIR = os.path.join(METRICS_DIR, 'holdout')
+# Saved with the holdout predictions; files from another row selection are re-predicted
+HOLDOUT_SCHEME = "hour-hash-v1"
 
 def calculate_metrics(y_true, y_pred):
     """Calculate various error metrics between true and predicted values."""
@@ -55,10 +62,34 @@ def calculate_metrics(y_true, y_pred):
     
     return metrics
 
-def evaluate_model(model, X, y, test_size=0.2, random_state=42):
-    """Evaluate model performance using train-test split."""
-    # Split data into train and test sets
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
+def holdout_rows(timestamps, test_size=0.2, random_state=42):
+    """Row positions of the holdout hours among ``timestamps``.
+
+    A row is held out when a hash of its epoch hour (salted with
+    ``random_state``) falls in the lowest ``test_size`` fraction, so the
+    choice depends only on the hour itself: appending rows never reshuffles
+    the holdout, and models evaluated on different data sizes share every
+    holdout hour they both cover. Hashing keeps the sample spread over all
+    hours of day and seasons, like a random split.
+    """
+    hours = ((pd.DatetimeIndex(timestamps) - pd.Timestamp("1970-01-01")) // pd.Timedelta(hours=1)).to_numpy(dtype=np.int64)
+    # splitmix64 finalizer; uint64 arithmetic wraps around
+    h = hours.astype(np.uint64) + np.uint64(random_state)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    h = h ^ (h >> np.uint64(31))
+    buckets = 10000
+    return np.flatnonzero(h % np.uint64(buckets) < np.uint64(round(test_size * buckets)))
+
+def evaluate_model(model, X, y, test_size=0.2, random_state=42, city=None, model_name=None):
+    """Evaluate model performance on the holdout hours (see ``holdout_rows``).
+
+    With ``city`` and ``model_name`` the holdout predictions are saved as well
+    (see ``save_holdout_predictions``).
+    """
+    # Select the holdout hours
+    test_rows = holdout_rows(X.index, test_size=test_size, random_state=random_state)
+    X_test, y_test = X.iloc[test_rows], y.iloc[test_rows]
     
     # Make predictions
     y_pred = model.predict(X_test)
@@ -67,12 +98,112 @@ def evaluate_model(model, X, y, test_size=0.2, random_state=42):
     y_test_np = y_test.values if hasattr(y_test, 'values') else np.array(y_test)
     y_pred_np = np.array(y_pred)
     
+    if city and model_name:
+        save_holdout_predictions(city, model_name, X_test.index, y_test_np, y_pred_np)
+    
     # Calculate metrics
     return calculate_metrics(y_test_np, y_pred_np)
 
+def holdout_predictions_path(city, model_name):
+    return os.path.join(HOLDOUT_PREDICTIONS_DIR, f"{city}_{model_name}_holdout.npz")
+
+def save_holdout_predictions(city, model_name, timestamps, y_true, y_pred):
+    """Store a model's holdout predictions with the true values, sorted by hour."""
+    os.makedirs(HOLDOUT_PREDICTIONS_DIR, exist_ok=True)
+    path = holdout_predictions_path(city, model_name)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    hours = ((pd.DatetimeIndex(timestamps) - pd.Timestamp("1970-01-01")) // pd.Timedelta(hours=1)).to_numpy(dtype=np.int64)
+    order = np.argsort(hours, kind="stable")
+    np.savez(tmp_path, hours=hours[order], actual=np.asarray(y_true, dtype=np.float64)[order],
+             predictions=np.asarray(y_pred, dtype=np.float64)[order], scheme=np.array(HOLDOUT_SCHEME))
+    os.replace(tmp_path, path)
+    return path
+
+def load_holdout_predictions(city, model_name):
+    """Saved holdout arrays (hours, actual, predictions) of a model, or None."""
+    path = holdout_predictions_path(city, model_name)
+    try:
+        with np.load(path) as stored:
+            if not _current_scheme(stored):
+                return None
+            return {key: stored[key] for key in stored.files}
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+
+def _current_scheme(stored):
+    return "scheme" in stored.files and str(stored["scheme"]) == HOLDOUT_SCHEME
+
+# path -> ((mtime_ns, size), scheme is current); an archive's scheme only changes when it is rewritten
+_scheme_checks = {}
+
+def _holdout_current(path, stat):
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _scheme_checks.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    # Reads only the scheme entry of the archive
+    try:
+        with np.load(path) as stored:
+            current = _current_scheme(stored)
+    except (FileNotFoundError, ValueError, OSError):
+        return False
+    _scheme_checks[path] = (version, current)
+    return current
+
+def stale_holdout_members(city, model_names=BASE_MODEL_NAMES):
+    """Members with a trained model but no current holdout predictions from that model."""
+    stale = []
+    for model_name in model_names:
+        model_file = model_registry.model_path(city, model_name)
+        if not os.path.exists(model_file):
+            continue
+        path = holdout_predictions_path(city, model_name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stale.append(model_name)
+            continue
+        # The archive is opened for its scheme only once per version, and only if it is newer than the model
+        if stat.st_mtime < os.path.getmtime(model_file) or not _holdout_current(path, stat):
+            stale.append(model_name)
+    return stale
+
+def ensemble_holdout_metrics(city, model_names=BASE_MODEL_NAMES, weights=None):
+    """Score the average of the members' saved holdout predictions.
+
+    ``weights`` ({model_name: weight}) gives a weighted average instead;
+    members without a weight are left out. Only rows every member predicted
+    are scored; holdout hours are chosen per hour, so members evaluated on
+    different data sizes differ only in the newest hours. Returns None when no member
+    has saved predictions.
+    """
+    members = {}
+    for model_name in model_names:
+        if weights is not None and not weights.get(model_name):
+            continue
+        stored = load_holdout_predictions(city, model_name)
+        if stored is not None:
+            members[model_name] = stored
+    if not members:
+        return None
+
+    hours = members[next(iter(members))]["hours"]
+    for stored in members.values():
+        hours = np.intersect1d(hours, stored["hours"])
+    if len(hours) == 0:
+        return None
+    # Saved arrays are sorted by hour, so the shared rows are found by binary search
+    aligned = [stored["predictions"][np.searchsorted(stored["hours"], hours)] for stored in members.values()]
+    reference = next(iter(members.values()))
+    actual = reference["actual"][np.searchsorted(reference["hours"], hours)]
+
+    member_weights = np.array([1.0 if weights is None else weights[name] for name in members], dtype=np.float64)
+    ensemble_pred = np.tensordot(member_weights / member_weights.sum(), np.stack(aligned), axes=1)
+    return calculate_metrics(actual, ensemble_pred)
+
 def save_model_metrics(city, model_name, metrics):
     """Save model evaluation metrics to a JSON file."""
-    metrics_filename = os.path.join(METRICS_DIR, f"{city}_{model_name}_metrics.json")
+    metrics_filename = metrics_path(city, model_name)
     
     # Convert numpy values to Python native types for JSON serialization
     serializable_metrics = {}
@@ -87,9 +218,21 @@ def save_model_metrics(city, model_name, metrics):
     
     return metrics_filename
 
-def load_model_metrics(city, model_name):
+def metrics_path(city, model_name, evaluation="holdout"):
+    return os.path.join(METRICS_DIRS[evaluation], f"{city}_{model_name}{METRICS_SUFFIX}")
+
+def parse_metrics_filename(filename):
+    """(city, model_name) of a file named by ``metrics_path``, or None."""
+    if not filename.endswith(METRICS_SUFFIX):
+        return None
+    parts = filename.split('_')
+    if len(parts) < 3:
+        return None
+    return parts[0], '_'.join(parts[1:-1])  # Handle model names with underscores
+
+def load_model_metrics(city, model_name, evaluation="holdout"):
     """Load model metrics from JSON file."""
-    metrics_filename = os.path.join(METRICS_DIR, f"{city}_{model_name}_metrics.json")
+    metrics_filename = metrics_path(city, model_name, evaluation)
     
     if not os.path.exists(metrics_filename):
         return None
@@ -97,63 +240,33 @@ def load_model_metrics(city, model_name):
     with open(metrics_filename, 'r') as f:
         return json.load(f)
 
-def get_all_metrics():
-    """Get metrics for all available city-model pairs."""
-    all_metrics = {}
-    
-    if not os.path.exists(METRICS_DIR):
-        return all_metrics
-    
-    for filename in os.listdir(METRICS_DIR):
-        if filename.endswith('_metrics.json'):
-            parts = filename.split('_')
-            if len(parts) >= 3:
-                city = parts[0]
-                model_name = '_'.join(parts[1:-1])  # Handle model names with underscores
-                
-                if city not in all_metrics:
-                    all_metrics[city] = {}
-                    
-                with open(os.path.join(METRICS_DIR, filename), 'r') as f:
-                    all_metrics[city][model_name] = json.load(f)
-    
-    return all_metrics
-
 def evaluate_ensemble(city, test_size=0.2, random_state=42):
-    """Evaluate the ensemble method by averaging predictions from base models."""
-    # Get training and test data
-    X, y = prepare_data_for_training(city)
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
-    
-    # Convert test data to numpy arrays
-    y_test_np = y_test.values if hasattr(y_test, 'values') else np.array(y_test)
-    
-    # Store predictions from each model
-    all_predictions = []
-    
-    # Get predictions from each base model
-    for model_name in BASE_MODEL_NAMES:
-        try:
-            model_path = os.path.join(MODELS_DIR, f"{city}_{model_name}.pkl")
-            if os.path.exists(model_path):
-                model = joblib.load(model_path)
-                y_pred = model.predict(X_test)
-                all_predictions.append(y_pred)
-                print(f"✅ Loaded predictions from {model_name} for ensemble evaluation")
-            else:
+    """Evaluate the ensemble method by averaging predictions from base models.
+
+    Members whose holdout predictions are missing or older than their model
+    are predicted (and saved) first; the ensemble is then scored from the
+    saved arrays. Run off the request path: it loads the training matrix and
+    the member models only when some member needs predicting.
+    """
+    stale = stale_holdout_members(city)
+    if stale:
+        # Get training and test data
+        X, y = prepare_data_for_training(city)
+        for model_name in stale:
+            try:
+                model = model_registry.get(city, model_name)
+                evaluate_model(model, X, y, test_size=test_size, random_state=random_state,
+                               city=city, model_name=model_name)
+                print(f"✅ Saved holdout predictions of {model_name} for ensemble evaluation")
+            except FileNotFoundError:
                 print(f"⚠️ Model {model_name} not found for {city}")
-        except Exception as e:
-            print(f"❌ Error getting predictions from {model_name}: {e}")
+            except Exception as e:
+                print(f"❌ Error getting predictions from {model_name}: {e}")
     
-    if not all_predictions:
+    metrics = ensemble_holdout_metrics(city)
+    if metrics is None:
         raise ValueError(f"No base model predictions could be generated for ensemble evaluation in {city}")
     
-    # Average predictions from all models
-    ensemble_pred = np.mean(all_predictions, axis=0)
-    
-    # Calculate metrics
-    metrics = calculate_metrics(y_test_np, ensemble_pred)
-    
     # Save metrics
     save_model_metrics(city, "Ensemble", metrics)
     
@@ -0,0 +1,375 @@
+"""Memory-mappable artifacts for the tree-ensemble models.
+
+An unpickled ExtraTrees forest lives on each process's heap, so every
+uvicorn worker holds its own copy (hundreds of MB per city). The forest
+artifact stores the node tables of all trees as flat ``.npy`` arrays in
+``<models>/<city>_<model>.forest/``; loading memory-maps them read-only,
+so all workers share one copy through the OS page cache.
+
+Usage (from the project root):
+    python -m app.ml.flat_forest --cities delhi --models ExtraTrees,HistGradientBoosting
+    python -m app.ml.flat_forest --cities delhi --report --workers 4
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import numpy as np
+import joblib
+from sklearn.multioutput import MultiOutputRegressor
+from sklearn.ensemble import ExtraTreesRegressor, HistGradientBoostingRegressor
+
+# Set MMAP_MODELS=0 to always unpickle models, even where a forest artifact exists
+MMAP_MODELS = os.getenv("MMAP_MODELS", "1") == "1"
+# Models published by training/refresh also get a forest artifact when convertible
+MMAP_MODELS_ON_PUBLISH = os.getenv("MMAP_MODELS_ON_PUBLISH", "1") == "1"
+
+FORMAT_VERSION = 2
+FOREST_SUFFIX = ".forest"
+ARRAYS = ("feature", "threshold", "children", "missing_left", "value", "roots", "tree_output")
+CONVERTIBLE_MODELS = ["ExtraTrees", "HistGradientBoosting"]
+
+
+class FlatForest:
+    """Tree ensemble predicting from flat node arrays.
+
+    All trees share one node table: ``feature``/``threshold`` split each
+    internal node and ``children`` holds its (left, right) absolute node
+    indices. Leaves point at themselves, so all trees are walked in
+    lock-step without checking for leaves, until no node moves any more.
+    ``value`` holds as many columns as one tree predicts (every output for
+    an ExtraTrees tree, one for a HistGradientBoosting tree), and a tree's
+    columns are added to the outputs starting at its ``tree_output``.
+
+    Predictions are ``(base + sum of leaf values over trees) / divisor``,
+    summed tree by tree in the original order, with inputs cast to
+    ``input_dtype`` first. This matches the source model's ``predict`` bit
+    for bit for HistGradientBoosting and within float rounding for
+    ExtraTrees (scikit-learn adds trees in thread completion order when
+    ``n_jobs > 1``).
+    """
+
+    def __init__(self, arrays, meta):
+        for name in ARRAYS:
+            # Plain ndarray views of the maps: np.memmap results carry per-operation overhead
+            setattr(self, name, np.asarray(arrays[name]))
+        self.base = np.asarray(meta["base"], dtype=np.float64)
+        self.divisor = meta["divisor"]
+        self.max_depth = meta["max_depth"]
+        self.input_dtype = np.dtype(meta["input_dtype"])
+        self.n_features_in_ = meta["n_features_in"]
+        self.n_outputs_ = meta["n_outputs"]
+        self.single_output = meta["single_output"]
+        self.feature_names_in_ = np.asarray(meta["feature_names"], dtype=object) if meta.get("feature_names") else None
+        self.source_type = meta["source_type"]
+        self.meta = meta
+        # (first output, trees adding to it); each output's trees are stored contiguously and in order
+        width = self.value.shape[1]
+        self._output_groups = []
+        for start in range(0, self.n_outputs_, width):
+            trees = np.flatnonzero(self.tree_output == start)
+            contiguous = len(trees) and trees[-1] - trees[0] + 1 == len(trees)
+            self._output_groups.append((start, slice(trees[0], trees[-1] + 1) if contiguous else trees))
+
+    def predict(self, X):
+        if hasattr(X, "to_numpy"):
+            X = X.to_numpy()
+        X = np.asarray(X)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has shape {X.shape}, but the model expects {self.n_features_in_} features")
+        # Same values the source model compares: float32 trees compare float32 inputs as float64
+        X = np.ascontiguousarray(X.astype(self.input_dtype), dtype=np.float64)
+        n_rows = len(X)
+        node = self._leaves(X.ravel(), np.arange(n_rows)[:, None] * X.shape[1],
+                            np.broadcast_to(self.roots, (n_rows, len(self.roots))).copy(), np.isnan(X).any())
+        # (trees, rows, values per tree), added tree by tree in order
+        leaf_values = self.value[node.T]
+        width = leaf_values.shape[2]
+        y = np.empty((n_rows, self.n_outputs_), dtype=np.float64)
+        for start, trees in self._output_groups:
+            base = np.broadcast_to(self.base[start:start + width], (1, n_rows, width))
+            stacked = np.concatenate([base, leaf_values[trees]])
+            # A single value column would let add.reduce switch to pairwise summation; accumulate stays sequential
+            summed = np.add.reduce(stacked, axis=0) if width > 1 else np.add.accumulate(stacked, axis=0)[-1]
+            y[:, start:start + width] = summed
+        if self.divisor != 1:
+            y /= self.divisor
+        return y[:, 0] if self.single_output else y
+
+    def _leaves(self, flat_X, row_offsets, node, has_missing):
+        """Walk every (row, tree) pair from ``node`` down to its leaf; flat ``take``s are the cheapest gathers."""
+        for depth in range(self.max_depth):
+            x = flat_X.take(row_offsets + self.feature.take(node))
+            go_right = x > self.threshold.take(node)
+            if has_missing:
+                go_right = np.where(np.isnan(x), ~self.missing_left.take(node), go_right)
+            moved = self.children.take(node * 2 + go_right)
+            # Internal nodes always move, so an unchanged array means every walk is at its leaf
+            if depth % 4 == 3 and np.array_equal(moved, node):
+                break
+            node = moved
+        return node
+
+
+def _sklearn_tree_nodes(tree):
+    return {
+        "feature": tree.feature,
+        "threshold": tree.threshold,
+        "left": tree.children_left,
+        "right": tree.children_right,
+        "missing_left": tree.missing_go_to_left.astype(bool),
+        "value": tree.value[:, :, 0],
+        "output": 0,
+        "max_depth": tree.max_depth,
+    }
+
+
+def _hist_predictor_nodes(predictor, output):
+    nodes = predictor.nodes
+    is_leaf = nodes["is_leaf"].astype(bool)
+    return {
+        "feature": nodes["feature_idx"],
+        "threshold": nodes["num_threshold"],
+        "left": np.where(is_leaf, -1, nodes["left"].astype(np.int64)),
+        "right": np.where(is_leaf, -1, nodes["right"].astype(np.int64)),
+        "missing_left": nodes["missing_go_to_left"].astype(bool),
+        "value": np.where(is_leaf, nodes["value"], 0.0)[:, None],
+        "output": output,
+        "max_depth": int(nodes["depth"].max()),
+    }
+
+
+def _forest_trees(model):
+    """Per-tree node tables plus base, divisor and input dtype; None if not convertible."""
+    if isinstance(model, ExtraTreesRegressor):
+        trees = [_sklearn_tree_nodes(estimator.tree_) for estimator in model.estimators_]
+        # ForestRegressor.predict: float32 inputs, sum of the trees, divided once
+        return trees, np.zeros(model.n_outputs_), len(trees), "float32", model.n_outputs_ == 1
+    if isinstance(model, MultiOutputRegressor) and all(
+            isinstance(estimator, HistGradientBoostingRegressor) for estimator in model.estimators_):
+        estimators = model.estimators_
+    elif isinstance(model, HistGradientBoostingRegressor):
+        estimators = [model]
+    else:
+        return None
+    n_outputs = len(estimators)
+    trees, base = [], np.zeros(n_outputs)
+    for output, estimator in enumerate(estimators):
+        # Only numeric splits and the squared-error (identity link) loss are flattened
+        if (estimator._preprocessor is not None or estimator.n_trees_per_iteration_ != 1
+                or type(estimator._loss).__name__ != "HalfSquaredError"):
+            return None
+        base[output] = estimator._baseline_prediction.ravel()[0]
+        for predictors_of_ith_iteration in estimator._predictors:
+            trees.append(_hist_predictor_nodes(predictors_of_ith_iteration[0], output))
+    return trees, base, 1, "float64", isinstance(model, HistGradientBoostingRegressor)
+
+
+def flatten_forest(model):
+    """``(arrays, meta)`` of a fitted ExtraTrees or HistGradientBoosting model, or None."""
+    converted = _forest_trees(model)
+    if converted is None:
+        return None
+    trees, base, divisor, input_dtype, single_output = converted
+    sizes = np.array([len(tree["feature"]) for tree in trees])
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    n_nodes = int(sizes.sum())
+    index_dtype = np.int32 if n_nodes < 2 ** 30 else np.int64  # children are indexed as node * 2
+    own = np.arange(n_nodes, dtype=index_dtype)
+
+    def concat(name, dtype):
+        return np.concatenate([np.asarray(tree[name], dtype=dtype) for tree in trees])
+
+    left = np.concatenate([np.where(tree["left"] < 0, -1, tree["left"] + offset) for tree, offset in zip(trees, offsets)])
+    right = np.concatenate([np.where(tree["right"] < 0, -1, tree["right"] + offset) for tree, offset in zip(trees, offsets)])
+    is_leaf = left < 0
+    threshold = concat("threshold", np.float64)
+    feature = concat("feature", index_dtype)
+    # Leaves loop onto themselves: feature 0 and an infinite threshold always "go left"
+    threshold[is_leaf] = np.inf
+    feature[is_leaf] = 0
+    arrays = {
+        "feature": feature,
+        "threshold": threshold,
+        "children": np.column_stack([np.where(is_leaf, own, left), np.where(is_leaf, own, right)]).astype(index_dtype),
+        "missing_left": np.where(is_leaf, True, concat("missing_left", bool)),
+        "value": np.ascontiguousarray(np.concatenate([np.asarray(tree["value"], dtype=np.float64) for tree in trees])),
+        "roots": offsets.astype(index_dtype),
+        "tree_output": np.array([tree["output"] for tree in trees], dtype=np.int32),
+    }
+    feature_names = getattr(model, "feature_names_in_", None)
+    if feature_names is None and isinstance(model, MultiOutputRegressor):
+        feature_names = getattr(model.estimators_[0], "feature_names_in_", None)
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "source_type": type(model).__name__,
+        "base": base.tolist(),
+        "divisor": divisor,
+        "max_depth": max(tree["max_depth"] for tree in trees),
+        "input_dtype": input_dtype,
+        "n_features_in": int(model.n_features_in_),
+        "n_outputs": len(base),
+        "single_output": bool(single_output),
+        "n_trees": len(trees),
+        "n_nodes": n_nodes,
+        "feature_names": None if feature_names is None else [str(name) for name in feature_names],
+    }
+    return arrays, meta
+
+
+def forest_path(pkl_path):
+    return pkl_path[:-len(".pkl")] + FOREST_SUFFIX
+
+
+def _source_version(pkl_path):
+    stat = os.stat(pkl_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def save_forest(model, pkl_path, source_path=None):
+    """Write the forest artifact of ``model`` next to its ``.pkl``; returns its path or None.
+
+    The artifact records the size and mtime of the pickle it was made from
+    (``source_path``, default ``pkl_path``) and is only used while
+    ``pkl_path`` matches them. It is written to a temporary directory and
+    renamed into place, so readers never see a partial artifact.
+    """
+    flat = flatten_forest(model)
+    if flat is None:
+        return None
+    arrays, meta = flat
+    meta["source"] = _source_version(source_path or pkl_path)
+    path = forest_path(pkl_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=4)
+    # os.replace cannot swap non-empty directories: move the old artifact aside first
+    old_path = f"{path}.{os.getpid()}.old"
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return path
+
+
+def load_forest(pkl_path):
+    """The memory-mapped FlatForest for ``pkl_path``, or None if there is no current artifact."""
+    path = forest_path(pkl_path)
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("format_version") != FORMAT_VERSION or meta.get("source") != _source_version(pkl_path):
+            return None
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in ARRAYS}
+    except (FileNotFoundError, ValueError):
+        return None
+    return FlatForest(arrays, meta)
+
+
+def load_model_file(pkl_path):
+    """Load a model file: its forest artifact when current (and MMAP_MODELS is on), else the pickle."""
+    if MMAP_MODELS:
+        forest = load_forest(pkl_path)
+        if forest is not None:
+            return forest
+    return joblib.load(pkl_path)
+
+
+def directory_bytes(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def _worker_memory(paths, mmap):
+    """Run in a fresh interpreter: load the models like a server worker and print its memory."""
+    import pandas as pd
+    from app.utils.preprocess import load_data, get_feature_columns, build_feature_matrix, LAG_FEATURES
+    models = [(load_forest(path) if mmap else None) or joblib.load(path) for path in paths]
+    for (path, model) in zip(paths, models):
+        city = os.path.basename(path).split("_")[0]
+        values, _, _ = build_feature_matrix(load_data(city, tail=LAG_FEATURES + 48), LAG_FEATURES, dtype=np.float64)
+        model.predict(pd.DataFrame(values, columns=get_feature_columns(LAG_FEATURES)))
+    memory = {}
+    # Rss counts shared pages in every process; Pss splits them between the processes mapping them
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                memory[key] = int(value.split()[0]) * 1024
+    print(json.dumps(memory), flush=True)
+    sys.stdin.read()  # stay alive until every worker has reported
+
+
+def measure_workers(paths, mmap, workers):
+    """Memory of ``workers`` concurrent processes each holding the models, as dicts of bytes."""
+    code = f"from app.ml.flat_forest import _worker_memory; _worker_memory({paths!r}, {mmap!r})"
+    processes = [subprocess.Popen([sys.executable, "-c", code], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                 for _ in range(workers)]
+    try:
+        return [json.loads(process.stdout.readline()) for process in processes]
+    finally:
+        for process in processes:
+            process.stdin.close()
+            process.wait()
+
+
+def report(paths, workers):
+    """Print on-disk size, load time and per-worker memory with pickles vs forest artifacts."""
+    mb = 1024 * 1024
+    print(f"{'model':<36} {'pkl MB':>9} {'forest MB':>10} {'pkl load s':>11} {'mmap load s':>12}")
+    for path in paths:
+        start = time.perf_counter()
+        joblib.load(path)
+        pkl_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        forest = load_forest(path)
+        mmap_seconds = time.perf_counter() - start
+        forest_mb = f"{directory_bytes(forest_path(path)) / mb:>10.1f}" if forest is not None else f"{'-':>10}"
+        print(f"{os.path.basename(path):<36} {os.path.getsize(path) / mb:>9.1f} {forest_mb} {pkl_seconds:>11.3f} "
+              f"{mmap_seconds if forest is not None else float('nan'):>12.4f}")
+
+    print(f"\nMemory of {workers} worker(s) holding all of the models above (MB per worker):")
+    print(f"{'artifacts':<10} {'Rss':>9} {'Pss':>9} {'private':>9}")
+    for label, mmap in (("pickle", False), ("forest", True)):
+        memory = _mean(measure_workers(paths, mmap, workers))
+        private = memory["Private_Clean"] + memory["Private_Dirty"]
+        print(f"{label:<10} {memory['Rss'] / mb:>9.1f} {memory['Pss'] / mb:>9.1f} {private / mb:>9.1f}")
+
+
+def _mean(memories):
+    return {key: sum(memory[key] for memory in memories) / len(memories) for key in memories[0]}
+
+
+if __name__ == "__main__":
+    from app.ml.registry import MODELS_DIR
+    from app.ml.train_models import CITIES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cities", default=",".join(CITIES))
+    parser.add_argument("--models", default=",".join(CONVERTIBLE_MODELS))
+    parser.add_argument("--report", action="store_true", help="Compare size, load time and worker memory instead of converting")
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes for the memory report")
+    args = parser.parse_args()
+
+    paths = [os.path.join(MODELS_DIR, f"{city}_{model_name}.pkl")
+             for city in args.cities.split(",") for model_name in args.models.split(",")]
+    paths = [path for path in paths if os.path.exists(path)]
+    if args.report:
+        report(paths, args.workers)
+    else:
+        for path in paths:
+            start = time.perf_counter()
+            saved = save_forest(joblib.load(path), path)
+            if saved is None:
+                print(f"⏭️ {os.path.basename(path)} has no forest artifact format; skipping.")
+                continue
+            print(f"✅ Converted {os.path.basename(path)} to {saved} in {time.perf_counter() - start:.1f}s "
+                  f"({os.path.getsize(path) / 1024 / 1024:.1f} MB -> {directory_bytes(saved) / 1024 / 1024:.1f} MB)")
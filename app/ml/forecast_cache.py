@@ -0,0 +1,252 @@
+import os
+import logging
+import threading
+import time
+from collections import OrderedDict
+from app.ml.predict import make_predictions, make_predictions_batch, load_model, is_prophet_model, calculate_extended_periods
+from app.ml.ensemble import predict_ensemble, average_member_predictions, BASE_MODEL_NAMES, ALL_MODEL_NAMES
+from app.ml.registry import model_registry
+from app.utils.preprocess import DATA_DIR
+from app.utils.work_queue import DeadlineExceeded
+
+FORECAST_CACHE_MAX_ENTRIES = int(os.getenv("FORECAST_CACHE_MAX_ENTRIES", "256"))
+FORECAST_CACHE_TTL_SECONDS = float(os.getenv("FORECAST_CACHE_TTL_SECONDS", "3600"))
+# Ensembles missing a member (timed out, failed, not found) are kept only this long, so
+# a burst of requests shares them but the full ensemble is retried soon (0 = never cached)
+FORECAST_CACHE_PARTIAL_TTL_SECONDS = float(os.getenv("FORECAST_CACHE_PARTIAL_TTL_SECONDS", "30"))
+# Standard horizons (48h, 1week, 2weeks) are all served from one 2-week forecast
+BASE_FORECAST_HOURS = 336
+
+logger = logging.getLogger(__name__)
+
+
+def _file_version(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def data_version(city_name):
+    return _file_version(os.path.join(DATA_DIR, f"{city_name}.csv"))
+
+
+def model_version(city_name, model_name):
+    model_names = BASE_MODEL_NAMES if model_name == "Ensemble" else [model_name]
+    return tuple(_file_version(model_registry.model_path(city_name, name)) for name in model_names)
+
+
+class ForecastCache:
+    """LRU + TTL cache of forecast DataFrames.
+
+    Keys include the city CSV and model file versions, so a retrained model or
+    refreshed data never serves a stale forecast; older versions of the same
+    forecast are dropped as soon as a newer one is stored.
+    """
+
+    def __init__(self, max_entries=FORECAST_CACHE_MAX_ENTRIES, ttl_seconds=FORECAST_CACHE_TTL_SECONDS,
+                 partial_ttl_seconds=FORECAST_CACHE_PARTIAL_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.partial_ttl_seconds = partial_ttl_seconds
+        self._entries = OrderedDict()  # key -> (df, expires_at, nbytes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, df):
+        if not self.enabled:
+            return
+        ttl_seconds = self.ttl_seconds
+        if any(member["status"] != "ok" for member in df.attrs.get("ensemble_members", [])):
+            ttl_seconds = min(ttl_seconds, self.partial_ttl_seconds)
+            if ttl_seconds <= 0:
+                return
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            # key[:-2] identifies the forecast; the last two items are the data/model versions
+            for old_key in [k for k in self._entries if k[:-2] == key[:-2] and k != key]:
+                del self._entries[old_key]
+                self.invalidations += 1
+            self._entries[key] = (df, time.monotonic() + ttl_seconds, nbytes)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "partial_ttl_seconds": self.partial_ttl_seconds,
+                "bytes": sum(entry[2] for entry in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+forecast_cache = ForecastCache()
+
+
+def forecast_key(city_name, model_name, hours, include_bounds=False):
+    return (city_name, model_name, hours, bool(include_bounds),
+            data_version(city_name), model_version(city_name, model_name))
+
+
+def _compute(city_name, model_name, hours, include_bounds):
+    if model_name == "Ensemble":
+        return predict_ensemble(city_name, hours)
+    return make_predictions(city_name, model_name, hours, include_bounds=include_bounds)
+
+
+def get_forecast(city_name, model_name, hours_to_predict, include_bounds=False, prophet_extended=None):
+    """Return a forecast, computing and caching it on a miss.
+
+    Standard horizons are sliced from a cached 2-week forecast; Prophet extended
+    forecasts are cached under their own length. The returned DataFrame is a
+    copy the caller may modify.
+    """
+    hours = BASE_FORECAST_HOURS
+    if prophet_extended:
+        hours = calculate_extended_periods(prophet_extended) or hours_to_predict
+        hours_to_predict = hours
+    elif hours_to_predict > BASE_FORECAST_HOURS:
+        hours = hours_to_predict
+
+    key = forecast_key(city_name, model_name, hours, include_bounds)
+    df = forecast_cache.get(key)
+    if df is None:
+        df = _compute(city_name, model_name, hours, include_bounds)
+        if not df.empty:
+            forecast_cache.put(key, df)
+    return df.head(hours_to_predict).copy()
+
+
+def get_base_forecasts(pairs):
+    """2-week forecasts for many (city_name, model_name) pairs, planned together.
+
+    Returns ``{pair: DataFrame or the exception that prevented it}``; frames
+    are shared with the cache and must not be modified. Cached forecasts are
+    reused. The rest are computed in one pass: tree models of every city
+    advance together in a lock-step batch, so each history and model is
+    loaded once. Prophet models run one by one. Each Ensemble is averaged
+    from its member forecasts, computed in the same pass when not cached.
+    """
+    pairs = list(dict.fromkeys(pairs))
+    needed = []
+    for city_name, model_name in pairs:
+        members = BASE_MODEL_NAMES if model_name == "Ensemble" else [model_name]
+        needed.extend((city_name, name) for name in members)
+    needed = list(dict.fromkeys(needed))
+
+    forecasts = {}
+    for pair in needed:
+        df = forecast_cache.get(forecast_key(*pair, BASE_FORECAST_HOURS))
+        if df is not None:
+            forecasts[pair] = df
+    cached = set(forecasts)
+
+    tree_requests = []
+    for pair in needed:
+        if pair in forecasts:
+            continue
+        try:
+            model = load_model(*pair)
+            if pair[1] == "Prophet" or is_prophet_model(model):
+                forecasts[pair] = make_predictions(*pair, BASE_FORECAST_HOURS)
+            else:
+                tree_requests.append(pair)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            forecasts[pair] = e
+
+    if tree_requests:
+        try:
+            forecasts.update(zip(tree_requests, make_predictions_batch(tree_requests, BASE_FORECAST_HOURS)))
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            # Retry one at a time so a single failing model does not fail the others
+            logger.error("Batch prediction failed (%s). Retrying %d forecasts individually.", e, len(tree_requests))
+            for pair in tree_requests:
+                try:
+                    forecasts[pair] = make_predictions(*pair, BASE_FORECAST_HOURS)
+                except DeadlineExceeded:
+                    raise
+                except Exception as pair_error:
+                    forecasts[pair] = pair_error
+    for pair in needed:
+        if pair not in cached and not isinstance(forecasts[pair], Exception):
+            forecast_cache.put(forecast_key(*pair, BASE_FORECAST_HOURS), forecasts[pair])
+
+    for city_name, model_name in pairs:
+        if model_name != "Ensemble":
+            continue
+        key = forecast_key(city_name, "Ensemble", BASE_FORECAST_HOURS)
+        df = forecast_cache.get(key)
+        if df is None:
+            members = {name: forecasts[(city_name, name)] for name in BASE_MODEL_NAMES
+                       if not isinstance(forecasts[(city_name, name)], Exception) and not forecasts[(city_name, name)].empty}
+            if not members:
+                forecasts[(city_name, model_name)] = ValueError(
+                    f"No base model predictions could be generated for ensemble in {city_name}.")
+                continue
+            df = average_member_predictions(members)
+            df.attrs["ensemble_members"] = [
+                {"model": name, "status": "ok" if name in members else "missing", "seconds": None}
+                for name in BASE_MODEL_NAMES
+            ]
+            forecast_cache.put(key, df)
+        forecasts[(city_name, model_name)] = df
+    return {pair: forecasts[pair] for pair in pairs}
+
+
+def precompute_forecasts(cities, model_names=ALL_MODEL_NAMES, include_ensemble=True):
+    """Warm the cache with 2-week forecasts for every city and model.
+
+    Tree models for all cities are advanced together by the lock-step batch
+    forecaster; the Ensemble is averaged from the member forecasts just made.
+    """
+    pairs = [(city_name, model_name) for city_name in cities for model_name in model_names]
+    if include_ensemble:
+        pairs += [(city_name, "Ensemble") for city_name in cities]
+    for (city_name, model_name), df in get_base_forecasts(pairs).items():
+        if isinstance(df, FileNotFoundError):
+            logger.warning("Model %s for %s not found. Skipping precompute.", model_name, city_name)
+        elif isinstance(df, Exception):
+            logger.error("Error precomputing %s for %s: %s", model_name, city_name, df)
+    logger.info("Precomputed forecasts for %d cities: %d cached entries.", len(cities), forecast_cache.stats()["entries"])
@@ -0,0 +1,225 @@
+import time
+import pandas as pd
+import numpy as np
+from app.utils import telemetry
+from app.utils.work_queue import check_deadline
+from app.ml.inference import compiled_predictor
+from app.utils.preprocess import TARGET_FEATURES, TIMESTAMP_COL, LAG_FEATURES, CALENDAR_FEATURES, calendar_features, get_feature_columns
+
+# Output constraints applied to every predicted step before it is fed back as history
+CLIP_BOUNDS = {
+    "Humidity (%)": (0, 100),
+    "Wind Direction (°)": (0, 360),
+}
+
+HOUR = pd.Timedelta(hours=1)
+EPOCH = pd.Timestamp("1970-01-01")
+
+
+def to_epoch_hours(timestamp):
+    return int((pd.Timestamp(timestamp) - EPOCH) // HOUR)
+
+
+def clip_predictions(values):
+    """Clip a (..., len(TARGET_FEATURES)) array of predictions in place."""
+    for idx, feature in enumerate(TARGET_FEATURES):
+        if feature in CLIP_BOUNDS:
+            low, high = CLIP_BOUNDS[feature]
+            np.clip(values[..., idx], low, high, out=values[..., idx])
+    return values
+
+
+def is_direct_model(model):
+    """Direct multi-horizon models forecast whole blocks of hours without recursion."""
+    return hasattr(model, "predict_horizon")
+
+
+def direct_forecast_arrays(model, windows, epoch_hours, hours_to_predict, lag_features=LAG_FEATURES):
+    """Forecast every series with a direct multi-horizon model.
+
+    ``windows`` is (n_series, >= lag_features, n_targets), oldest hour first,
+    ending at the hours in ``epoch_hours``. Each ``predict_horizon`` call
+    covers ``model.horizon`` hours for all series at once; longer forecasts
+    chain blocks, starting each from the last predicted hours.
+    """
+    n_series, n_targets = len(windows), len(TARGET_FEATURES)
+    n_lags = n_targets * lag_features
+    window = np.array(windows[:, -lag_features:], dtype=np.float64)
+    last_hours = np.array(epoch_hours, dtype=np.int64)
+    X = np.empty((n_series, n_lags + len(CALENDAR_FEATURES)), dtype=np.float64)
+    outputs = np.empty((n_series, hours_to_predict, n_targets), dtype=np.float64)
+    done = 0
+    while done < hours_to_predict:
+        check_deadline()
+        # Lag k of every target is the k-th latest hour, in get_feature_columns order
+        X[:, :n_lags] = window[:, ::-1].transpose(0, 2, 1).reshape(n_series, n_lags)
+        X[:, n_lags:] = calendar_features(last_hours + 1)
+        block = clip_predictions(np.asarray(model.predict_horizon(X), dtype=np.float64))
+        take = min(block.shape[1], hours_to_predict - done)
+        outputs[:, done:done + take] = block[:, :take]
+        window = np.concatenate([window, block[:, :take]], axis=1)[:, -lag_features:]
+        last_hours += take
+        done += take
+    return outputs
+
+
+class BatchRecursiveForecaster:
+    """Advance many independent recursive forecasts in lock-step.
+
+    Each series is a (model, df_history) pair. All series share one ring
+    buffer of shape (n_series, lag_features + 1, n_targets); at every step the
+    feature rows of all series are filled at once and each distinct model is
+    called once on the rows of the series that use it. Forecasting four cities
+    with one model, or many requests for the same model, therefore costs one
+    ``predict`` over an N-row matrix per hour instead of N single-row calls.
+    """
+
+    def __init__(self, series, lag_features=LAG_FEATURES):
+        if not series:
+            raise ValueError("At least one series is required for batch forecasting.")
+        size = lag_features + 1
+        window = np.empty((len(series), size, len(TARGET_FEATURES)), dtype=np.float64)
+        for row, (model, df_history) in enumerate(series):
+            if len(df_history) < size:
+                raise ValueError(f"Need at least {size} hours of history for prediction.")
+            window[row] = df_history[TARGET_FEATURES].iloc[-size:].to_numpy()
+        self._setup(
+            [model for model, _ in series], window,
+            [df_history.index.max() for _, df_history in series], lag_features,
+        )
+
+    @classmethod
+    def from_windows(cls, model, windows, last_timestamps, lag_features=LAG_FEATURES):
+        """Forecast with one model from history windows that are already cut out.
+
+        ``windows`` is (n_series, lag_features + 1, n_targets), oldest hour
+        first, and ``last_timestamps`` the hour of each window's last row.
+        Used by the backtest to start hundreds of origins from one history array.
+        """
+        forecaster = cls.__new__(cls)
+        window = np.array(windows, dtype=np.float64)
+        forecaster._setup([model] * len(window), window, list(last_timestamps), lag_features)
+        return forecaster
+
+    def _setup(self, models, window, last_timestamps, lag_features):
+        self.lag_features = lag_features
+        self.columns = get_feature_columns(lag_features)
+        self.n_series = len(models)
+        self.n_targets = len(TARGET_FEATURES)
+        self.n_lags = self.n_targets * lag_features
+        self.size = lag_features + 1
+
+        self.window = window
+        self.last_timestamps = last_timestamps
+        # Group series by model so each model is called once per step
+        self.groups = {}
+        for row, model in enumerate(models):
+            self.groups.setdefault(id(model), (model, []))[1].append(row)
+        self.groups = [(model, np.array(rows)) for model, rows in self.groups.values()]
+        self.head = 0  # next slot to overwrite == oldest row
+        self.epoch_hours = np.array([to_epoch_hours(ts) for ts in self.last_timestamps], dtype=np.int64)
+
+        self.features = np.empty((self.n_series, len(self.columns)), dtype=np.float64)
+        # Lag block viewed as (series, target, lag) so one copy fills every lag column
+        self._lag_view = self.features[:, :self.n_lags].reshape(self.n_series, self.n_targets, lag_features)
+        self._lag_offsets = np.arange(1, lag_features + 1)
+
+    def _fill_features(self, epoch_hours):
+        latest = (self.head - 1) % self.size
+        lag_rows = (latest - self._lag_offsets) % self.size
+        self._lag_view[...] = self.window[:, lag_rows, :].transpose(0, 2, 1)
+        self.features[:, self.n_lags:] = calendar_features(epoch_hours)
+
+    def _push(self, values):
+        self.window[:, self.head, :] = values
+        self.head = (self.head + 1) % self.size
+
+    def predict_rows(self, model, X):
+        predict = compiled_predictor(model)
+        if predict is not None:
+            return np.asarray(predict(X))
+        X_df = pd.DataFrame(X, columns=self.columns)
+        return np.asarray(model.predict(X_df))
+
+    def forecast_arrays(self, hours_to_predict):
+        """Run the forecast and return a list of (hours, n_targets) arrays, one per series."""
+        outputs = [[] for _ in range(self.n_series)]
+        # Direct multi-horizon models need no stepping; their series are forecast up front
+        recursive_groups = []
+        for model, rows in self.groups:
+            if not is_direct_model(model):
+                recursive_groups.append((model, rows))
+                continue
+            with telemetry.span("predict"):
+                values = direct_forecast_arrays(model, self.window[rows], self.epoch_hours[rows],
+                                                hours_to_predict, lag_features=self.lag_features)
+            for i, row in enumerate(rows):
+                outputs[row] = list(values[i])
+        # Stage timing is two clock reads per step, and only while a request is traced
+        trace = telemetry.current_trace()
+        feature_seconds = 0.0
+        epoch_hours = self.epoch_hours.copy()
+        step_values = np.zeros((self.n_series, self.n_targets), dtype=np.float64)
+        for _ in range(hours_to_predict if recursive_groups else 0):
+            check_deadline()
+            if trace is not None:
+                start = time.perf_counter()
+            self._fill_features(epoch_hours)
+            if trace is not None:
+                features_done = time.perf_counter()
+                feature_seconds += features_done - start
+            for model, rows in recursive_groups:
+                values = self.predict_rows(model, self.features[rows])
+                clip_predictions(values)
+                step_values[rows] = values
+                # Keep each model's own output dtype for the returned frames
+                for i, row in enumerate(rows):
+                    outputs[row].append(values[i])
+            self._push(step_values)
+            epoch_hours += 1
+            if trace is not None:
+                trace.add("predict_step", time.perf_counter() - features_done)
+        if trace is not None and recursive_groups:
+            trace.add("feature_build", feature_seconds)
+
+        return [
+            np.vstack(rows) if rows else np.empty((0, self.n_targets))
+            for rows in outputs
+        ]
+
+    def forecast(self, hours_to_predict):
+        """Run the forecast and return one prediction DataFrame per series."""
+        arrays = self.forecast_arrays(hours_to_predict)
+        with telemetry.span("postprocess"):
+            return [
+                predictions_to_frame(last_timestamp, values)
+                for last_timestamp, values in zip(self.last_timestamps, arrays)
+            ]
+
+
+class RecursiveForecaster(BatchRecursiveForecaster):
+    """Recursive hour-by-hour forecaster for the lag-feature tree models.
+
+    Only the last ``lag_features + 1`` observations are kept, in a NumPy ring
+    buffer. Each step writes the lag and calendar features for the newest row
+    straight into a preallocated feature vector, predicts the next hour and
+    pushes the (clipped) prediction back into the buffer. This reproduces
+    ``prepare_data_for_prediction`` + ``pd.concat`` exactly without copying
+    the history.
+    """
+
+    def __init__(self, model, df_history, lag_features=LAG_FEATURES):
+        super().__init__([(model, df_history)], lag_features=lag_features)
+        self.model = model
+        self.last_timestamp = self.last_timestamps[0]
+
+    def forecast(self, hours_to_predict):
+        return super().forecast(hours_to_predict)[0]
+
+
+def predictions_to_frame(last_timestamp, values):
+    """Build the prediction DataFrame (Timestamp + TARGET_FEATURES) for hours after last_timestamp."""
+    timestamps = last_timestamp + pd.to_timedelta(np.arange(1, len(values) + 1), unit='h')
+    df = pd.DataFrame(values, columns=TARGET_FEATURES)
+    df.insert(0, TIMESTAMP_COL, timestamps)
+    return df
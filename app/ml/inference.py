@@ -0,0 +1,236 @@
+import os
+import threading
+import weakref
+import numpy as np
+import pandas as pd
+from sklearn.multioutput import MultiOutputRegressor
+from sklearn.ensemble import ExtraTreesRegressor, HistGradientBoostingRegressor
+from app.ml.flat_forest import FlatForest
+
+# Set COMPILED_INFERENCE=0 to always predict through model.predict on a DataFrame
+COMPILED_INFERENCE = os.getenv("COMPILED_INFERENCE", "1") == "1"
+# HistGradientBoosting spreads batches of at least this many rows over all OpenMP
+# threads; the few-row batches of recursive forecasting run faster on one
+INFERENCE_PARALLEL_MIN_ROWS = int(os.getenv("INFERENCE_PARALLEL_MIN_ROWS", "2048"))
+
+_compiled = weakref.WeakKeyDictionary()  # model -> predictor, or None when not compilable
+_compiled_lock = threading.Lock()
+# Rows a compiled predictor must reproduce model.predict on before it is used
+PROBE_ROWS = 8
+
+
+class _InputBuffer:
+    """Per-thread, reused contiguous copy of the feature rows in the dtype a library reads.
+
+    Converting to that dtype here gives the library exactly the values its own
+    input conversion would, so predictions are bit-identical to ``model.predict``.
+    """
+
+    def __init__(self, dtype):
+        self.dtype = np.dtype(dtype)
+        self._local = threading.local()
+
+    def fill(self, X):
+        if X.dtype == self.dtype and X.flags.c_contiguous:
+            return X
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None or buffer.shape != X.shape:
+            buffer = self._local.buffer = np.empty(X.shape, dtype=self.dtype)
+        elif not buffer.flags.writeable:
+            # CatBoost's FeaturesData marks its input read-only; the buffer owns its memory
+            buffer.flags.writeable = True
+        np.copyto(buffer, X, casting="unsafe")
+        return buffer
+
+
+def _lightgbm_predictor(estimator):
+    booster = estimator.booster_
+    num_threads = estimator._process_n_jobs(estimator.n_jobs)
+    # LightGBM reads float64 rows as they are
+    buffer = _InputBuffer(np.float64)
+    return lambda X: booster.predict(buffer.fill(X), num_threads=num_threads)
+
+
+def _xgboost_predictor(estimator):
+    booster = estimator.get_booster()
+    iteration_range = estimator._get_iteration_range(None)
+    missing = estimator.missing
+    # XGBoost converts every input to float32 internally
+    buffer = _InputBuffer(np.float32)
+    return lambda X: booster.inplace_predict(
+        buffer.fill(X), iteration_range=iteration_range, predict_type="value",
+        missing=missing, validate_features=False,
+    )
+
+
+def _catboost_predictor(estimator):
+    from catboost import FeaturesData
+    # CatBoost stores numeric features as float32; FeaturesData skips its pandas/array inspection
+    buffer = _InputBuffer(np.float32)
+    return lambda X: estimator.predict(FeaturesData(num_feature_data=buffer.fill(X)))
+
+
+def _hist_gradient_boosting_predictor(estimator):
+    # Private scikit-learn helper, imported here so a moved module only disables this path
+    from sklearn.utils._openmp_helpers import _openmp_effective_n_threads
+    # Same steps as HistGradientBoostingRegressor.predict without the input validation
+    known_cat_bitsets, f_idx_map = estimator._bin_mapper.make_known_categories_bitsets()
+    baseline = estimator._baseline_prediction
+    predictors = estimator._predictors
+    inverse_link = estimator._loss.link.inverse
+    n_threads_all = _openmp_effective_n_threads()
+    buffer = _InputBuffer(np.float64)
+
+    def predict(X):
+        X = buffer.fill(X)
+        n_threads = n_threads_all if len(X) >= INFERENCE_PARALLEL_MIN_ROWS else 1
+        raw = np.zeros((X.shape[0], estimator.n_trees_per_iteration_), dtype=baseline.dtype, order="F")
+        raw += baseline
+        for predictors_of_ith_iteration in predictors:
+            for k, predictor in enumerate(predictors_of_ith_iteration):
+                raw[:, k] += predictor.predict(X, known_cat_bitsets, f_idx_map, n_threads)
+        return inverse_link(raw.ravel())
+
+    return predict
+
+
+def _extra_trees_predictor(forest):
+    # ForestRegressor.predict sums the trees in order in float64 and divides once
+    trees = [estimator.tree_ for estimator in forest.estimators_]
+    n_outputs = forest.n_outputs_
+    buffer = _InputBuffer(np.float32)
+
+    def predict(X):
+        X = buffer.fill(X)
+        y_hat = np.zeros((X.shape[0], n_outputs) if n_outputs > 1 else X.shape[0], dtype=np.float64)
+        for tree in trees:
+            values = tree.predict(X)
+            y_hat += values[:, :, 0] if n_outputs > 1 else values[:, 0]
+        y_hat /= len(trees)
+        return y_hat
+
+    return predict
+
+
+def _estimator_predictor(estimator):
+    module = type(estimator).__module__
+    if module.startswith("lightgbm"):
+        return _lightgbm_predictor(estimator)
+    if module.startswith("xgboost"):
+        return _xgboost_predictor(estimator)
+    if module.startswith("catboost"):
+        return _catboost_predictor(estimator)
+    if isinstance(estimator, HistGradientBoostingRegressor) and not estimator._preprocessor:
+        return _hist_gradient_boosting_predictor(estimator)
+    if isinstance(estimator, ExtraTreesRegressor):
+        return _extra_trees_predictor(estimator)
+    return None
+
+
+def compile_model(model):
+    """Build a ``predict(X)`` for a fitted model that skips the scikit-learn wrappers.
+
+    ``X`` is a 2-D float array with the model's feature columns in training
+    order. The result equals ``model.predict`` on the same rows as a
+    DataFrame, in value and dtype, but each target's booster or tree is
+    called directly on a reused contiguous buffer: no DataFrame, no feature
+    name validation, no joblib dispatch. Returns None for models without a
+    compiled path (e.g. Prophet), which keep using ``model.predict``.
+
+    The compiled path relies on library internals, so it is checked against
+    ``model.predict`` on probe rows and a ValueError is raised if they differ.
+    """
+    if isinstance(model, FlatForest):
+        # Already array-based and validates its input shape
+        return model.predict
+    predict = _compile(model)
+    if predict is not None:
+        _check_probe(model, predict)
+    return predict
+
+
+def _compile(model):
+    n_features = getattr(model, "n_features_in_", None)
+    if isinstance(model, MultiOutputRegressor):
+        target_predictors = [_estimator_predictor(estimator) for estimator in model.estimators_]
+        if any(predictor is None for predictor in target_predictors):
+            return None
+
+        def predict(X):
+            if n_features is not None and X.shape[1] != n_features:
+                raise ValueError(f"X has {X.shape[1]} features, but the model expects {n_features}")
+            # MultiOutputRegressor returns np.asarray(per-target predictions).T
+            return np.asarray([target_predict(X) for target_predict in target_predictors]).T
+
+        return predict
+
+    single = _estimator_predictor(model)
+    if single is None:
+        return None
+
+    def predict(X):
+        if n_features is not None and X.shape[1] != n_features:
+            raise ValueError(f"X has {X.shape[1]} features, but the model expects {n_features}")
+        return single(X)
+
+    return predict
+
+
+def _public_predict(model, X):
+    # model.predict as the forecaster calls it without a compiled path: on a DataFrame with the training columns
+    columns = getattr(model, "feature_names_in_", None)
+    return np.asarray(model.predict(pd.DataFrame(X, columns=columns) if columns is not None else X))
+
+
+def _check_probe(model, predict):
+    n_features = getattr(model, "n_features_in_", None)
+    if n_features is None:
+        raise ValueError("model has no n_features_in_ to build probe rows from")
+    X = np.random.default_rng(0).normal(0.0, 20.0, size=(PROBE_ROWS, n_features))
+    expected = _public_predict(model, X)
+    actual = np.asarray(predict(X))
+    # Tree sums may differ in the last bit (e.g. per-thread summation order), nothing more
+    if actual.shape != expected.shape or not np.allclose(actual, expected, rtol=1e-9, atol=1e-9):
+        raise ValueError("compiled predictions differ from model.predict on the probe rows")
+
+
+def _with_fallback(model, predict):
+    """``predict`` that switches the model to ``model.predict`` if it ever raises."""
+    def guarded(X):
+        try:
+            return predict(X)
+        except Exception as e:
+            if X.ndim != 2 or X.shape[1] != getattr(model, "n_features_in_", X.shape[1]):
+                raise
+            print(f"⚠️ Compiled inference failed for {type(model).__name__} ({e}); using model.predict from now on.")
+            with _compiled_lock:
+                _compiled[model] = None
+            return _public_predict(model, X)
+
+    return guarded
+
+
+def compiled_predictor(model):
+    """The compiled ``predict`` of a loaded model, built on first use; None if unavailable.
+
+    Any error while compiling, checking or calling the compiled path makes
+    the model use the public ``model.predict`` instead.
+    """
+    if not COMPILED_INFERENCE:
+        return None
+    try:
+        return _compiled[model]
+    except KeyError:
+        pass
+    with _compiled_lock:
+        if model not in _compiled:
+            try:
+                predictor = compile_model(model)
+            except Exception as e:
+                # Library internals changed: fall back to the public predict
+                print(f"⚠️ No compiled inference for {type(model).__name__}: {e}")
+                predictor = None
+            if predictor is not None and not isinstance(model, FlatForest):
+                predictor = _with_fallback(model, predictor)
+            _compiled[model] = predictor
+        return _compiled[model]
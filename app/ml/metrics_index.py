@@ -0,0 +1,128 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from app.ml.evaluate import METRICS_DIRS, parse_metrics_filename, load_model_metrics
+
+# Minimum seconds between two scans of a metrics directory for changed files
+METRICS_INDEX_CHECK_SECONDS = float(os.getenv("METRICS_INDEX_CHECK_SECONDS", "1"))
+# Encoded /model-metrics bodies kept per directory (LRU)
+METRICS_BODY_CACHE_ENTRIES = int(os.getenv("METRICS_BODY_CACHE_ENTRIES", "256"))
+
+
+class MetricsIndex:
+    """Parsed metrics files of one evaluation kind, re-read only when a file changes.
+
+    At most every ``check_seconds`` the directory is scanned; only files whose
+    (mtime, size) changed since the last scan are parsed again. Every selection
+    comes with a strong ETag built from the versions of the files it includes,
+    and encoded bodies are cached under it, so repeated and conditional
+    requests neither read files nor encode anything.
+    """
+
+    def __init__(self, evaluation, check_seconds=METRICS_INDEX_CHECK_SECONDS,
+                 max_bodies=METRICS_BODY_CACHE_ENTRIES):
+        self.evaluation = evaluation
+        self.metrics_dir = METRICS_DIRS[evaluation]
+        self.check_seconds = check_seconds
+        self.max_bodies = max_bodies
+        self._files = {}  # filename -> (version, city, model_name, metrics)
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self._bodies = OrderedDict()  # etag -> encoded body
+        self.scans = 0
+        self.files_loaded = 0
+        self.body_hits = 0
+        self.body_misses = 0
+
+    def _scan(self):
+        try:
+            entries = list(os.scandir(self.metrics_dir))
+        except FileNotFoundError:
+            entries = []
+        files = {}
+        for entry in entries:
+            key = parse_metrics_filename(entry.name)
+            if key is None:
+                continue
+            old = self._files.get(entry.name)
+            try:
+                stat = entry.stat()
+                version = (stat.st_mtime_ns, stat.st_size)
+                if old is not None and old[0] == version:
+                    files[entry.name] = old
+                    continue
+                metrics = load_model_metrics(*key, self.evaluation)
+            except (FileNotFoundError, ValueError):
+                metrics = None
+            if metrics is None:
+                # Deleted, or caught halfway through being rewritten: keep the
+                # previous contents (if any) and read it again on the next scan
+                if old is not None:
+                    files[entry.name] = old
+                continue
+            files[entry.name] = (version, *key, metrics)
+            self.files_loaded += 1
+        self._files = files
+        self.scans += 1
+
+    def refresh(self, force=False):
+        """Pick up changed files; without ``force`` at most once every ``check_seconds``."""
+        with self._lock:
+            now = time.monotonic()
+            if force or self._checked_at is None or now - self._checked_at >= self.check_seconds:
+                self._scan()
+                self._checked_at = now
+
+    def select(self, city=None, model_name=None):
+        """Return ``(metrics, etag)`` of the files matching ``city`` and ``model_name``.
+
+        With both ``city`` and ``model_name`` the metrics of that file (None if
+        there is none); otherwise ``{city: {model: metrics}}`` of the matching files.
+        """
+        self.refresh()
+        chosen = sorted(
+            (entry for entry in self._files.values()
+             if (city is None or entry[1] == city) and (model_name is None or entry[2] == model_name)),
+            key=lambda entry: (entry[1], entry[2]),
+        )
+        if city and model_name:
+            metrics = chosen[0][3] if chosen else None
+        else:
+            metrics = {}
+            for _, entry_city, entry_model, entry_metrics in chosen:
+                metrics.setdefault(entry_city, {})[entry_model] = entry_metrics
+        signature = repr((self.evaluation, city, model_name, [(entry[1], entry[2], entry[0]) for entry in chosen]))
+        return metrics, hashlib.blake2b(signature.encode("utf-8"), digest_size=16).hexdigest()
+
+    def encoded(self, etag, encode):
+        """Body cached under ``etag``, produced with ``encode()`` on a miss."""
+        with self._lock:
+            body = self._bodies.get(etag)
+            if body is not None:
+                self._bodies.move_to_end(etag)
+                self.body_hits += 1
+                return body
+            self.body_misses += 1
+        body = encode()
+        if self.max_bodies > 0:
+            with self._lock:
+                self._bodies[etag] = body
+                while len(self._bodies) > self.max_bodies:
+                    self._bodies.popitem(last=False)
+        return body
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": len(self._files),
+                "scans": self.scans,
+                "files_loaded": self.files_loaded,
+                "cached_bodies": len(self._bodies),
+                "body_hits": self.body_hits,
+                "body_misses": self.body_misses,
+            }
+
+
+metrics_indexes = {evaluation: MetricsIndex(evaluation) for evaluation in METRICS_DIRS}
@@ -1,22 +1,104 @@
+import os
+import copy
+import threading
+import contextvars
 import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from statistics import NormalDist
 from prophet import Prophet
 import warnings
+from app.utils.work_queue import check_deadline
 
 # Suppress Prophet related warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
 
+# How Prophet's yhat_lower/yhat_upper are computed when bounds are requested:
+# "sampled" (Prophet's own uncertainty_samples simulated trajectories),
+# "reduced" (PROPHET_REDUCED_UNCERTAINTY_SAMPLES trajectories) or "analytic"
+# (closed-form normal interval of the same trend-change and noise model).
+# Forecasts without bounds never sample.
+PROPHET_BOUNDS_MODES = ("sampled", "reduced", "analytic")
+PROPHET_BOUNDS_MODE = os.getenv("PROPHET_BOUNDS_MODE", "sampled")
+PROPHET_REDUCED_UNCERTAINTY_SAMPLES = int(os.getenv("PROPHET_REDUCED_UNCERTAINTY_SAMPLES", "200"))
+# Threads predicting the per-target Prophet models of one forecast (1 = one after another)
+PROPHET_PREDICT_WORKERS = int(os.getenv("PROPHET_PREDICT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_prophet_executor = None
+_prophet_executor_lock = threading.Lock()
+
+def _map_targets(fn, models):
+    """``[fn(model) for model in models]``, on the Prophet thread pool when it has several workers."""
+    global _prophet_executor
+    if PROPHET_PREDICT_WORKERS <= 1 or len(models) <= 1:
+        return [fn(model) for model in models]
+    with _prophet_executor_lock:
+        if _prophet_executor is None:
+            _prophet_executor = ThreadPoolExecutor(max_workers=PROPHET_PREDICT_WORKERS, thread_name_prefix="prophet")
+    # Each task runs in a copy of the caller's context, so request deadlines and traces carry over
+    futures = [_prophet_executor.submit(contextvars.copy_context().run, fn, model) for model in models]
+    return [future.result() for future in futures]
+
+def _analytic_bounds(model, future, forecast):
+    """Normal-approximation interval of Prophet's simulated forecast distribution.
+
+    Prophet simulates future slope changes (at each future step with
+    probability ``len(changepoints) * step``, Laplace-distributed with the
+    mean absolute fitted change, averaged with the previous step's) and adds
+    Gaussian observation noise. The variance of that sum has a closed form,
+    so no trajectories are drawn. Only the first parameter draw is used.
+    """
+    params = model.params
+    sigma_obs = float(np.ravel(params['sigma_obs'])[0]) * model.y_scale
+    t = model.setup_dataframe(future.copy())['t'].to_numpy()
+    is_future = t > 1
+    trend_var = np.zeros(len(t))
+    n_future = int(is_future.sum())
+    if n_future:
+        step = np.diff(t[is_future]).mean() if n_future > 1 else np.diff(model.history['t']).mean()
+        change_likelihood = min(1.0, len(model.changepoints_t) * step)
+        mean_delta = np.mean(np.abs(np.ravel(params['delta']))) + 1e-8
+        # Value n steps ahead = step * sum_i shift_i * (n - i + 0.5); Laplace variance is 2 * scale^2
+        weights = np.cumsum((np.arange(n_future) + 0.5) ** 2)
+        trend_var[is_future] = (step * model.y_scale) ** 2 * change_likelihood * 2 * mean_delta ** 2 * weights
+    scale = 1 + forecast['multiplicative_terms'].to_numpy()
+    sd = np.sqrt(sigma_obs ** 2 + scale ** 2 * trend_var)
+    z = NormalDist().inv_cdf(0.5 + model.interval_width / 2)
+    yhat = forecast['yhat'].to_numpy()
+    return {'yhat_lower': yhat - z * sd, 'yhat_upper': yhat + z * sd}
+
+def _forecast_target(model, future, bounds_mode):
+    check_deadline()
+    if bounds_mode == "sampled":
+        forecast = model.predict(future)
+    else:
+        # Shallow copy: the shared fitted model is never modified
+        model_copy = copy.copy(model)
+        sampled = bounds_mode == "reduced" or (bounds_mode == "analytic" and model.growth != "linear")
+        model_copy.uncertainty_samples = PROPHET_REDUCED_UNCERTAINTY_SAMPLES if sampled else 0
+        forecast = model_copy.predict(future)
+    result = {'yhat': forecast['yhat'].to_numpy()}
+    if 'yhat_lower' in forecast:
+        result['yhat_lower'] = forecast['yhat_lower'].to_numpy()
+        result['yhat_upper'] = forecast['yhat_upper'].to_numpy()
+    elif bounds_mode == "analytic":
+        result.update(_analytic_bounds(model, future, forecast))
+    return result
+
 # Prophet wrapper for multi-output regression compatibility
 class ProphetRegressor:
     def __init__(self, seasonality_mode='multiplicative', yearly_seasonality=True, 
-                 weekly_seasonality=True, daily_seasonality=True):
+                 weekly_seasonality=True, daily_seasonality=True, bounds_mode=None):
         self.seasonality_mode = seasonality_mode
         self.yearly_seasonality = yearly_seasonality
         self.weekly_seasonality = weekly_seasonality
         self.daily_seasonality = daily_seasonality
+        # One of PROPHET_BOUNDS_MODES; None follows PROPHET_BOUNDS_MODE
+        self.bounds_mode = bounds_mode
         self.models = None
         
-    def fit(self, X, y):
+    def fit(self, X, y, init=None):
+        # init: optional per-target Stan initial values (warm start from a previous fit)
         # Create a separate Prophet model for each target feature
         self.models = []
         for i in range(y.shape[1]):
@@ -31,20 +113,113 @@ class ProphetRegressor:
                 'ds': X.index,  # dates
                 'y': y.iloc[:, i]  # target variable
             })
-            model.fit(df)
+            model.fit(df, **({'init': init[i]} if init else {}))
             self.models.append(model)
         return self
-    
-    def predict(self, X):
+
+    def forecast(self, dates, include_bounds=False):
+        """Forecast every target at ``dates``, the per-target models in parallel.
+
+        Returns one dict per target with a ``yhat`` array and, with
+        ``include_bounds``, ``yhat_lower`` and ``yhat_upper``. Without bounds
+        no trajectories are simulated; yhat is the same either way.
+        """
         if self.models is None:
             raise ValueError("Model has not been fitted yet.")
-        
-        predictions = []
-        for model in self.models:
-            # Create future dataframe with 'ds' column
-            future = pd.DataFrame({'ds': X.index})
-            forecast = model.predict(future)
-            predictions.append(forecast['yhat'].values)
+        bounds_mode = "none"
+        if include_bounds:
+            # Models pickled before bounds modes existed have no bounds_mode
+            bounds_mode = getattr(self, 'bounds_mode', None) or PROPHET_BOUNDS_MODE
+            if bounds_mode not in PROPHET_BOUNDS_MODES:
+                raise ValueError(f"Unknown Prophet bounds mode: {bounds_mode}. Allowed: {', '.join(PROPHET_BOUNDS_MODES)}")
+        future = pd.DataFrame({'ds': dates})
+        return _map_targets(lambda model: _forecast_target(model, future, bounds_mode), self.models)
+    
+    def predict(self, X):
+        # Point forecasts only: Prophet's uncertainty sampling is skipped
+        predictions = [forecast['yhat'] for forecast in self.forecast(X.index)]
         
         # Combine predictions for all features
         return np.column_stack(predictions)
+
+# Direct multi-horizon regressor: the whole forecast from one matrix product
+class DirectMultiHorizonRegressor:
+    """Ridge regression from the last lag hours straight to the next ``horizon`` hours.
+
+    Trained on the standard feature matrix (lag columns, then hour, dayofweek,
+    month, dayofyear): the row for hour t is mapped to the targets of hours
+    t .. t + horizon - 1, with separate coefficients per target and hour ahead.
+    Hour of day and day of year enter as Fourier terms, so each horizon hour
+    learns its own diurnal and seasonal profile. ``predict`` returns the first
+    hour only (like the one-step models); ``predict_horizon`` the whole block.
+    """
+
+    def __init__(self, horizon=336, alpha=1.0, daily_harmonics=3, yearly_harmonics=2):
+        self.horizon = horizon
+        self.alpha = alpha
+        self.daily_harmonics = daily_harmonics
+        self.yearly_harmonics = yearly_harmonics
+        self.coef_ = None
+
+    def _expand_features(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        # The last four columns are hour, dayofweek, month, dayofyear
+        hour, dayofyear = X[:, -4], X[:, -1]
+        columns = [X[:, :-4]]
+        for k in range(1, self.daily_harmonics + 1):
+            angle = 2 * np.pi * k * hour / 24
+            columns += [np.sin(angle)[:, None], np.cos(angle)[:, None]]
+        for k in range(1, self.yearly_harmonics + 1):
+            angle = 2 * np.pi * k * dayofyear / 365.25
+            columns += [np.sin(angle)[:, None], np.cos(angle)[:, None]]
+        return np.hstack(columns)
+
+    def _design(self, X):
+        return (self._expand_features(X) - self.mean_) / self.scale_
+
+    def fit(self, X, y):
+        Y = np.asarray(y, dtype=np.float64)
+        self.n_targets_ = Y.shape[1]
+        self.n_features_in_ = X.shape[1]
+        Z = self._expand_features(X)
+
+        # Row i is usable when rows i .. i + horizon - 1 are consecutive hours
+        hours = ((pd.DatetimeIndex(X.index) - pd.Timestamp("1970-01-01")) // pd.Timedelta(hours=1)).to_numpy()
+        n_rows, horizon = len(Z), self.horizon
+        usable = np.zeros(n_rows, dtype=bool)
+        if n_rows >= horizon:
+            usable[:n_rows - horizon + 1] = hours[horizon - 1:] - hours[:n_rows - horizon + 1] == horizon - 1
+        rows = np.flatnonzero(usable)
+        if len(rows) <= Z.shape[1]:
+            raise ValueError(f"Need more than {Z.shape[1] + horizon} consecutive hours to fit a {horizon}h direct model.")
+
+        Z = Z[rows]
+        self.mean_ = Z.mean(axis=0)
+        self.scale_ = Z.std(axis=0)
+        self.scale_[self.scale_ == 0] = 1.0
+        Z = (Z - self.mean_) / self.scale_
+
+        # Normal equations, one right-hand side per (hour ahead, target); the
+        # (rows x horizon x targets) target matrix is never materialized
+        gram = Z.T @ Z + self.alpha * np.eye(Z.shape[1])
+        cross = np.empty((Z.shape[1], horizon, self.n_targets_))
+        intercept = np.empty((horizon, self.n_targets_))
+        for h in range(horizon):
+            Y_h = Y[rows + h]
+            intercept[h] = Y_h.mean(axis=0)
+            cross[:, h] = Z.T @ (Y_h - intercept[h])
+        self.coef_ = np.linalg.solve(gram, cross.reshape(Z.shape[1], -1))
+        self.intercept_ = intercept.reshape(-1)
+        return self
+
+    def predict_horizon(self, X):
+        """(n_rows, horizon, n_targets) forecasts; row i of X holds the features of the first hour ahead."""
+        if self.coef_ is None:
+            raise ValueError("Model has not been fitted yet.")
+        predictions = self._design(X) @ self.coef_ + self.intercept_
+        return predictions.reshape(len(predictions), self.horizon, self.n_targets_)
+
+    def predict(self, X):
+        if self.coef_ is None:
+            raise ValueError("Model has not been fitted yet.")
+        return self._design(X) @ self.coef_[:, :self.n_targets_] + self.intercept_[:self.n_targets_]
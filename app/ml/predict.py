@@ -1,20 +1,24 @@
 import pandas as pd
 import numpy as np
-import joblib
 import os
-from datetime import timedelta, datetime
-from app.utils.preprocess import load_data, prepare_data_for_prediction, TARGET_FEATURES, TIMESTAMP_COL, LAG_FEATURES
+import logging
+from app.utils import telemetry
+from app.utils.preprocess import load_data, TARGET_FEATURES, TIMESTAMP_COL, LAG_FEATURES
 # Import ProphetRegressor to ensure it's available when loading models
 from app.ml.models import ProphetRegressor
+from app.ml.registry import model_registry, MODELS_DIR
+from app.ml.forecaster import RecursiveForecaster, BatchRecursiveForecaster, CLIP_BOUNDS, to_epoch_hours
 
-MODELS_DIR = os.path.join(os.path.dirname(__file__), '..', 'models')
+# Length of the Prophet forecast stored at training time (covers prophet_extended up to 1year)
+PROPHET_FORECAST_HOURS = 24 * 365
+_prophet_forecasts = {}  # city -> (file versions, stored forecast)
+
+logger = logging.getLogger(__name__)
 
 def load_model(city_name, model_name):
-    model_filename = os.path.join(MODELS_DIR, f"{city_name}_{model_name}.pkl")
-    if not os.path.exists(model_filename):
-        raise FileNotFoundError(f"Model file not found: {model_filename}")
-    model = joblib.load(model_filename)
-    return model
+    """Return the cached model for the city, loading it on first use."""
+    with telemetry.span("model_load"):
+        return model_registry.get(city_name, model_name)
 
 def is_prophet_model(model):
     """Check if the model is a Prophet model"""
@@ -32,65 +36,121 @@ def calculate_extended_periods(extended_option):
         return 24 * 365  # ~365 days
     return None  # No extension
 
-def make_predictions_with_prophet(model, city_name, hours_to_predict, include_bounds=False):
+def prophet_forecast_path(city_name):
+    return os.path.join(MODELS_DIR, f"{city_name}_Prophet_forecast.npz")
+
+def _prophet_forecast_arrays(model, future_dates, include_bounds):
+    """Run each per-target Prophet model once and return its columns as arrays."""
+    columns = {}
+    # Targets beyond the fitted models are left out
+    for feature, forecast in zip(TARGET_FEATURES, model.forecast(future_dates, include_bounds)):
+        columns[feature] = forecast['yhat']
+        if include_bounds:
+            columns[f"{feature}_lower"] = forecast['yhat_lower']
+            columns[f"{feature}_upper"] = forecast['yhat_upper']
+    return columns
+
+def save_prophet_forecast(model, city_name, hours_to_predict=PROPHET_FORECAST_HOURS):
+    """Persist a one-year Prophet forecast (with bounds) next to the city's model file.
+
+    Any Prophet request covered by it, up to prophet_extended=1year, is then
+    served as a slice of the stored arrays instead of running Prophet.
+    """
+    df_history = load_data(city_name, tail=1)
+    if df_history.empty:
+        raise ValueError(f"No historical data found for {city_name} to make predictions.")
+    start_hour = to_epoch_hours(df_history.index.max()) + 1
+    future_dates = df_history.index.max() + pd.to_timedelta(np.arange(1, hours_to_predict + 1), unit='h')
+    columns = _prophet_forecast_arrays(model, future_dates, include_bounds=True)
+
+    model_stat = os.stat(model_registry.model_path(city_name, "Prophet"))
+    filename = prophet_forecast_path(city_name)
+    tmp_filename = filename + ".tmp.npz"
+    np.savez(
+        tmp_filename,
+        start_hour=start_hour,
+        model_version=np.array([model_stat.st_mtime_ns, model_stat.st_size], dtype=np.int64),
+        features=np.array(list(columns)),
+        values=np.column_stack(list(columns.values())),
+    )
+    os.replace(tmp_filename, filename)
+    return filename
+
+def load_prophet_forecast(city_name):
+    """Return the stored Prophet forecast if it was made by the current model file, else None."""
+    filename = prophet_forecast_path(city_name)
+    try:
+        model_stat = os.stat(model_registry.model_path(city_name, "Prophet"))
+        forecast_stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    version = (forecast_stat.st_mtime_ns, model_stat.st_mtime_ns, model_stat.st_size)
+    cached = _prophet_forecasts.get(city_name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with np.load(filename) as data:
+        if list(data['model_version']) != [model_stat.st_mtime_ns, model_stat.st_size]:
+            logger.warning("Stored Prophet forecast for %s is from an older model. Ignoring it.", city_name)
+            stored = None
+        else:
+            stored = {
+                'start_hour': int(data['start_hour']),
+                'features': [str(feature) for feature in data['features']],
+                'values': data['values'],
+            }
+    _prophet_forecasts[city_name] = (version, stored)
+    return stored
+
+def _slice_prophet_forecast(stored, first_hour, hours_to_predict, include_bounds):
+    offset = first_hour - stored['start_hour']
+    if offset < 0 or offset + hours_to_predict > len(stored['values']):
+        return None
+    rows = stored['values'][offset:offset + hours_to_predict]
+    return {
+        feature: rows[:, idx]
+        for idx, feature in enumerate(stored['features'])
+        if include_bounds or not feature.endswith(('_lower', '_upper'))
+    }
+
+def make_predictions_with_prophet(model, city_name, hours_to_predict, include_bounds=False, df_history=None):
     """Generate predictions using Prophet model with extended capabilities"""
-    print(f"Using Prophet-specific prediction path for {city_name}")
+    logger.debug("Using Prophet-specific prediction path for %s", city_name)
     
-    # Get the last timestamp from historical data
-    df_history = load_data(city_name)
+    # Get the last timestamp from historical data (callers may pass the history they already loaded)
+    if df_history is None:
+        with telemetry.span("history_load"):
+            df_history = load_data(city_name, tail=1)
     if df_history.empty:
         raise ValueError(f"No historical data found for {city_name} to make predictions.")
     
     last_timestamp = df_history.index.max()
-    
-    # Create future dates DataFrame
-    future_dates = pd.date_range(
-        start=last_timestamp + timedelta(hours=1),
-        periods=hours_to_predict,
-        freq='H'
-    )
-    
-    # Prepare predictions dataframe
-    predictions = []
-    
-    # For each target feature (temperature, humidity, etc.)
-    for i, feature in enumerate(TARGET_FEATURES):
-        # Check if we have a model for this feature
-        if i < len(model.models):
-            # Create future dataframe for Prophet
-            future = pd.DataFrame({'ds': future_dates})
-            # Make prediction
-            forecast = model.models[i].predict(future)
-            
-            # Extract the predicted values
-            for j, timestamp in enumerate(future_dates):
-                if j >= len(predictions):
-                    predictions.append({TIMESTAMP_COL: timestamp})
-                
-                # Add the main forecast
-                predictions[j][feature] = forecast.iloc[j]['yhat']
-                
-                # Add uncertainty bounds if requested
-                if include_bounds:
-                    predictions[j][f"{feature}_lower"] = forecast.iloc[j]['yhat_lower']
-                    predictions[j][f"{feature}_upper"] = forecast.iloc[j]['yhat_upper']
-    
-    # Apply constraints to the predictions
-    for pred in predictions:
-        if "Humidity (%)" in pred:
-            pred["Humidity (%)"] = np.clip(pred["Humidity (%)"], 0, 100)
-            if include_bounds and "Humidity (%)_lower" in pred:
-                pred["Humidity (%)_lower"] = np.clip(pred["Humidity (%)_lower"], 0, 100)
-                pred["Humidity (%)_upper"] = np.clip(pred["Humidity (%)_upper"], 0, 100)
-                
-        if "Wind Direction (°)" in pred:
-            pred["Wind Direction (°)"] = np.clip(pred["Wind Direction (°)"], 0, 360)
-            if include_bounds and "Wind Direction (°)_lower" in pred:
-                pred["Wind Direction (°)_lower"] = np.clip(pred["Wind Direction (°)_lower"], 0, 360)
-                pred["Wind Direction (°)_upper"] = np.clip(pred["Wind Direction (°)_upper"], 0, 360)
-    
-    print(f"Finished Prophet prediction. Generated {len(predictions)} data points.")
-    return pd.DataFrame(predictions)
+    future_dates = last_timestamp + pd.to_timedelta(np.arange(1, hours_to_predict + 1), unit='h')
+
+    # Prophet forecasts depend only on the timestamp, so a stored forecast covering
+    # the requested hours can be sliced instead of re-running the models
+    columns = None
+    with telemetry.span("predict"):
+        stored = load_prophet_forecast(city_name)
+        if stored is not None:
+            columns = _slice_prophet_forecast(stored, to_epoch_hours(last_timestamp) + 1, hours_to_predict, include_bounds)
+        if columns is None:
+            columns = _prophet_forecast_arrays(model, future_dates, include_bounds)
+        else:
+            logger.debug("Serving Prophet forecast for %s from stored forecast.", city_name)
+
+    with telemetry.span("postprocess"):
+        df_predictions = pd.DataFrame(columns)
+        df_predictions.insert(0, TIMESTAMP_COL, future_dates)
+
+        # Apply constraints to the predictions and their bounds
+        for feature, (low, high) in CLIP_BOUNDS.items():
+            for column in (feature, f"{feature}_lower", f"{feature}_upper"):
+                if column in df_predictions:
+                    df_predictions[column] = np.clip(df_predictions[column].to_numpy(), low, high)
+
+    logger.debug("Finished Prophet prediction. Generated %d data points.", len(df_predictions))
+    return df_predictions
 
 def make_predictions(city_name, model_name, hours_to_predict=48, include_bounds=False, prophet_extended=None):
     """Enhanced prediction function with Prophet-specific options"""
@@ -101,52 +161,61 @@ def make_predictions(city_name, model_name, hours_to_predict=48, include_bounds=
         extended_hours = calculate_extended_periods(prophet_extended)
         if extended_hours:
             hours_to_predict = extended_hours
-            print(f"Using extended Prophet forecast: {prophet_extended} ({hours_to_predict} hours)")
+            logger.debug("Using extended Prophet forecast: %s (%d hours)", prophet_extended, hours_to_predict)
     
     # Prophet-specific prediction path
     if model_name == "Prophet" or is_prophet_model(model):
         return make_predictions_with_prophet(model, city_name, hours_to_predict, include_bounds)
     
-    # Standard prediction for tree-based models (existing code)
-    df_history = load_data(city_name)
+    # Standard prediction for tree-based models; only the lag window is read
+    with telemetry.span("history_load"):
+        df_history = load_data(city_name, tail=LAG_FEATURES + 1)
 
     if df_history.empty:
         raise ValueError(f"No historical data found for {city_name} to make predictions.")
 
-    predictions = []
-    current_history = df_history.copy()
-    last_timestamp = current_history.index.max()
-
-    print(f"Starting prediction for {city_name} using {model_name} for {hours_to_predict} hours.")
-    print(f"Latest data point timestamp: {last_timestamp}")
-
-    for i in range(hours_to_predict):
-        try:
-            X_pred_input = prepare_data_for_prediction(current_history, lag_features=LAG_FEATURES)
-        except ValueError as e:
-             print(f"Error preparing data at step {i+1}/{hours_to_predict}: {e}")
-             print(f"History length: {len(current_history)}")
-             break
-
-        next_hour_pred_values = model.predict(X_pred_input)[0]
-
-        next_timestamp = last_timestamp + timedelta(hours=i + 1)
-        pred_record = {TIMESTAMP_COL: next_timestamp}
-        for idx, feature in enumerate(TARGET_FEATURES):
-             if feature == "Humidity (%)":
-                 pred_record[feature] = np.clip(next_hour_pred_values[idx], 0, 100)
-             elif feature == "Wind Direction (°)":
-                 pred_record[feature] = np.clip(next_hour_pred_values[idx], 0, 360)
-             else:
-                 pred_record[feature] = next_hour_pred_values[idx]
-        predictions.append(pred_record)
-
-        new_row_df = pd.DataFrame([pred_record])
-        new_row_df[TIMESTAMP_COL] = pd.to_datetime(new_row_df[TIMESTAMP_COL])
-        new_row_df.set_index(TIMESTAMP_COL, inplace=True)
-        new_row_df = new_row_df[TARGET_FEATURES]
-
-        current_history = pd.concat([current_history, new_row_df])
-
-    print(f"Finished prediction. Generated {len(predictions)} data points.")
-    return pd.DataFrame(predictions)
+    logger.debug("Starting prediction for %s using %s for %d hours from %s.",
+                 city_name, model_name, hours_to_predict, df_history.index.max())
+
+    with telemetry.span("feature_build"):
+        forecaster = RecursiveForecaster(model, df_history, lag_features=LAG_FEATURES)
+    df_predictions = forecaster.forecast(hours_to_predict)
+
+    logger.debug("Finished prediction. Generated %d data points.", len(df_predictions))
+    return df_predictions
+
+def make_predictions_batch(requests, hours_to_predict=48):
+    """Forecast many (city_name, model_name) pairs together.
+
+    Tree-model requests are advanced in lock-step by a BatchRecursiveForecaster,
+    so each model is called once per hour on all the rows that use it.
+    Prophet requests have no recursive loop and are run individually.
+    Returns one prediction DataFrame per request, in request order.
+    """
+    unique_requests = list(dict.fromkeys(requests))
+    histories = {}
+    series = []
+    tree_requests = []
+    results = {}
+
+    for city_name, model_name in unique_requests:
+        model = load_model(city_name, model_name)
+        if model_name == "Prophet" or is_prophet_model(model):
+            results[(city_name, model_name)] = make_predictions_with_prophet(model, city_name, hours_to_predict)
+            continue
+        if city_name not in histories:
+            histories[city_name] = load_data(city_name, tail=LAG_FEATURES + 1)
+            if histories[city_name].empty:
+                raise ValueError(f"No historical data found for {city_name} to make predictions.")
+        series.append((model, histories[city_name]))
+        tree_requests.append((city_name, model_name))
+
+    if series:
+        logger.debug("Starting batch prediction of %d series for %d hours.", len(series), hours_to_predict)
+        forecaster = BatchRecursiveForecaster(series, lag_features=LAG_FEATURES)
+        for request, df_predictions in zip(tree_requests, forecaster.forecast(hours_to_predict)):
+            results[request] = df_predictions
+        logger.debug("Finished batch prediction of %d series.", len(series))
+
+    # Duplicate requests get their own copy so callers can modify frames independently
+    return [results[request].copy() for request in requests]
@@ -0,0 +1,215 @@
+import os
+import time
+import argparse
+import joblib
+import pandas as pd
+from sklearn.base import clone
+from app.utils.preprocess import prepare_data_for_training
+from app.ml.ensemble import ALL_MODEL_NAMES
+from app.ml.artifacts import publish_model, load_model_meta
+from app.ml.registry import model_registry
+from app.ml.train_models import (
+    CITIES, LAG_FEATURES, MODELS_DIR, PRECOMPUTE_PROPHET_FORECAST,
+    build_model, reset_thread_params, precompute_prophet_forecast,
+)
+from app.ml.evaluate import evaluate_model, save_model_metrics
+from app.ml.train_scheduler import run_training_jobs, TRAIN_CPU_BUDGET, TRAIN_MAX_PARALLEL_JOBS
+import warnings
+
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+# Boosting rounds added per target on each incremental refresh
+REFRESH_BOOST_ROUNDS = int(os.getenv("REFRESH_BOOST_ROUNDS", "20"))
+# Learning rate of the added LightGBM/XGBoost rounds; kept low so a small batch
+# of new rows does not pull the model away from the rest of the history
+REFRESH_LEARNING_RATE = float(os.getenv("REFRESH_LEARNING_RATE", "0.05"))
+# Minimum rows per leaf of the added trees. Leaves backed by a handful of new rows
+# otherwise shift predictions for every input outside the new rows' range.
+REFRESH_MIN_LEAF_ROWS = int(os.getenv("REFRESH_MIN_LEAF_ROWS", "20"))
+# Fewer new hours than this are not worth a refresh; the model is left as is
+REFRESH_MIN_NEW_ROWS = int(os.getenv("REFRESH_MIN_NEW_ROWS", "24"))
+# A model whose last full training is older than this is retrained from scratch
+REFRESH_FULL_RETRAIN_HOURS = float(os.getenv("REFRESH_FULL_RETRAIN_HOURS", str(24 * 7)))
+# Progress of the current refresh run, used to resume after a crash
+REFRESH_STATE_FILE = os.path.join(MODELS_DIR, '.refresh_state.json')
+
+# Models that can continue from their previous fit. ExtraTrees and
+# HistGradientBoosting only pick up new data at the scheduled full retrain.
+INCREMENTAL_MODELS = {"LightGBM", "XGBoost", "CatBoost", "Prophet"}
+
+
+def _continue_estimator(model_name, estimator, X, y, n_jobs=None):
+    """Fit REFRESH_BOOST_ROUNDS more trees for one target on the new rows only."""
+    if model_name == "LightGBM":
+        updated = clone(estimator).set_params(
+            n_estimators=REFRESH_BOOST_ROUNDS, learning_rate=REFRESH_LEARNING_RATE,
+            min_child_samples=REFRESH_MIN_LEAF_ROWS, n_jobs=n_jobs,
+        )
+        return updated.fit(X, y, init_model=estimator.booster_)
+    if model_name == "XGBoost":
+        updated = clone(estimator).set_params(
+            n_estimators=REFRESH_BOOST_ROUNDS, learning_rate=REFRESH_LEARNING_RATE,
+            # Squared error has unit hessian, so the hessian sum is the row count
+            min_child_weight=REFRESH_MIN_LEAF_ROWS, n_jobs=n_jobs,
+        )
+        return updated.fit(X, y, xgb_model=estimator.get_booster())
+    if model_name == "CatBoost":
+        # Keep the learning rate CatBoost picked for the full data set; its
+        # automatic choice for a small batch of rows would be far larger
+        # (sklearn's clone keeps CatBoost's fitted state, so the estimator is rebuilt from its params)
+        params = {
+            **estimator.get_params(),
+            "iterations": REFRESH_BOOST_ROUNDS,
+            "learning_rate": estimator.get_all_params()["learning_rate"],
+            "thread_count": n_jobs or -1,
+        }
+        return type(estimator)(**params).fit(X, y, init_model=estimator)
+    raise ValueError(f"{model_name} does not support continued boosting")
+
+
+def prophet_warm_start_params(model):
+    """Stan initial values from a fitted Prophet model (Prophet's documented warm start)."""
+    params = {}
+    for name in ["k", "m", "sigma_obs"]:
+        params[name] = model.params[name][0][0]
+    for name in ["delta", "beta"]:
+        params[name] = model.params[name][0]
+    return params
+
+
+def refresh_incrementally(model, model_name, X_new, y_new, X, y, n_jobs=None):
+    """Return an updated copy of ``model``; the live model object is not modified.
+
+    Boosted models get extra rounds fitted to the new rows only. Prophet is
+    refitted on the full history, starting from the previous parameters so the
+    optimizer converges in a fraction of the time.
+    """
+    if model_name == "Prophet":
+        init = [prophet_warm_start_params(target_model) for target_model in model.models]
+        updated = build_model("Prophet")
+        return updated.fit(X, y, init=init)
+
+    updated = clone(model)
+    updated.estimators_ = [
+        _continue_estimator(model_name, estimator, X_new, y_new.iloc[:, i], n_jobs=n_jobs)
+        for i, estimator in enumerate(model.estimators_)
+    ]
+    for attr in ("n_features_in_", "feature_names_in_"):
+        if hasattr(model, attr):
+            setattr(updated, attr, getattr(model, attr))
+    return updated
+
+
+def full_retrain_due(meta, now=None):
+    if not meta or "full_trained_at" not in meta:
+        return True
+    now = now or time.time()
+    return (now - meta["full_trained_at"]) / 3600 >= REFRESH_FULL_RETRAIN_HOURS
+
+
+def refresh_city_model(city, model_name, n_jobs=None, force_full=False):
+    """Bring one live model up to date with the rows appended since it was trained.
+
+    Chooses between nothing (too few new rows), an incremental refresh and a
+    full retrain (no metadata, forced, or REFRESH_FULL_RETRAIN_HOURS since the
+    last one). Returns ``{"action": ..., "error": ..., "version": ...}``.
+    """
+    model_filename = model_registry.model_path(city, model_name)
+    meta = load_model_meta(city, model_name)
+    try:
+        X, y = prepare_data_for_training(city, lag_features=LAG_FEATURES)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ Error processing data for {city}: {e}")
+        return {"action": "skipped", "error": str(e)}
+    if X.empty:
+        return {"action": "skipped", "error": None}
+
+    full = force_full or not os.path.exists(model_filename) or full_retrain_due(meta)
+    if not full:
+        trained_through = pd.Timestamp(meta["trained_through"])
+        new_rows = X.index > trained_through
+        if new_rows.sum() < REFRESH_MIN_NEW_ROWS:
+            print(f"✅ {model_name} for {city} is up to date ({new_rows.sum()} new rows since {trained_through}).")
+            return {"action": "up_to_date", "error": None}
+        if model_name not in INCREMENTAL_MODELS:
+            print(f"⏭️ {model_name} for {city} has {new_rows.sum()} new rows; waiting for the scheduled full retrain.")
+            return {"action": "deferred", "error": None}
+
+    try:
+        if full:
+            reason = "forced" if force_full else "no refresh metadata" if not meta else "scheduled"
+            print(f"Full retrain of {model_name} for {city} ({reason}) on {len(X)} rows...")
+            model = build_model(model_name, n_jobs=n_jobs).fit(X, y)
+            meta = {"kind": "full", "full_trained_at": time.time(), "incremental_refreshes": 0}
+        else:
+            X_new, y_new = X[new_rows], y[new_rows]
+            print(f"Incremental refresh of {model_name} for {city} on {len(X_new)} new rows...")
+            model = refresh_incrementally(joblib.load(model_filename), model_name, X_new, y_new, X, y, n_jobs=n_jobs)
+            meta = {
+                "kind": "incremental",
+                "full_trained_at": meta["full_trained_at"],
+                "incremental_refreshes": meta.get("incremental_refreshes", 0) + 1,
+                "new_rows": int(len(X_new)),
+            }
+
+        version = publish_model(
+            reset_thread_params(model), city, model_name,
+            trained_through=str(X.index.max()), rows=len(X), **meta,
+        )
+        print(f"✅ Published {model_name} for {city} as version {version} ({meta['kind']})")
+    except Exception as e:
+        print(f"❌ Error refreshing {model_name} for {city}: {e}")
+        return {"action": "full" if full else "incremental", "error": str(e)}
+
+    if model_name == "Prophet" and PRECOMPUTE_PROPHET_FORECAST:
+        precompute_prophet_forecast(model, city)
+    # Every published version gets fresh metrics and holdout predictions, so /model-metrics
+    # describes the live model and the Ensemble never has to re-predict a stale member
+    try:
+        metrics_file = save_model_metrics(city, model_name, evaluate_model(model, X, y, city=city, model_name=model_name))
+        print(f"✅ Saved evaluation metrics to {metrics_file}")
+    except Exception as e:
+        print(f"❌ Error evaluating {model_name} for {city}: {e}")
+    return {"action": meta["kind"], "error": None, "version": version}
+
+
+def _refresh_job(city, model_name, n_jobs):
+    return refresh_city_model(city, model_name, n_jobs=n_jobs)
+
+
+def _full_retrain_job(city, model_name, n_jobs):
+    return refresh_city_model(city, model_name, n_jobs=n_jobs, force_full=True)
+
+
+def refresh_all_models(cities=CITIES, model_names=ALL_MODEL_NAMES, force_full=False,
+                       cpu_budget=TRAIN_CPU_BUDGET, max_parallel_jobs=TRAIN_MAX_PARALLEL_JOBS, resume=True):
+    """Refresh every city x model pair through the training scheduler."""
+    jobs = [(city, model_name) for city in cities for model_name in model_names]
+    return run_training_jobs(
+        _full_retrain_job if force_full else _refresh_job,
+        jobs,
+        REFRESH_STATE_FILE,
+        cpu_budget=cpu_budget,
+        max_parallel_jobs=max_parallel_jobs,
+        resume=resume,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update trained models with newly appended hours.")
+    parser.add_argument("--cities", default=",".join(CITIES))
+    parser.add_argument("--models", default=",".join(ALL_MODEL_NAMES))
+    parser.add_argument("--full", action="store_true", help="Retrain from scratch instead of refreshing")
+    parser.add_argument("--cpu-budget", type=int, default=TRAIN_CPU_BUDGET)
+    parser.add_argument("--max-parallel-jobs", type=int, default=TRAIN_MAX_PARALLEL_JOBS)
+    parser.add_argument("--fresh", action="store_true", help="Ignore the state of an interrupted run")
+    args = parser.parse_args()
+
+    refresh_all_models(
+        args.cities.split(","),
+        args.models.split(","),
+        force_full=args.full,
+        cpu_budget=args.cpu_budget,
+        max_parallel_jobs=args.max_parallel_jobs,
+        resume=not args.fresh,
+    )
@@ -0,0 +1,147 @@
+import os
+import logging
+import threading
+import time
+from collections import OrderedDict
+# Import ProphetRegressor to ensure it's available when unpickling models
+from app.ml.models import ProphetRegressor
+from app.ml.flat_forest import load_model_file
+
+# WEATHER_MODELS_DIR points the app at another model directory (e.g. the benchmark suite's)
+MODELS_DIR = os.getenv("WEATHER_MODELS_DIR", os.path.join(os.path.dirname(__file__), '..', 'models'))
+# Memory budget for unpickled models. The on-disk pickle size is used as the
+# estimate of a model's in-memory footprint.
+MODEL_CACHE_MAX_MB = float(os.getenv("MODEL_CACHE_MAX_MB", "4096"))
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """Process-wide LRU cache of loaded models keyed by (city, model_name).
+
+    Models are loaded lazily on first use (or eagerly via ``preload``) and kept
+    until the memory budget is exceeded. A model is reloaded transparently when
+    its ``.pkl`` file changes on disk.
+    """
+
+    def __init__(self, models_dir=MODELS_DIR, max_bytes=int(MODEL_CACHE_MAX_MB * 1024 * 1024)):
+        self.models_dir = models_dir
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (city, model_name) -> (model, mtime_ns, size)
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.load_time = 0.0
+        self.last_load_times = {}
+
+    def model_path(self, city_name, model_name):
+        return os.path.join(self.models_dir, f"{city_name}_{model_name}.pkl")
+
+    def get(self, city_name, model_name):
+        key = (city_name, model_name)
+        model_filename = self.model_path(city_name, model_name)
+        try:
+            stat = os.stat(model_filename)
+        except FileNotFoundError:
+            self.invalidate(city_name, model_name)
+            raise FileNotFoundError(f"Model file not found: {model_filename}")
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == stat.st_mtime_ns and entry[2] == stat.st_size:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so cached models stay available while
+        # a large pickle is being read. The per-key lock stops concurrent
+        # requests from unpickling the same file twice.
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] == stat.st_mtime_ns and entry[2] == stat.st_size:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                reload = entry is not None
+
+            start = time.perf_counter()
+            # Tree forests with a current .forest artifact are memory-mapped instead of unpickled
+            model = load_model_file(model_filename)
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self.misses += 1
+                if reload:
+                    self.reloads += 1
+                    logger.info("Reloaded %s for %s (model file changed)", model_name, city_name)
+                self.load_time += elapsed
+                self.last_load_times[f"{city_name}_{model_name}"] = elapsed
+                self._remove(key)
+                self._entries[key] = (model, stat.st_mtime_ns, stat.st_size)
+                self._bytes += stat.st_size
+                self._evict(keep=key)
+        return model
+
+    def preload(self, cities, model_names):
+        """Load every available (city, model) pair up front."""
+        loaded = 0
+        for city_name in cities:
+            for model_name in model_names:
+                try:
+                    self.get(city_name, model_name)
+                    loaded += 1
+                except FileNotFoundError:
+                    logger.warning("Model %s for %s not found. Skipping preload.", model_name, city_name)
+        return loaded
+
+    def invalidate(self, city_name=None, model_name=None):
+        """Drop cached models matching the given city and/or model name."""
+        with self._lock:
+            for key in list(self._entries):
+                if (city_name is None or key[0] == city_name) and (model_name is None or key[1] == model_name):
+                    self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "models": [f"{city}_{model}" for city, model in self._entries],
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else None,
+                "reloads": self.reloads,
+                "evictions": self.evictions,
+                "load_time_seconds": self.load_time,
+                "last_load_times_seconds": dict(self.last_load_times),
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _evict(self, keep):
+        # The most recently loaded model is always kept, even if it alone
+        # exceeds the budget.
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            self._remove(key)
+            self.evictions += 1
+
+
+model_registry = ModelRegistry()
+
+
+def get_model(city_name, model_name):
+    return model_registry.get(city_name, model_name)
@@ -2,91 +2,185 @@ import pandas as pd
 import numpy as np
 import joblib
 import os
+import time
+import argparse
 from sklearn.ensemble import ExtraTreesRegressor, HistGradientBoostingRegressor
 from sklearn.multioutput import MultiOutputRegressor
 import lightgbm as lgb
 import xgboost as xgb
 import catboost as cb
 from app.utils.preprocess import prepare_data_for_training, TARGET_FEATURES
-from app.ml.models import ProphetRegressor
+from app.ml.models import ProphetRegressor, DirectMultiHorizonRegressor
 from app.ml.evaluate import evaluate_model, save_model_metrics
+from app.ml.ensemble import ALL_MODEL_NAMES
+from app.ml.artifacts import publish_model
+from app.ml.predict import save_prophet_forecast, load_prophet_forecast
+from app.ml.train_scheduler import run_training_jobs, TRAIN_CPU_BUDGET, TRAIN_MAX_PARALLEL_JOBS
 import warnings
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 
-CITIES = ["ahmedabad", "mumbai", "delhi", "bengaluru"]
+# WEATHER_CITIES (comma-separated) replaces the default city list
+CITIES = os.getenv("WEATHER_CITIES", "ahmedabad,mumbai,delhi,bengaluru").split(",")
 LAG_FEATURES = 24
-MODELS_DIR = os.path.join(os.path.dirname(__file__), '..', 'models')
-DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+MODELS_DIR = os.getenv("WEATHER_MODELS_DIR", os.path.join(os.path.dirname(__file__), '..', 'models'))
+DATA_DIR = os.getenv("WEATHER_DATA_DIR", os.path.join(os.path.dirname(__file__), '..', 'data'))
+
+# Hours the Direct model forecasts per call; longer forecasts chain calls
+DIRECT_HORIZON_HOURS = int(os.getenv("DIRECT_HORIZON_HOURS", "336"))
+
+# Store a one-year Prophet forecast per city so extended requests are served as slices
+# (set PRECOMPUTE_PROPHET_FORECAST=0 to skip it)
+PRECOMPUTE_PROPHET_FORECAST = os.getenv("PRECOMPUTE_PROPHET_FORECAST", "1") == "1"
 
 os.makedirs(MODELS_DIR, exist_ok=True)
 
-models_config = {
-    "LightGBM": MultiOutputRegressor(lgb.LGBMRegressor(random_state=42)),
-    "CatBoost": MultiOutputRegressor(cb.CatBoostRegressor(random_state=42, verbose=0)),
-    "ExtraTrees": ExtraTreesRegressor(random_state=42, n_estimators=100),
-    "XGBoost": MultiOutputRegressor(xgb.XGBRegressor(random_state=42, objective='reg:squarederror')),
-    "HistGradientBoosting": MultiOutputRegressor(HistGradientBoostingRegressor(random_state=42)),
-    "Prophet": ProphetRegressor()
-}
+# Each (city, model) pair is an independent training job
+MODEL_NAMES = ALL_MODEL_NAMES
+# Progress of the current training run, used to resume after a crash
+TRAIN_STATE_FILE = os.path.join(MODELS_DIR, '.train_state.json')
+
+def build_model(model_name, n_jobs=None):
+    """Create a fresh, unfitted estimator for one training job.
+
+    ``n_jobs`` is the number of threads the library may use (None keeps the
+    library default). HistGradientBoosting, Prophet and Direct have no thread setting;
+    the scheduler limits HistGradientBoosting through its OpenMP pool.
+    """
+    if model_name == "LightGBM":
+        return MultiOutputRegressor(lgb.LGBMRegressor(random_state=42, n_jobs=n_jobs))
+    if model_name == "CatBoost":
+        return MultiOutputRegressor(cb.CatBoostRegressor(random_state=42, verbose=0, thread_count=n_jobs or -1))
+    if model_name == "ExtraTrees":
+        return ExtraTreesRegressor(random_state=42, n_estimators=100, n_jobs=n_jobs)
+    if model_name == "XGBoost":
+        return MultiOutputRegressor(xgb.XGBRegressor(random_state=42, objective='reg:squarederror', n_jobs=n_jobs))
+    if model_name == "HistGradientBoosting":
+        return MultiOutputRegressor(HistGradientBoostingRegressor(random_state=42))
+    if model_name == "Prophet":
+        return ProphetRegressor()
+    if model_name == "Direct":
+        return DirectMultiHorizonRegressor(horizon=DIRECT_HORIZON_HOURS)
+    raise ValueError(f"Unknown model name: {model_name}")
+
+def reset_thread_params(model):
+    """Restore library-default threading on a fitted model before it is saved.
+
+    Training jobs get a share of the CPU budget; the served model should not
+    keep that limit.
+    """
+    # CatBoost is left alone: a fitted CatBoost model rejects set_params, and its
+    # predict() uses all cores regardless of the training thread_count
+    estimators = [model, getattr(model, "estimator", None)] + list(getattr(model, "estimators_", []))
+    for estimator in estimators:
+        if estimator is None or not hasattr(estimator, "get_params"):
+            continue
+        if "n_jobs" in estimator.get_params(deep=False):
+            estimator.set_params(n_jobs=None)
+    return model
+
+def precompute_prophet_forecast(model, city):
+    try:
+        print(f"Precomputing one-year Prophet forecast for {city}...")
+        forecast_file = save_prophet_forecast(model, city)
+        print(f"✅ Saved Prophet forecast to {forecast_file}")
+    except Exception as forecast_error:
+        print(f"❌ Error precomputing Prophet forecast for {city}: {forecast_error}")
+
+def train_city_model(city, model_name, n_jobs=None):
+    """Train (or re-evaluate an existing) model for one city; one scheduler job.
 
-def train_all_models():
+    Returns ``{"action": "trained" | "evaluated" | "skipped", "error": str | None}``.
+    """
+    try:
+        X, y = prepare_data_for_training(city, lag_features=LAG_FEATURES)
+        print(f"Loaded and preprocessed data for {city}. Shape X: {X.shape}, y: {y.shape}")
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ Error processing data for {city}: {e}")
+        return {"action": "skipped", "error": str(e)}
+
+    if X.empty or y.empty:
+        print(f"⚠️ No data available for training {city} after preprocessing. Skipping.")
+        return {"action": "skipped", "error": None}
+
+    # Check if model already exists
+    model_filename = os.path.join(MODELS_DIR, f"{city}_{model_name}.pkl")
+    if os.path.exists(model_filename):
+        print(f"✅ Model {model_name} for {city} already exists. Skipping training.")
+        
+        # Try to evaluate using the existing model
+        error = None
+        try:
+            existing_model = joblib.load(model_filename)
+            print(f"Evaluating existing {model_name} model for {city}...")
+            metrics = evaluate_model(existing_model, X, y, city=city, model_name=model_name)
+            metrics_file = save_model_metrics(city, model_name, metrics)
+            print(f"✅ Saved evaluation metrics to {metrics_file}")
+            if model_name == "Prophet" and PRECOMPUTE_PROPHET_FORECAST and load_prophet_forecast(city) is None:
+                precompute_prophet_forecast(existing_model, city)
+        except Exception as eval_error:
+            print(f"❌ Error evaluating existing {model_name} for {city}: {eval_error}")
+            error = str(eval_error)
+
+        return {"action": "evaluated", "error": error}
+    
+    print(f"Training {model_name} for {city} with {n_jobs or 'default'} thread(s)...")
+    try:
+        model = build_model(model_name, n_jobs=n_jobs)
+        model.fit(X, y)
+        # Published as a new model version; the live .pkl is swapped atomically
+        version = publish_model(
+            reset_thread_params(model),
+            city,
+            model_name,
+            kind="full",
+            trained_through=str(X.index.max()),
+            full_trained_at=time.time(),
+            incremental_refreshes=0,
+            rows=len(X),
+        )
+        print(f"✅ Saved {model_name} model for {city} to {model_filename} (version {version})")
+
+        if model_name == "Prophet" and PRECOMPUTE_PROPHET_FORECAST:
+            precompute_prophet_forecast(model, city)
+        
+        # Evaluate and save metrics after training
+        print(f"Evaluating {model_name} model for {city}...")
+        metrics = evaluate_model(model, X, y, city=city, model_name=model_name)
+        metrics_file = save_model_metrics(city, model_name, metrics)
+        print(f"✅ Saved evaluation metrics to {metrics_file}")
+
+    except Exception as train_error:
+        print(f"❌ Error training {model_name} for {city}: {train_error}")
+        return {"action": "trained", "error": str(train_error)}
+    return {"action": "trained", "error": None}
+
+def train_all_models(cpu_budget=TRAIN_CPU_BUDGET, max_parallel_jobs=TRAIN_MAX_PARALLEL_JOBS, resume=True):
+    """Train every city x model pair through the parallel training scheduler."""
+    jobs = []
     for city in CITIES:
-        print(f"\n--- Processing City: {city.title()} ---")
         city_file = os.path.join(DATA_DIR, f"{city}.csv")
         if not os.path.exists(city_file):
             print(f"⚠️ Data file not found for {city}. Skipping.")
             continue
+        jobs.extend((city, model_name) for model_name in MODEL_NAMES)
 
-        try:
-            X, y = prepare_data_for_training(city, lag_features=LAG_FEATURES)
-            print(f"Loaded and preprocessed data for {city}. Shape X: {X.shape}, y: {y.shape}")
-
-            if X.empty or y.empty:
-                print(f"⚠️ No data available for training {city} after preprocessing. Skipping.")
-                continue
-
-            for model_name, model in models_config.items():
-                # Check if model already exists
-                model_filename = os.path.join(MODELS_DIR, f"{city}_{model_name}.pkl")
-                if os.path.exists(model_filename):
-                    print(f"✅ Model {model_name} for {city} already exists. Skipping training.")
-                    
-                    # Try to evaluate using the existing model
-                    try:
-                        existing_model = joblib.load(model_filename)
-                        print(f"Evaluating existing {model_name} model for {city}...")
-                        metrics = evaluate_model(existing_model, X, y)
-                        metrics_file = save_model_metrics(city, model_name, metrics)
-                        print(f"✅ Saved evaluation metrics to {metrics_file}")
-                    except Exception as eval_error:
-                        print(f"❌ Error evaluating existing {model_name} for {city}: {eval_error}")
-                    
-                    continue
-                
-                print(f"Training {model_name} for {city}...")
-                try:
-                    model.fit(X, y)
-                    joblib.dump(model, model_filename)
-                    print(f"✅ Saved {model_name} model for {city} to {model_filename}")
-                    
-                    # Evaluate and save metrics after training
-                    print(f"Evaluating {model_name} model for {city}...")
-                    metrics = evaluate_model(model, X, y)
-                    metrics_file = save_model_metrics(city, model_name, metrics)
-                    print(f"✅ Saved evaluation metrics to {metrics_file}")
-
-                except Exception as train_error:
-                    print(f"❌ Error training {model_name} for {city}: {train_error}")
-
-        except FileNotFoundError as e:
-            print(f"❌ {e}")
-        except ValueError as e:
-             print(f"❌ Error processing data for {city}: {e}")
-        except Exception as e:
-            print(f"❌ An unexpected error occurred for city {city}: {e}")
+    return run_training_jobs(
+        train_city_model,
+        jobs,
+        TRAIN_STATE_FILE,
+        cpu_budget=cpu_budget,
+        max_parallel_jobs=max_parallel_jobs,
+        resume=resume,
+    )
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train all city x model pairs in parallel.")
+    parser.add_argument("--cpu-budget", type=int, default=TRAIN_CPU_BUDGET, help="Cores shared by all jobs (env TRAIN_CPU_BUDGET)")
+    parser.add_argument("--max-parallel-jobs", type=int, default=TRAIN_MAX_PARALLEL_JOBS, help="Max concurrent jobs, 0 = up to the CPU budget (env TRAIN_MAX_PARALLEL_JOBS)")
+    parser.add_argument("--fresh", action="store_true", help="Ignore the state of an interrupted run")
+    args = parser.parse_args()
+
     print("🚀 Starting model training process...")
-    train_all_models()
+    train_all_models(cpu_budget=args.cpu_budget, max_parallel_jobs=args.max_parallel_jobs, resume=not args.fresh)
     print("\n🎯 Model training finished.")
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from threadpoolctl import threadpool_limits
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is then not reported
+    resource = None
+
+# Cores shared by all training jobs: job-level parallelism x per-job library threads
+TRAIN_CPU_BUDGET = int(os.getenv("TRAIN_CPU_BUDGET", str(os.cpu_count() or 1)))
+# Upper bound on concurrently running jobs (0 = as many as the CPU budget allows).
+# Lower it when several large models in memory at once would not fit in RAM.
+TRAIN_MAX_PARALLEL_JOBS = int(os.getenv("TRAIN_MAX_PARALLEL_JOBS", "0"))
+
+# Relative training cost, used to start the longest jobs first so the run does
+# not end with one big model training alone on a single core
+JOB_COST = {"ExtraTrees": 5, "CatBoost": 4, "Prophet": 4, "XGBoost": 3, "LightGBM": 2, "HistGradientBoosting": 2}
+# Jobs whose library cannot use more than one thread (Prophet fits through a single Stan process)
+SINGLE_THREADED_MODELS = {"Prophet"}
+
+
+def job_key(city, model_name):
+    return f"{city}/{model_name}"
+
+
+class TrainingState:
+    """Per-job progress of a training run, persisted as JSON after every change.
+
+    A run that crashes or is interrupted leaves jobs in the ``running`` or
+    ``failed`` state; the next run skips the ``done`` ones. Once a run has
+    finished, the next run starts from scratch.
+    """
+
+    def __init__(self, path, resume=True):
+        self.path = path
+        self.jobs = {}
+        self.started_at = time.time()
+        if resume:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        if state.get("finished"):
+            return
+        self.jobs = state.get("jobs", {})
+        self.started_at = state.get("started_at", self.started_at)
+        done = sum(1 for job in self.jobs.values() if job.get("status") == "done")
+        print(f"Resuming training run from {self.path}: {done} job(s) already done.")
+
+    def is_done(self, key):
+        return self.jobs.get(key, {}).get("status") == "done"
+
+    def update(self, key, **fields):
+        self.jobs.setdefault(key, {}).update(fields)
+        self.save()
+
+    def save(self, finished=False):
+        state = {"started_at": self.started_at, "finished": finished, "jobs": self.jobs}
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux; children covers the Stan process Prophet spawns
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / 1024
+
+
+def _cpu_seconds():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _run_job(job_fn, city, model_name, n_jobs):
+    """Run one training job in a fresh worker process and measure it."""
+    start = time.perf_counter()
+    cpu_start = _cpu_seconds()
+    # Caps OpenMP/BLAS pools too (HistGradientBoosting has no n_jobs parameter)
+    with threadpool_limits(limits=n_jobs):
+        result = job_fn(city, model_name, n_jobs)
+    wall = time.perf_counter() - start
+    return {
+        "result": result,
+        "wall_seconds": wall,
+        "cpu_seconds": _cpu_seconds() - cpu_start,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _threads_for(model_name, free_cpus, open_slots):
+    """Share the currently free CPUs evenly between the jobs that can still start."""
+    if model_name in SINGLE_THREADED_MODELS:
+        return 1
+    return max(1, free_cpus // max(1, open_slots))
+
+
+def run_training_jobs(job_fn, jobs, state_path, cpu_budget=TRAIN_CPU_BUDGET,
+                      max_parallel_jobs=TRAIN_MAX_PARALLEL_JOBS, resume=True):
+    """Run independent (city, model_name) training jobs in a process pool.
+
+    ``job_fn(city, model_name, n_jobs)`` must be a module-level function; it
+    runs in its own spawned process (one process per job, so memory of large
+    models is returned after each job and peak RSS is per job). Up to
+    ``max_parallel_jobs`` jobs run at once and the CPU budget is split between
+    them: a job gets an even share of the cores not used by running jobs, so
+    the last jobs of a run train with more threads. Returns the per-job report.
+    """
+    state = TrainingState(state_path, resume=resume)
+    pending = [job for job in jobs if not state.is_done(job_key(*job))]
+    pending.sort(key=lambda job: JOB_COST.get(job[1], 1), reverse=True)
+    skipped = len(jobs) - len(pending)
+    if skipped:
+        print(f"Skipping {skipped} job(s) completed by the interrupted run.")
+
+    cpu_budget = max(1, cpu_budget)
+    max_parallel = min(max_parallel_jobs or cpu_budget, cpu_budget, len(pending)) or 1
+    print(f"Training {len(pending)} job(s): up to {max_parallel} in parallel, CPU budget {cpu_budget}.")
+
+    executor = None
+    running = {}  # future -> (city, model_name, n_jobs)
+
+    def finish(future):
+        """Record a finished job; returns its key if it was lost with a broken pool."""
+        city, model_name, n_jobs = running.pop(future)
+        key = job_key(city, model_name)
+        try:
+            measured = future.result()
+        except BrokenProcessPool:
+            return key
+        except Exception as e:
+            print(f"❌ Training job {key} failed: {e}")
+            state.update(key, status="failed", error=str(e))
+            return None
+        result = measured.pop("result") or {}
+        status = "failed" if result.get("error") else "done"
+        state.update(key, status=status, finished_at=time.time(), **result, **measured)
+        rss = f"{measured['peak_rss_mb']:.0f} MB" if measured["peak_rss_mb"] is not None else "n/a"
+        print(f"{'✅' if status == 'done' else '❌'} {key}: {measured['wall_seconds']:.1f}s wall, "
+              f"{measured['cpu_seconds']:.1f}s CPU, {n_jobs} thread(s), peak RSS {rss}")
+        return None
+
+    try:
+        while pending or running:
+            if executor is None:
+                executor = ProcessPoolExecutor(
+                    max_workers=max_parallel,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=1,
+                )
+            while pending and len(running) < max_parallel:
+                city, model_name = pending.pop(0)
+                free_cpus = cpu_budget - sum(n_jobs for _, _, n_jobs in running.values())
+                open_slots = min(max_parallel - len(running), len(pending) + 1)
+                n_jobs = _threads_for(model_name, free_cpus, open_slots)
+                state.update(job_key(city, model_name), status="running", n_jobs=n_jobs, error=None)
+                running[executor.submit(_run_job, job_fn, city, model_name, n_jobs)] = (city, model_name, n_jobs)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            lost = [key for key in map(finish, done) if key]
+            if lost:
+                # A worker died (e.g. killed for running out of memory). Jobs that finished before
+                # it are recorded above; the others fail with BrokenProcessPool as the pool breaks,
+                # so wait for them to settle, keep any that still completed and rebuild the pool.
+                lost += [key for key in map(finish, wait(running).done) if key]
+                print(f"❌ Worker process died while training {', '.join(lost)}.")
+                for lost_key in lost:
+                    state.update(lost_key, status="failed", error="worker process died")
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = None
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    finished = all(job.get("status") == "done" for job in state.jobs.values())
+    state.save(finished=finished)
+    print_training_report(state.jobs)
+    return state.jobs
+
+
+def print_training_report(jobs):
+    print("\n--- Training report ---")
+    print(f"{'job':<34} {'status':<8} {'threads':>7} {'wall s':>9} {'CPU s':>9} {'peak RSS MB':>12}")
+    for key, job in sorted(jobs.items()):
+        wall = job.get("wall_seconds")
+        cpu = job.get("cpu_seconds")
+        rss = job.get("peak_rss_mb")
+        print(f"{key:<34} {job.get('status', '?'):<8} {job.get('n_jobs') or '':>7} "
+              f"{'' if wall is None else f'{wall:.1f}':>9} {'' if cpu is None else f'{cpu:.1f}':>9} "
+              f"{'' if rss is None else f'{rss:.0f}':>12}")
@@ -0,0 +1,180 @@
+import os
+import logging
+import json
+import threading
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 1
+EPOCH = np.datetime64("1970-01-01T00:00:00", "s")
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryStore:
+    """Binary columnar copy of the per-city CSV files.
+
+    Each CSV is converted once into ``<store_dir>/<name>/``:
+
+    * ``index.npy``  - int64 hours since 1970-01-01, sorted
+    * ``values.npy`` - (n_columns, n_rows) float32 array, one contiguous row per column
+    * ``meta.json``  - CSV mtime/size the store was built from, column names and
+      the number of decimals needed to restore the exact CSV values
+
+    Both arrays are memory-mapped, so reading the last few rows only touches the
+    end of each column. The store is rebuilt automatically when the CSV changes
+    and opened stores are kept in an in-process cache.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self._cache = {}  # csv_path -> entry dict
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.hits = 0
+        self.opens = 0
+
+    def read(self, csv_path, timestamp_col, columns, tail=None):
+        """Return the CSV contents as a DataFrame indexed by timestamp.
+
+        With ``tail`` only the last ``tail`` rows are read.
+        """
+        entry = self._entry(csv_path, timestamp_col, columns)
+        if "frame" in entry:
+            # CSV could not be stored as hourly epoch index; served from the parsed frame
+            df = entry["frame"]
+            return (df.iloc[-tail:] if tail else df).copy()
+
+        if tail is None and "full" in entry:
+            return entry["full"].copy()
+
+        index = entry["index"]
+        values = entry["values"]
+        if tail is not None:
+            index = index[-tail:]
+            values = values[:, -tail:]
+        df = self._to_frame(entry, index, values, timestamp_col)
+        if tail is None:
+            entry["full"] = df
+            return df.copy()
+        return df
+
+    def stats(self):
+        with self._lock:
+            return {
+                "stores": len(self._cache),
+                "builds": self.builds,
+                "opens": self.opens,
+                "hits": self.hits,
+            }
+
+    def _store_path(self, csv_path):
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        return os.path.join(self.store_dir, name)
+
+    def _entry(self, csv_path, timestamp_col, columns):
+        stat = os.stat(csv_path)
+        version = [stat.st_mtime_ns, stat.st_size]
+        with self._lock:
+            entry = self._cache.get(csv_path)
+            if entry is not None and entry["version"] == version and entry["columns"] == list(columns):
+                self.hits += 1
+                return entry
+
+            path = self._store_path(csv_path)
+            entry = self._open(path, version, columns)
+            if entry is None:
+                entry = self._build(csv_path, path, version, timestamp_col, columns)
+            self._cache[csv_path] = entry
+            return entry
+
+    def _open(self, path, version, columns):
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if meta.get("format") != FORMAT_VERSION or meta.get("csv_version") != version or meta.get("columns") != list(columns):
+            return None
+        self.opens += 1
+        return {
+            "version": version,
+            "columns": meta["columns"],
+            "decimals": meta["decimals"],
+            "timestamp_dtype": meta["timestamp_dtype"],
+            "index": np.load(os.path.join(path, "index.npy"), mmap_mode="r"),
+            "values": np.load(os.path.join(path, "values.npy"), mmap_mode="r"),
+        }
+
+    def _build(self, csv_path, path, version, timestamp_col, columns):
+        df = pd.read_csv(csv_path)
+        df[timestamp_col] = pd.to_datetime(df[timestamp_col])
+        df.sort_values(timestamp_col, inplace=True)
+        df.set_index(timestamp_col, inplace=True)
+        for col in columns:
+            if col not in df.columns:
+                raise ValueError(f"Missing expected column '{col}' in {os.path.basename(csv_path)}")
+        df = df[list(columns)]
+
+        seconds = df.index.values.astype("datetime64[s]")
+        epoch_hours, remainder = np.divmod((seconds - EPOCH).astype(np.int64), 3600)
+        if np.any(remainder):
+            logger.warning("%s has timestamps off the hour; keeping it in memory only.", os.path.basename(csv_path))
+            return {"version": version, "columns": list(columns), "frame": df}
+
+        values64 = df.to_numpy(dtype=np.float64).T
+        values, decimals = _compact(values64)
+
+        meta = {
+            "format": FORMAT_VERSION,
+            "csv_version": version,
+            "columns": list(columns),
+            "rows": len(df),
+            "decimals": decimals,
+            "timestamp_dtype": str(df.index.dtype),
+        }
+        try:
+            _write_store(path, epoch_hours.astype(np.int64), np.ascontiguousarray(values), meta)
+        except OSError as e:
+            logger.warning("Could not write history store for %s: %s. Keeping it in memory only.", os.path.basename(csv_path), e)
+            return {"version": version, "columns": list(columns), "frame": df}
+        self.builds += 1
+        logger.info("Built columnar history store for %s (%d rows)", os.path.basename(csv_path), len(df))
+        return self._open(path, version, columns)
+
+    def _to_frame(self, entry, index, values, timestamp_col):
+        values = np.asarray(values, dtype=np.float64)
+        if entry["decimals"] is not None:
+            values = np.round(values, entry["decimals"])
+        timestamps = (EPOCH + np.asarray(index, dtype=np.int64) * np.timedelta64(3600, "s")).astype(entry["timestamp_dtype"])
+        df = pd.DataFrame(values.T, columns=entry["columns"], index=pd.DatetimeIndex(timestamps, name=timestamp_col))
+        return df
+
+
+def _write_store(path, index, values, meta):
+    # Arrays first, metadata last: a store is only valid once meta.json points at its CSV version
+    os.makedirs(path, exist_ok=True)
+    suffix = f".{os.getpid()}.tmp"
+    for name, array in (("index.npy", index), ("values.npy", values)):
+        # np.save appends .npy unless the name already ends with it
+        tmp_path = os.path.join(path, name + suffix + ".npy")
+        np.save(tmp_path, array)
+        os.replace(tmp_path, os.path.join(path, name))
+    tmp_path = os.path.join(path, "meta.json" + suffix)
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=4)
+    os.replace(tmp_path, os.path.join(path, "meta.json"))
+
+
+def _compact(values64):
+    """Store values as float32 when rounding restores the exact float64 values.
+
+    Weather readings carry only a few decimals, so float32 plus the decimal
+    count is lossless. Falls back to float64 (decimals=None) otherwise.
+    """
+    values32 = values64.astype(np.float32)
+    restored = values32.astype(np.float64)
+    for decimals in range(7):
+        if np.array_equal(np.round(restored, decimals), values64, equal_nan=True):
+            return values32, decimals
+    return values64, None
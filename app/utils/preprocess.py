@@ -1,24 +1,30 @@
 import pandas as pd
 import numpy as np
 import os
+from numpy.lib.stride_tricks import sliding_window_view
+from app.utils.history_store import HistoryStore
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+# WEATHER_DATA_DIR points the app at another directory of <city>.csv files
+DATA_DIR = os.getenv("WEATHER_DATA_DIR", os.path.join(os.path.dirname(__file__), '..', 'data'))
 TARGET_FEATURES = ["Temperature (°C)", "Humidity (%)", "Wind Speed (km/h)", "Wind Direction (°)"]
 TIMESTAMP_COL = "Timestamp"
 LAG_FEATURES = 24
+CALENDAR_FEATURES = ["hour", "dayofweek", "month", "dayofyear"]
+# Training feature matrices are float32: half the memory of float64, and the
+# tree libraries bin or split in float32 anyway. Set to float64 for full precision.
+TRAIN_FEATURE_DTYPE = os.getenv("TRAIN_FEATURE_DTYPE", "float32")
+# Rows generated per chunk by build_feature_matrix
+FEATURE_CHUNK_ROWS = 65536
 
-def load_data(city_name):
+# Binary columnar copies of the CSVs, rebuilt whenever a CSV changes
+history_store = HistoryStore(os.path.join(DATA_DIR, '.history'))
+
+def load_data(city_name, tail=None):
+    """Load a city's history indexed by timestamp; ``tail`` limits it to the last rows."""
     file_path = os.path.join(DATA_DIR, f"{city_name}.csv")
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Data file not found for city: {city_name} at {file_path}")
-    df = pd.read_csv(file_path)
-    df[TIMESTAMP_COL] = pd.to_datetime(df[TIMESTAMP_COL])
-    df.sort_values(TIMESTAMP_COL, inplace=True)
-    df.set_index(TIMESTAMP_COL, inplace=True)
-    for col in TARGET_FEATURES:
-        if col not in df.columns:
-            raise ValueError(f"Missing expected column '{col}' in {city_name}.csv")
-    return df[TARGET_FEATURES]
+    return history_store.read(file_path, TIMESTAMP_COL, TARGET_FEATURES, tail=tail)
 
 def create_features(df, lag_features=LAG_FEATURES):
     df_feat = df.copy()
@@ -34,12 +40,111 @@ def create_features(df, lag_features=LAG_FEATURES):
     df_feat.dropna(inplace=True)
     return df_feat
 
-def prepare_data_for_training(city_name, lag_features=LAG_FEATURES):
+def get_feature_columns(lag_features=LAG_FEATURES):
+    """Feature column order produced by create_features (and expected by the saved models)."""
+    lag_columns = [f'{col}_lag_{lag}' for col in TARGET_FEATURES for lag in range(1, lag_features + 1)]
+    return lag_columns + CALENDAR_FEATURES
+
+def calendar_features(epoch_hours):
+    """Compute hour, dayofweek, month and dayofyear arithmetically from hours since 1970-01-01.
+
+    Matches the values pandas derives from a DatetimeIndex, without building one.
+    """
+    epoch_hours = np.asarray(epoch_hours, dtype=np.int64)
+    days = epoch_hours // 24
+    hour = epoch_hours - days * 24
+    dayofweek = (days + 3) % 7  # 1970-01-01 was a Thursday
+
+    # Civil-from-days conversion (proleptic Gregorian calendar)
+    z = days + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy_mar = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy_mar + 2) // 153
+    month = np.where(mp < 10, mp + 3, mp - 9)
+    year = yoe + era * 400 + (month <= 2)
+    is_leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    # Day of year counted from 1 January instead of 1 March
+    dayofyear = np.where(mp >= 10, doy_mar - 305, doy_mar + 60 + is_leap)
+
+    return np.stack([hour, dayofweek, month, dayofyear], axis=-1)
+
+def build_lag_matrix(series, lag_features=LAG_FEATURES, out=None):
+    """Lag block of the feature matrix, built from strided windows.
+
+    ``series`` is a (n_targets, n_rows) array with one contiguous row per
+    target. Row i of the result holds lags 1..lag_features of every target at
+    position i + lag_features, in get_feature_columns order. Each target is
+    copied once out of a sliding-window view; nothing else is materialized.
+    """
+    n_targets, n_rows = series.shape
+    n_out = max(0, n_rows - lag_features)
+    if out is None:
+        out = np.empty((n_out, n_targets * lag_features), dtype=series.dtype)
+    if n_out == 0:
+        return out
+    for t in range(n_targets):
+        # windows[i] = series[t, i : i + lag_features]; lag 1 is its newest value
+        windows = sliding_window_view(series[t, :-1], lag_features)
+        out[:, t * lag_features:(t + 1) * lag_features] = windows[:, ::-1]
+    return out
+
+def _complete_windows(series, lag_features):
+    """Positions whose row and lag window contain no NaN (the rows create_features keeps)."""
+    missing = np.isnan(series).any(axis=0)
+    positions = np.arange(lag_features, series.shape[1])
+    if not missing.any():
+        return positions
+    missing_before = np.concatenate([[0], np.cumsum(missing)])
+    return positions[missing_before[positions + 1] == missing_before[positions - lag_features]]
+
+def build_feature_matrix(df, lag_features=LAG_FEATURES, dtype=TRAIN_FEATURE_DTYPE, out=None,
+                         chunk_rows=FEATURE_CHUNK_ROWS):
+    """Training features for a history frame, equivalent to ``create_features``.
+
+    Returns ``(X, y, index)``: X is a (rows, features) array in
+    get_feature_columns order, y the float64 targets and index the timestamps
+    of the kept rows. X is written ``chunk_rows`` rows at a time, so passing a
+    memory-mapped ``out`` (see ``feature_matrix_rows``) keeps peak memory at
+    one chunk plus the history itself.
+    """
+    series = np.ascontiguousarray(df[TARGET_FEATURES].to_numpy(dtype=dtype).T)
+    positions = _complete_windows(series, lag_features)
+    n_features = len(TARGET_FEATURES) * lag_features + len(CALENDAR_FEATURES)
+    if out is None:
+        out = np.empty((len(positions), n_features), dtype=dtype)
+    elif out.shape != (len(positions), n_features):
+        raise ValueError(f"Feature matrix needs shape {(len(positions), n_features)}, got {out.shape}")
+
+    n_lags = len(TARGET_FEATURES) * lag_features
+    written = 0
+    for start in range(0, len(positions), chunk_rows):
+        chunk = positions[start:start + chunk_rows]
+        first, last = chunk[0], chunk[-1]
+        # Lags for every position first..last, then keep only the complete ones
+        lags = build_lag_matrix(series[:, first - lag_features:last + 1], lag_features)
+        rows = slice(written, written + len(chunk))
+        out[rows, :n_lags] = lags if len(chunk) == len(lags) else lags[chunk - first]
+        index = df.index[chunk]
+        out[rows, n_lags:] = np.column_stack([index.hour, index.dayofweek, index.month, index.dayofyear])
+        written += len(chunk)
+
+    y = df[TARGET_FEATURES].to_numpy(dtype=np.float64)[positions]
+    return out, y, df.index[positions]
+
+def feature_matrix_rows(df, lag_features=LAG_FEATURES):
+    """Number of rows build_feature_matrix will produce (to size a memory-mapped ``out``)."""
+    series = df[TARGET_FEATURES].to_numpy(dtype=np.float32).T
+    return len(_complete_windows(series, lag_features))
+
+def prepare_data_for_training(city_name, lag_features=LAG_FEATURES, dtype=TRAIN_FEATURE_DTYPE):
     df = load_data(city_name)
-    df_processed = create_features(df, lag_features)
+    values, targets, index = build_feature_matrix(df, lag_features, dtype=dtype)
 
-    X = df_processed.drop(columns=TARGET_FEATURES)
-    y = df_processed[TARGET_FEATURES]
+    # Single-block frames wrap the arrays without copying them
+    X = pd.DataFrame(values, index=index, columns=get_feature_columns(lag_features), copy=False)
+    y = pd.DataFrame(targets, index=index, columns=TARGET_FEATURES, copy=False)
 
     return X, y
 
@@ -0,0 +1,154 @@
+import json
+import numpy as np
+import pandas as pd
+from app.utils.preprocess import TIMESTAMP_COL
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow responses are optional
+    pa = None
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NDJSON_CHUNK_ROWS = 500
+COLUMNAR_MEDIA_TYPE = "application/vnd.weather.columnar+json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+# Values in every response format are rounded like the records JSON
+VALUE_DECIMALS = 2
+# Metric rows are keyed by these columns; the metric names become the value columns
+METRICS_KEY_COLUMNS = ["city", "model", "feature"]
+
+
+def arrow_available():
+    return pa is not None
+
+
+def format_records(df):
+    """Rows as dicts with formatted timestamps and values rounded to 2 decimals (the /predict JSON body)."""
+    df = df.copy()
+    df[TIMESTAMP_COL] = df[TIMESTAMP_COL].dt.strftime(TIMESTAMP_FORMAT)
+    return df.round(2).to_dict(orient='records')
+
+
+def iter_ndjson(df, chunk_rows=NDJSON_CHUNK_ROWS):
+    """Yield the forecast as newline-delimited JSON, one chunk of rows at a time.
+
+    Only ``chunk_rows`` row dicts exist at any moment, and the first bytes can
+    be sent as soon as the first chunk is formatted.
+    """
+    for start in range(0, len(df), chunk_rows):
+        records = format_records(df.iloc[start:start + chunk_rows])
+        yield "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+
+
+def time_axis(timestamps):
+    """Describe forecast timestamps as epoch seconds.
+
+    Evenly spaced timestamps (every plain forecast) collapse to ``start`` and
+    ``step``; anything else, e.g. a forecast filtered to one weekday, keeps the
+    full ``values`` list. Naive timestamps are read as UTC.
+    """
+    epochs = np.asarray(timestamps, dtype="datetime64[s]").astype(np.int64)
+    axis = {"column": TIMESTAMP_COL, "unit": "s"}
+    steps = np.diff(epochs)
+    if len(epochs) and (len(steps) == 0 or np.all(steps == steps[0])):
+        axis["start"] = int(epochs[0])
+        axis["step"] = int(steps[0]) if len(steps) else 0
+    else:
+        axis["values"] = epochs.tolist()
+    return axis, epochs
+
+
+def _value_list(values, decimals=VALUE_DECIMALS):
+    values = np.asarray(values, dtype=np.float64)
+    if decimals is not None:
+        values = np.round(values, decimals)
+    mask = np.isnan(values)
+    if not mask.any():
+        return values.tolist()
+    # NaN is not valid JSON
+    return [None if missing else value for value, missing in zip(values.tolist(), mask)]
+
+
+def _column_list(series):
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return _value_list(series.to_numpy(), decimals=None)
+    return [None if pd.isna(value) else value for value in series.tolist()]
+
+
+def forecast_to_columnar(df):
+    """Encode a forecast as one JSON object of column arrays plus a compact time axis.
+
+    ``{"time": {"column", "unit", "start", "step"}, "length": n, "columns": {name: [...]}}``
+    """
+    axis, _ = time_axis(df[TIMESTAMP_COL])
+    body = {
+        "time": axis,
+        "length": len(df),
+        "columns": {col: _value_list(df[col].to_numpy()) for col in df.columns if col != TIMESTAMP_COL},
+    }
+    return json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+
+def forecast_to_arrow(df):
+    """Encode a forecast as an Arrow IPC stream.
+
+    Value columns are float64; the time axis is stored in the schema metadata.
+    A timestamp column is only added when the timestamps are not evenly spaced.
+    """
+    axis, epochs = time_axis(df[TIMESTAMP_COL])
+    arrays, names = [], []
+    if "values" in axis:
+        arrays.append(pa.array(epochs, type=pa.timestamp("s")))
+        names.append(TIMESTAMP_COL)
+        axis = {key: value for key, value in axis.items() if key != "values"}
+    for col in df.columns:
+        if col != TIMESTAMP_COL:
+            arrays.append(pa.array(np.round(df[col].to_numpy(dtype=np.float64), VALUE_DECIMALS)))
+            names.append(col)
+    table = pa.Table.from_arrays(arrays, names=names)
+    table = table.replace_schema_metadata({"time": json.dumps(axis)})
+    return _write_arrow(table)
+
+
+def _is_metric_value(value):
+    return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+
+
+def flatten_metrics(metrics_by_city):
+    """Flatten ``{city: {model: {feature: {metric: value}}}}`` into one row per city/model/feature."""
+    rows = []
+    for city, models in metrics_by_city.items():
+        for model_name, features in models.items():
+            for feature, feature_metrics in features.items():
+                # Backtest files also hold per-horizon curves and run settings; only numeric metrics become rows
+                if not all(_is_metric_value(value) for value in feature_metrics.values()):
+                    continue
+                rows.append({"city": city, "model": model_name, "feature": feature, **feature_metrics})
+    df = pd.DataFrame(rows)
+    if df.empty:
+        df = pd.DataFrame(columns=METRICS_KEY_COLUMNS)
+    return df
+
+
+def table_to_columnar(df):
+    """Encode a plain table (e.g. flattened metrics) as ``{"length": n, "columns": {name: [...]}}``."""
+    body = {"length": len(df), "columns": {col: _column_list(df[col]) for col in df.columns}}
+    return json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+
+def table_to_arrow(df):
+    arrays = []
+    for col in df.columns:
+        if pd.api.types.is_numeric_dtype(df[col].dtype):
+            arrays.append(pa.array(df[col].to_numpy(dtype=np.float64), from_pandas=True))
+        else:
+            arrays.append(pa.array(df[col].astype(object).tolist(), type=pa.string()))
+    return _write_arrow(pa.Table.from_arrays(arrays, names=list(df.columns)))
+
+
+def _write_arrow(table):
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,237 @@
+import os
+import sys
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Set TELEMETRY_ENABLED=0 to skip stage timing entirely
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "1") == "1"
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = tuple(float(b) for b in os.getenv(
+    "LATENCY_BUCKETS", "0.0001,0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30").split(","))
+# Requests slower than this are profiled (0 = profiler off); the stacks of the
+# worker thread are sampled every PROFILE_SAMPLE_INTERVAL_SECONDS while it runs
+PROFILE_SLOW_REQUESTS_SECONDS = float(os.getenv("PROFILE_SLOW_REQUESTS_SECONDS", "0"))
+PROFILE_SAMPLE_INTERVAL_SECONDS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_SECONDS", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), '..', 'profiles'))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
+
+LABEL_NAMES = ("city", "model", "horizon")
+
+# Trace of the request the current worker is serving
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per label tuple."""
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: list(series) for labels, series in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.snapshot().items()):
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-1]!r}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+stage_seconds = Histogram(
+    "weather_stage_seconds",
+    "Time spent in each stage of a /predict request.",
+    LABEL_NAMES + ("stage",),
+)
+request_seconds = Histogram(
+    "weather_request_seconds",
+    "Total /predict latency by outcome.",
+    LABEL_NAMES + ("status",),
+)
+
+
+class Trace:
+    """Stage timings of one request; recorded into the histograms once it is done.
+
+    Spans are only collected while the request runs, so a trace built in a
+    worker process can be returned to the server and recorded there.
+    """
+
+    def __init__(self, city, model_name, horizon):
+        self.labels = (city, model_name, str(horizon))
+        self.spans = []  # (stage, seconds)
+
+    def add(self, stage, seconds):
+        self.spans.append((stage, seconds))
+
+
+@contextmanager
+def tracing(city, model_name, horizon):
+    """Collect the spans of the enclosed work into a new Trace."""
+    trace = Trace(city, model_name, horizon)
+    token = _trace.set(trace if TELEMETRY_ENABLED else None)
+    try:
+        with _profiled(trace):
+            yield trace
+    finally:
+        _trace.reset(token)
+
+
+def current_trace():
+    """The Trace of the request being served, or None outside ``tracing``."""
+    return _trace.get()
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as ``stage`` of the current request (no-op outside one)."""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append((stage, time.perf_counter() - start))
+
+
+def record(trace):
+    """Add a finished trace's spans to the stage histograms."""
+    for stage, seconds in trace.spans:
+        stage_seconds.observe(trace.labels + (stage,), seconds)
+
+
+def observe(labels, stage, seconds):
+    """Record one stage measured outside a trace (e.g. while a response streams)."""
+    if TELEMETRY_ENABLED:
+        stage_seconds.observe(tuple(labels) + (stage,), seconds)
+
+
+def observe_request(labels, status, seconds):
+    if TELEMETRY_ENABLED:
+        request_seconds.observe(tuple(labels) + (str(status),), seconds)
+
+
+def render_prometheus(gauges=None):
+    """The histograms, plus ``{name: (help, value)}`` gauges, in Prometheus text format."""
+    lines = []
+    for histogram in (request_seconds, stage_seconds):
+        lines.extend(histogram.render())
+    for name, (help_text, value) in sorted((gauges or {}).items()):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value!r}"]
+    return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """Samples the Python stacks of registered threads from one background thread.
+
+    Samples are folded into ``frame;frame;frame count`` lines (the input
+    format of flamegraph.pl and speedscope). A thread's samples are only
+    written out when its request turns out to be slow.
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self._samples = {}  # thread id -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._thread = None
+        self.profiles_written = 0
+
+    def start(self, thread_id):
+        with self._lock:
+            self._samples[thread_id] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._samples.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._samples:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, samples in self._samples.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[_fold(frame)] += 1
+
+    def write(self, trace, samples, elapsed):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if len(os.listdir(PROFILE_DIR)) >= PROFILE_MAX_FILES:
+            return None
+        city, model_name, horizon = trace.labels
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{city}_{model_name}_{horizon}h_{elapsed:.2f}s.folded")
+        with open(path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        self.profiles_written += 1
+        return path
+
+
+def _fold(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+profiler = SamplingProfiler()
+
+
+@contextmanager
+def _profiled(trace):
+    if PROFILE_SLOW_REQUESTS_SECONDS <= 0:
+        yield
+        return
+    thread_id = threading.get_ident()
+    start = time.perf_counter()
+    profiler.start(thread_id)
+    try:
+        yield
+    finally:
+        samples = profiler.stop(thread_id)
+        elapsed = time.perf_counter() - start
+        if elapsed >= PROFILE_SLOW_REQUESTS_SECONDS and samples:
+            path = profiler.write(trace, samples, elapsed)
+            if path:
+                logger.warning("Slow request (%.2fs) for %s; profile written to %s", elapsed, trace.labels, path)
@@ -0,0 +1,217 @@
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Absolute time.time() deadline of the request the current worker is serving
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class QueueFullError(Exception):
+    """Raised when the executor has no free worker or queue slot."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised inside a worker once its request's deadline has passed."""
+
+
+def check_deadline():
+    """Abort long-running work whose request has already timed out.
+
+    Called at safe points (each forecast step, each ensemble member); a no-op
+    outside of a BoundedExecutor job.
+    """
+    deadline = _deadline.get()
+    if deadline is not None and time.time() > deadline:
+        raise DeadlineExceeded("Request deadline exceeded.")
+
+
+def remaining_time():
+    """Seconds left before the current job's deadline, or None without a deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.time())
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """Run the enclosed work under ``deadline`` (time.time()), or the current one if earlier.
+
+    ``check_deadline`` calls inside it raise DeadlineExceeded once it passes.
+    """
+    current = _deadline.get()
+    if deadline is None or (current is not None and current < deadline):
+        deadline = current
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def _run_job(fn, deadline, args, kwargs):
+    started = time.time()
+    token = _deadline.set(deadline)
+    try:
+        # Don't start work for a request that already gave up while queued
+        check_deadline()
+        return started, fn(*args, **kwargs)
+    finally:
+        _deadline.reset(token)
+
+
+class BoundedExecutor:
+    """Thread or process pool with a bounded queue for CPU-bound request work.
+
+    ``run`` rejects new jobs with QueueFullError once ``max_workers`` jobs are
+    running and ``max_queue`` more are waiting, instead of letting requests
+    pile up. Each job gets a deadline: ``run`` raises DeadlineExceeded when it
+    passes, and the job itself stops at its next ``check_deadline`` call.
+    """
+
+    def __init__(self, max_workers=4, max_queue=16, kind="thread"):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self._executor = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="predict")
+        return self._executor
+
+    async def run(self, fn, *args, timeout=None, **kwargs):
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise QueueFullError(
+                    f"Prediction queue is full ({self.in_flight} requests in flight). Try again later."
+                )
+            self.in_flight += 1
+            self.submitted += 1
+
+        submitted_at = time.time()
+        deadline = submitted_at + timeout if timeout else None
+        try:
+            job = self._get_executor().submit(_run_job, fn, deadline, args, kwargs)
+        except Exception:
+            self._release()
+            raise
+        # The slot is freed when the job really ends, not when the caller stops waiting
+        job.add_done_callback(lambda _: self._release())
+        try:
+            started, result = await asyncio.wait_for(asyncio.wrap_future(job), timeout=timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise DeadlineExceeded(f"Prediction did not finish within {timeout}s.")
+        except DeadlineExceeded:
+            with self._lock:
+                self.timeouts += 1
+            raise
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+
+        wait = started - submitted_at
+        with self._lock:
+            self.completed += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        return result
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queue_depth": max(0, self.in_flight - self.max_workers),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "failed": self.failed,
+                "avg_wait_seconds": self.total_wait / self.completed if self.completed else None,
+                "max_wait_seconds": self.max_wait,
+            }
+
+
+class SingleFlight:
+    """Coalesces concurrent identical async calls into one running computation.
+
+    The first caller for a key (the leader) starts ``fn``; callers with the
+    same key that arrive while it runs attach to it and receive the same
+    result or exception. Nothing is kept once the call finishes, so this
+    needs no result cache. The computation runs as its own task: a caller
+    that is cancelled does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> asyncio.Task of the running computation
+        self.leaders = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+        self._waiters = {}  # key -> callers attached to the running computation
+
+    async def run(self, key, fn, *args, **kwargs):
+        """Await ``fn(*args, **kwargs)``, sharing a running call with the same key.
+
+        Returns ``(result, leader)``; ``leader`` is False for coalesced callers.
+        """
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._calls[key] = task
+            self._waiters[key] = 1
+            self.leaders += 1
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self._waiters[key] += 1
+            self.coalesced += 1
+            self.max_waiters = max(self.max_waiters, self._waiters[key])
+        return await asyncio.shield(task), leader
+
+    def _finish(self, key, task):
+        self._calls.pop(key, None)
+        self._waiters.pop(key, None)
+        if not task.cancelled():
+            # Mark the exception retrieved even if every caller gave up waiting
+            task.exception()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "max_waiters": self.max_waiters,
+        }
@@ -0,0 +1,52 @@
+"""Benchmark lock-step batch forecasting against one recursive forecast per series.
+
+Usage (from the project root, after training models):
+    python -m benchmarks.bench_batch --model LightGBM --cities ahmedabad,mumbai,delhi,bengaluru
+
+Each city's forecast is run on its own and then all cities together in one
+BatchRecursiveForecaster. ``--repeat`` duplicates the series to simulate many
+concurrent requests for the same model.
+"""
+import argparse
+import time
+import warnings
+from app.ml.forecaster import RecursiveForecaster, BatchRecursiveForecaster
+from app.ml.registry import model_registry
+from app.utils.preprocess import load_data
+
+
+def run(model_name, cities, hours, repeat):
+    series = []
+    for city in cities:
+        try:
+            series.append((model_registry.get(city, model_name), load_data(city)))
+        except FileNotFoundError as e:
+            print(f"⚠️ {e}. Skipping {city}.")
+    series = series * repeat
+    if not series:
+        return None
+
+    start = time.perf_counter()
+    expected = [RecursiveForecaster(model, df_history).forecast(hours) for model, df_history in series]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = BatchRecursiveForecaster(series).forecast(hours)
+    batch_time = time.perf_counter() - start
+
+    identical = all(a.equals(b) for a, b in zip(expected, actual))
+    print(f"{model_name}: {len(series)} series x {hours}h  one-by-one {single_time:.3f}s  "
+          f"lock-step {batch_time:.3f}s  speedup {single_time / batch_time:.1f}x  identical={identical}")
+    return {"series": len(series), "single_s": single_time, "batch_s": batch_time, "identical": identical}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="LightGBM")
+    parser.add_argument("--cities", default="ahmedabad,mumbai,delhi,bengaluru")
+    parser.add_argument("--hours", type=int, default=48)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore")
+    run(args.model, args.cities.split(","), args.hours, args.repeat)
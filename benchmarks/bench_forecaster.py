@@ -0,0 +1,91 @@
+"""Benchmark the array-backed recursive forecaster against the original pandas loop.
+
+Usage (from the project root, after training models):
+    python -m benchmarks.bench_forecaster --city delhi --models LightGBM,XGBoost
+
+For every model and horizon (48h, 1week, 2weeks) both paths are run on the same
+history, their outputs are checked for exact equality and the timings printed.
+"""
+import argparse
+import time
+import warnings
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from app.ml.ensemble import BASE_MODEL_NAMES
+from app.ml.forecaster import RecursiveForecaster
+from app.ml.registry import model_registry
+from app.utils.preprocess import load_data, prepare_data_for_prediction, TARGET_FEATURES, TIMESTAMP_COL, LAG_FEATURES
+
+HORIZONS = {"48h": 48, "1week": 168, "2weeks": 336}
+
+
+def legacy_forecast(model, df_history, hours_to_predict):
+    """The per-step pd.concat + create_features loop formerly used by make_predictions."""
+    predictions = []
+    current_history = df_history.copy()
+    last_timestamp = current_history.index.max()
+
+    for i in range(hours_to_predict):
+        X_pred_input = prepare_data_for_prediction(current_history, lag_features=LAG_FEATURES)
+        next_hour_pred_values = model.predict(X_pred_input)[0]
+
+        pred_record = {TIMESTAMP_COL: last_timestamp + timedelta(hours=i + 1)}
+        for idx, feature in enumerate(TARGET_FEATURES):
+            if feature == "Humidity (%)":
+                pred_record[feature] = np.clip(next_hour_pred_values[idx], 0, 100)
+            elif feature == "Wind Direction (°)":
+                pred_record[feature] = np.clip(next_hour_pred_values[idx], 0, 360)
+            else:
+                pred_record[feature] = next_hour_pred_values[idx]
+        predictions.append(pred_record)
+
+        new_row_df = pd.DataFrame([pred_record])
+        new_row_df[TIMESTAMP_COL] = pd.to_datetime(new_row_df[TIMESTAMP_COL])
+        new_row_df.set_index(TIMESTAMP_COL, inplace=True)
+        current_history = pd.concat([current_history, new_row_df[TARGET_FEATURES]])
+
+    return pd.DataFrame(predictions)
+
+
+def run(city, model_names):
+    df_history = load_data(city)
+    results = []
+    for model_name in model_names:
+        try:
+            model = model_registry.get(city, model_name)
+        except FileNotFoundError:
+            print(f"⚠️ Model {model_name} for {city} not found. Skipping.")
+            continue
+
+        for label, hours in HORIZONS.items():
+            start = time.perf_counter()
+            expected = legacy_forecast(model, df_history, hours)
+            legacy_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            actual = RecursiveForecaster(model, df_history).forecast(hours)
+            new_time = time.perf_counter() - start
+
+            results.append({
+                "model": model_name,
+                "horizon": label,
+                "legacy_s": legacy_time,
+                "ring_buffer_s": new_time,
+                "speedup": legacy_time / new_time,
+                "identical": expected.equals(actual),
+            })
+            print(f"{model_name:>22} {label:>7}: legacy {legacy_time:8.3f}s  "
+                  f"ring buffer {new_time:8.3f}s  speedup {legacy_time / new_time:6.1f}x  "
+                  f"identical={results[-1]['identical']}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--city", default="delhi")
+    parser.add_argument("--models", default=",".join(m for m in BASE_MODEL_NAMES if m != "Prophet"))
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore")
+    run(args.city, args.models.split(","))
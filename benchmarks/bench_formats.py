@@ -0,0 +1,79 @@
+"""Benchmark /predict response formats: payload size and encoding time.
+
+Usage (from the project root; no trained models needed):
+    python -m benchmarks.bench_formats --hours 48,336,8760 --bounds
+
+A synthetic hourly forecast with the target columns (plus Prophet bounds with
+``--bounds``) is encoded as records JSON (including FastAPI's response
+encoding), NDJSON, columnar JSON and, when pyarrow is installed, Arrow IPC.
+"""
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+from app.utils.preprocess import TARGET_FEATURES, TIMESTAMP_COL
+from app.utils.serialize import format_records, iter_ndjson, forecast_to_columnar, forecast_to_arrow, arrow_available
+
+
+def synthetic_forecast(hours, bounds):
+    rng = np.random.default_rng(0)
+    data = {TIMESTAMP_COL: pd.date_range("2025-01-01", periods=hours, freq="h")}
+    for col in TARGET_FEATURES:
+        data[col] = rng.normal(25, 5, hours)
+        if bounds:
+            data[f"{col}_lower"] = data[col] - 2
+            data[f"{col}_upper"] = data[col] + 2
+    return pd.DataFrame(data)
+
+
+def encode_json(df):
+    # What /predict does for the default format: records, then FastAPI's JSONResponse
+    content = jsonable_encoder(format_records(df))
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def encode_ndjson(df):
+    return b"".join(iter_ndjson(df))
+
+
+ENCODERS = {
+    "json": encode_json,
+    "ndjson": encode_ndjson,
+    "columnar": forecast_to_columnar,
+    "arrow": forecast_to_arrow,
+}
+
+
+def run(hours, bounds, repeat):
+    df = synthetic_forecast(hours, bounds)
+    results = {}
+    for name, encode in ENCODERS.items():
+        if name == "arrow" and not arrow_available():
+            print("⚠️ pyarrow not installed; skipping arrow.")
+            continue
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            body = encode(df)
+            timings.append(time.perf_counter() - start)
+        results[name] = {"bytes": len(body), "seconds": min(timings)}
+
+    base = results["json"]
+    print(f"{hours}h ({len(df.columns) - 1} value columns):")
+    for name, result in results.items():
+        print(f"  {name:<9} {result['bytes']:>10,} bytes ({result['bytes'] / base['bytes']:.2f}x)  "
+              f"{result['seconds'] * 1000:8.2f} ms (speedup {base['seconds'] / result['seconds']:.1f}x)")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", default="48,336,8760")
+    parser.add_argument("--bounds", action="store_true", help="Add Prophet-style _lower/_upper columns")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for hours in args.hours.split(","):
+        run(int(hours), args.bounds, args.repeat)
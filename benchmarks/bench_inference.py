@@ -0,0 +1,87 @@
+"""Benchmark one recursive forecast step: model.predict on a DataFrame vs the compiled adapter.
+
+Usage (from the project root; needs the trained models of the city):
+    python -m benchmarks.bench_inference --city delhi --rows 1,4 --hours 48
+
+For every model in BASE_MODEL_NAMES the per-step latency of predicting
+``rows`` feature rows is measured both ways, and the compiled predictions
+are checked to be identical. With ``--hours`` a full recursive forecast of
+that length is timed as well. Prophet has no per-step path and is skipped.
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from app.ml import inference
+from app.ml.ensemble import BASE_MODEL_NAMES
+from app.ml.registry import model_registry
+from app.ml.forecaster import RecursiveForecaster
+from app.utils.preprocess import load_data, get_feature_columns, LAG_FEATURES
+
+
+def best_of(fn, repeat):
+    fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def feature_rows(df_history, rows):
+    """Realistic feature rows: the lag features of the last ``rows`` hours plus zeros for the calendar."""
+    columns = get_feature_columns(LAG_FEATURES)
+    values = df_history.to_numpy(dtype=np.float64)
+    X = np.zeros((rows, len(columns)), dtype=np.float64)
+    for row in range(rows):
+        end = len(values) - row
+        X[row, :values.shape[1] * LAG_FEATURES] = values[end - LAG_FEATURES:end][::-1].T.ravel()
+    return X, columns
+
+
+def forecast_seconds(model, df_history, hours, compiled, repeat):
+    inference.COMPILED_INFERENCE = compiled
+    try:
+        return best_of(lambda: RecursiveForecaster(model, df_history).forecast(hours), repeat)
+    finally:
+        inference.COMPILED_INFERENCE = True
+
+
+def run(city, rows_list, hours, repeat):
+    df_history = load_data(city, tail=LAG_FEATURES + 64)
+    print(f"{'model':<22} {'rows':>5} {'predict us':>12} {'compiled us':>12} {'speedup':>8} {'identical':>9}")
+    for model_name in BASE_MODEL_NAMES:
+        try:
+            model = model_registry.get(city, model_name)
+        except FileNotFoundError:
+            print(f"⚠️ {model_name} for {city} not found; skipping.")
+            continue
+        predict = inference.compile_model(model)
+        if predict is None:
+            print(f"{model_name:<22} {'':>5} {'n/a (no compiled path)':>34}")
+            continue
+        for rows in rows_list:
+            X, columns = feature_rows(df_history, rows)
+            before = best_of(lambda: model.predict(pd.DataFrame(X, columns=columns)), repeat)
+            after = best_of(lambda: predict(X), repeat)
+            expected = np.asarray(model.predict(pd.DataFrame(X, columns=columns)))
+            actual = predict(X)
+            identical = np.array_equal(expected, actual) and expected.dtype == actual.dtype
+            print(f"{model_name:<22} {rows:>5} {before * 1e6:>12.0f} {after * 1e6:>12.0f} "
+                  f"{before / after:>7.1f}x {str(identical):>9}")
+        if hours:
+            before = forecast_seconds(model, df_history, hours, False, max(1, repeat // 10))
+            after = forecast_seconds(model, df_history, hours, True, max(1, repeat // 10))
+            print(f"{'':<22} {hours:>4}h forecast: {before * 1000:.1f} ms -> {after * 1000:.1f} ms ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--city", default="delhi")
+    parser.add_argument("--rows", default="1,4", help="Comma-separated batch sizes (1 = one forecast, 4 = four cities)")
+    parser.add_argument("--hours", type=int, default=48, help="Also time a recursive forecast of this length (0 = skip)")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    run(args.city, [int(rows) for rows in args.rows.split(",")], args.hours, args.repeat)
@@ -0,0 +1,261 @@
+"""End-to-end benchmark suite on synthetic cities, with regression gates.
+
+Usage (from the project root):
+    python -m benchmarks.bench_suite --cities 1 --years 2 --out bench_results.json
+    python -m benchmarks.bench_suite --cities 1 --years 2 --baseline bench_results.json
+
+Synthetic cities (``benchmarks/synthetic.py``) are written to a work
+directory, the models are trained on them once, and then the hot paths are
+timed: ``load_data``, ``create_features``, ``prepare_data_for_training``,
+``make_predictions`` per model for one hour and for the full 2-week horizon,
+``predict_ensemble``, ``evaluate_ensemble`` and ``/predict`` through an
+in-process ASGI client, with and without the forecast cache. Each timing
+covers all synthetic cities.
+
+The app reads its data, model and metrics directories from
+``WEATHER_DATA_DIR``, ``WEATHER_MODELS_DIR``, ``WEATHER_METRICS_DIR`` and its
+cities from ``WEATHER_CITIES``; the suite sets them before importing the app,
+so ``app/data`` and ``app/models`` are never touched.
+
+With ``--baseline`` every timing is compared to an earlier results file. A
+benchmark regresses when its best time exceeds the baseline's by more than
+``--threshold`` (a fraction, per-benchmark overrides with ``--threshold-for``)
+and by more than ``--min-delta-ms``; the run then exits with status 1.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from importlib import metadata
+
+# Allowed slowdown before a benchmark counts as a regression (0.25 = 25% slower)
+BENCH_REGRESSION_THRESHOLD = float(os.getenv("BENCH_REGRESSION_THRESHOLD", "0.25"))
+# Differences smaller than this are timer noise, whatever the ratio
+BENCH_MIN_DELTA_MS = float(os.getenv("BENCH_MIN_DELTA_MS", "1.0"))
+
+FULL_HORIZON_HOURS = 336
+LIBRARIES = ["numpy", "pandas", "scikit-learn", "lightgbm", "xgboost", "catboost", "prophet", "fastapi"]
+
+
+def default_workdir(n_cities, years, seed):
+    return os.path.join(tempfile.gettempdir(), f"weather-bench-{n_cities}c-{years:g}y-s{seed}")
+
+
+def configure_environment(workdir):
+    """Point the app at the work directory; must run before any ``app`` import."""
+    os.environ["WEATHER_DATA_DIR"] = os.path.join(workdir, "data")
+    os.environ["WEATHER_MODELS_DIR"] = os.path.join(workdir, "models")
+    os.environ["WEATHER_METRICS_DIR"] = os.path.join(workdir, "metrics")
+    # Forecasts are timed, not served from a precomputed or preloaded cache
+    os.environ["PRECOMPUTE_FORECASTS"] = "0"
+    os.environ["PRELOAD_MODELS"] = "0"
+
+
+def measure(fn, repeat, min_seconds):
+    """Time ``fn`` after one warm-up call: at least ``repeat`` runs and ``min_seconds`` in total."""
+    fn()
+    timings = []
+    while len(timings) < repeat or (sum(timings) < min_seconds and len(timings) < 1000):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "best_ms": timings[0] * 1000,
+        "median_ms": timings[len(timings) // 2] * 1000,
+        "runs": len(timings),
+    }
+
+
+def train_missing_models(cities, model_names):
+    """Train the models not yet in the work directory; returns seconds per trained model."""
+    from app.ml.train_models import train_city_model
+    from app.ml.registry import MODELS_DIR
+
+    seconds = {}
+    for city in cities:
+        for model_name in model_names:
+            if os.path.exists(os.path.join(MODELS_DIR, f"{city}_{model_name}.pkl")):
+                continue
+            start = time.perf_counter()
+            result = train_city_model(city, model_name)
+            if result["error"]:
+                raise RuntimeError(f"Training {model_name} for {city} failed: {result['error']}")
+            seconds[f"{city}/{model_name}"] = round(time.perf_counter() - start, 3)
+    return seconds
+
+
+def run_benchmarks(cities, model_names, repeat, min_seconds):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.ml.ensemble import predict_ensemble, BASE_MODEL_NAMES
+    from app.ml.evaluate import evaluate_ensemble
+    from app.ml.forecast_cache import forecast_cache
+    from app.ml.predict import make_predictions
+    from app.utils.preprocess import load_data, create_features, prepare_data_for_training, LAG_FEATURES
+
+    results = {}
+
+    def bench(name, fn, runs=repeat):
+        results[name] = measure(fn, runs, min_seconds)
+        print(f"{name:<40} {results[name]['best_ms']:>11.2f} ms  (median {results[name]['median_ms']:.2f}, {results[name]['runs']} runs)")
+
+    def each_city(fn):
+        return lambda: [fn(city) for city in cities]
+
+    bench("load_data", each_city(load_data))
+    bench("load_data[tail]", each_city(lambda city: load_data(city, tail=LAG_FEATURES + 1)))
+    histories = {city: load_data(city) for city in cities}
+    bench("create_features", each_city(lambda city: create_features(histories[city])))
+    bench("prepare_data_for_training", each_city(prepare_data_for_training))
+
+    for model_name in model_names:
+        bench(f"make_predictions[{model_name}]:1h", each_city(lambda city: make_predictions(city, model_name, 1)))
+        bench(f"make_predictions[{model_name}]:{FULL_HORIZON_HOURS}h",
+              each_city(lambda city: make_predictions(city, model_name, FULL_HORIZON_HOURS)))
+
+    if set(BASE_MODEL_NAMES) <= set(model_names):
+        bench("predict_ensemble", each_city(lambda city: predict_ensemble(city, FULL_HORIZON_HOURS)))
+        bench("evaluate_ensemble", each_city(evaluate_ensemble))
+        endpoint_models = list(model_names) + ["Ensemble"]
+    else:
+        print("⏭️ Not all ensemble members selected; skipping the ensemble benchmarks.")
+        endpoint_models = list(model_names)
+
+    with TestClient(app) as client:
+        def get_prediction(city, model_name, cold):
+            if cold:
+                forecast_cache.clear()
+            response = client.get("/predict", params={"city": city, "model_name": model_name, "forecast_type": "2weeks"})
+            response.raise_for_status()
+
+        for model_name in endpoint_models:
+            bench(f"/predict[{model_name}]",
+                  each_city(lambda city: get_prediction(city, model_name, cold=True)))
+            bench(f"/predict[{model_name}]:cached",
+                  each_city(lambda city: get_prediction(city, model_name, cold=False)))
+    return results
+
+
+def environment_info():
+    versions = {}
+    for library in LIBRARIES:
+        try:
+            versions[library] = metadata.version(library)
+        except metadata.PackageNotFoundError:
+            versions[library] = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "libraries": versions,
+    }
+
+
+def compare(results, baseline, threshold=BENCH_REGRESSION_THRESHOLD, thresholds=None, min_delta_ms=BENCH_MIN_DELTA_MS):
+    """Compare best times to a baseline results file; returns the regressed benchmark names.
+
+    ``thresholds`` maps fnmatch patterns to the allowed slowdown of matching
+    benchmarks; the first matching pattern wins over ``threshold``.
+    """
+    thresholds = thresholds or {}
+    regressions = []
+    print(f"\n{'benchmark':<40} {'baseline ms':>12} {'current ms':>12} {'change':>8}")
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<40} {'-':>12} {result['best_ms']:>12.2f} {'new':>8}")
+            continue
+        allowed = next((ratio for pattern, ratio in thresholds.items() if fnmatch.fnmatchcase(name, pattern)), threshold)
+        change = result["best_ms"] / before["best_ms"] - 1 if before["best_ms"] > 0 else 0.0
+        regressed = change > allowed and result["best_ms"] - before["best_ms"] > min_delta_ms
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<40} {before['best_ms']:>12.2f} {result['best_ms']:>12.2f} {change:>+7.0%}"
+              f"{'  ❌ regression (allowed ' + format(allowed, '+.0%') + ')' if regressed else ''}")
+    return regressions
+
+
+def parse_thresholds(values):
+    thresholds = {}
+    for value in values:
+        pattern, _, ratio = value.rpartition("=")
+        if not pattern:
+            raise ValueError(f"Expected PATTERN=RATIO, got {value!r}")
+        thresholds[pattern] = float(ratio)
+    return thresholds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cities", type=int, default=1, help="Number of synthetic cities")
+    parser.add_argument("--years", type=float, default=2, help="Years of hourly history per city")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--models", default=None, help="Comma-separated models (default: all)")
+    parser.add_argument("--workdir", default=None, help="Data/models/metrics directory, reused between runs "
+                        "(default: a temp directory named after cities, years and seed)")
+    parser.add_argument("--repeat", type=int, default=5, help="Minimum timed runs per benchmark")
+    parser.add_argument("--min-seconds", type=float, default=0.5, help="Keep repeating fast benchmarks for this long")
+    parser.add_argument("--out", default=None, help="Write the results JSON here")
+    parser.add_argument("--baseline", default=None, help="Results JSON to check for regressions against")
+    parser.add_argument("--threshold", type=float, default=BENCH_REGRESSION_THRESHOLD,
+                        help="Allowed slowdown as a fraction (default %(default)s)")
+    parser.add_argument("--threshold-for", action="append", default=[], metavar="PATTERN=RATIO",
+                        help="Allowed slowdown for benchmarks matching an fnmatch pattern, e.g. '/predict*=0.5'")
+    parser.add_argument("--min-delta-ms", type=float, default=BENCH_MIN_DELTA_MS,
+                        help="Ignore slowdowns smaller than this many milliseconds")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    workdir = args.workdir or default_workdir(args.cities, args.years, args.seed)
+    # The synthetic module imports app.utils.preprocess, so it is imported after the environment is set
+    configure_environment(workdir)
+    from benchmarks.synthetic import city_names, write_cities
+    cities = city_names(args.cities)
+    os.environ["WEATHER_CITIES"] = ",".join(cities)
+    from app.ml.ensemble import ALL_MODEL_NAMES
+
+    model_names = args.models.split(",") if args.models else ALL_MODEL_NAMES
+    config = {"cities": args.cities, "years": args.years, "seed": args.seed, "models": model_names}
+    if baseline is not None and baseline.get("config") != config:
+        print(f"⚠️ Baseline was run with {baseline.get('config')}, this run with {config}; timings are not comparable.")
+
+    write_cities(os.environ["WEATHER_DATA_DIR"], args.cities, args.years, seed=args.seed)
+    trained = train_missing_models(cities, model_names)
+    if trained:
+        print(f"✅ Trained {len(trained)} model(s) in {sum(trained.values()):.1f}s")
+
+    print(f"\nBenchmarking {len(cities)} synthetic cities x {args.years:g} years in {workdir}")
+    results = run_benchmarks(cities, model_names, args.repeat, args.min_seconds)
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": config,
+        "environment": environment_info(),
+        "training_seconds": trained,
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Saved results to {args.out}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold, parse_thresholds(args.threshold_for), args.min_delta_ms)
+        if regressions:
+            print(f"\n❌ {len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+            return 1
+        print("\n✅ No regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
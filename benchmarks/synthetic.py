@@ -0,0 +1,85 @@
+"""Generate synthetic hourly weather CSVs in the layout of ``app/data/<city>.csv``.
+
+Usage (from the project root):
+    python -m benchmarks.synthetic --out /tmp/weather-bench/data --cities 4 --years 3
+
+Each city gets a seasonal and diurnal temperature cycle, humidity that falls
+as temperature rises, gusty wind speed and a slowly drifting wind direction,
+all with autocorrelated noise and rounded to one decimal like the Meteostat
+exports. The same ``seed`` always produces the same files, so benchmark runs
+on different machines or commits use identical inputs.
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from app.utils.preprocess import TARGET_FEATURES, TIMESTAMP_COL
+
+SYNTHETIC_START = "2020-01-01"
+
+
+def city_names(n_cities):
+    return [f"synth{i:02d}" for i in range(n_cities)]
+
+
+def _ar1(rng, n, phi, scale):
+    """Autocorrelated noise: x[t] = phi * x[t-1] + e[t], with stationary std ``scale``."""
+    shocks = rng.normal(0.0, scale * np.sqrt(1 - phi ** 2), n)
+    noise = np.empty(n)
+    noise[0] = rng.normal(0.0, scale)
+    for t in range(1, n):
+        noise[t] = phi * noise[t - 1] + shocks[t]
+    return noise
+
+
+def generate_city(years, seed=0, start=SYNTHETIC_START):
+    """One city's history: ``years`` * 365 days of hourly rows as a DataFrame."""
+    rng = np.random.default_rng(seed)
+    n = int(years * 365 * 24)
+    timestamps = pd.date_range(start, periods=n, freq="h")
+    hour = timestamps.hour.to_numpy()
+    dayofyear = timestamps.dayofyear.to_numpy()
+
+    # Per-city climate so cities differ the way the real ones do
+    mean_temp = rng.uniform(22, 30)
+    seasonal = rng.uniform(3, 10)
+    diurnal = rng.uniform(3, 8)
+    season = -np.cos(2 * np.pi * (dayofyear - 15) / 365.25)
+    day = -np.cos(2 * np.pi * (hour - 3) / 24)
+
+    temperature = mean_temp + seasonal * season + diurnal * day + _ar1(rng, n, 0.97, 1.5)
+    humidity = np.clip(rng.uniform(50, 75) - 2.5 * (temperature - mean_temp) + _ar1(rng, n, 0.95, 8), 5, 100)
+    wind_speed = np.maximum(0, rng.uniform(6, 12) + 3 * day + _ar1(rng, n, 0.9, 3) + rng.gamma(1.5, 1.5, n))
+    wind_direction = np.mod(rng.uniform(0, 360) + np.cumsum(rng.normal(0, 6, n)), 360)
+
+    values = np.column_stack([temperature, humidity, wind_speed, wind_direction]).round(1)
+    df = pd.DataFrame(values, columns=TARGET_FEATURES)
+    df.insert(0, TIMESTAMP_COL, timestamps)
+    return df
+
+
+def write_cities(out_dir, n_cities, years, seed=0):
+    """Write ``n_cities`` synthetic CSVs to ``out_dir``; returns the city names.
+
+    Existing files are kept, so a benchmark directory is generated only once.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    cities = city_names(n_cities)
+    for i, city in enumerate(cities):
+        path = os.path.join(out_dir, f"{city}.csv")
+        if os.path.exists(path):
+            continue
+        generate_city(years, seed=seed + i).to_csv(path, index=False, date_format="%Y-%m-%d %H:%M:%S")
+        print(f"✅ Wrote {years} year(s) of synthetic data for {city} to {path}")
+    return cities
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", required=True, help="Directory for the <city>.csv files")
+    parser.add_argument("--cities", type=int, default=4)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_cities(args.out, args.cities, args.years, seed=args.seed)
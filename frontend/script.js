@@ -273,6 +273,8 @@ form.addEventListener('submit', async (event) => {
         city: city,
         model_name: model_name,
         forecast_type: forecast_type,
+        // Stream rows as newline-delimited JSON so long forecasts render as they arrive
+        format: 'ndjson',
     });
 
     // Add day of week if applicable
@@ -312,11 +314,9 @@ form.addEventListener('submit', async (event) => {
             throw new Error(errorMsg);
         }
 
-        const data = await response.json();
+        const rowCount = await renderStream(response);
 
-        if (data && data.length > 0) {
-            renderResults(data);
-        } else {
+        if (rowCount === 0) {
             resultsDiv.innerHTML = '<p>No forecast data available for the selected criteria.</p>';
         }
 
@@ -329,18 +329,46 @@ form.addEventListener('submit', async (event) => {
     }
 });
 
-function renderResults(data) {
-    if (!data || data.length === 0) {
-        resultsDiv.innerHTML = '<p>No forecast data received.</p>';
-        return;
+// Read an NDJSON response and append each row to the table as soon as its line arrives
+async function renderStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let table = null;
+    let headers = null;
+    let rowCount = 0;
+
+    const handleLine = (line) => {
+        if (!line.trim()) return;
+        const rowData = JSON.parse(line);
+        if (!table) {
+            headers = Object.keys(rowData);
+            table = createResultsTable(headers);
+            loadingDiv.style.display = 'none';
+        }
+        appendResultRow(table, headers, rowData);
+        rowCount++;
+    };
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.forEach(handleLine);
     }
+    buffer += decoder.decode();
+    handleLine(buffer);
+    return rowCount;
+}
 
+function createResultsTable(headers) {
     const table = document.createElement('table');
     const thead = document.createElement('thead');
     const tbody = document.createElement('tbody');
     const headerRow = document.createElement('tr');
 
-    const headers = Object.keys(data[0]);
     headers.forEach(headerText => {
         const th = document.createElement('th');
         th.textContent = headerText;
@@ -348,17 +376,18 @@ function renderResults(data) {
     });
     thead.appendChild(headerRow);
 
-    data.forEach(rowData => {
-        const row = document.createElement('tr');
-        headers.forEach(header => {
-            const td = document.createElement('td');
-            td.textContent = rowData[header];
-            row.appendChild(td);
-        });
-        tbody.appendChild(row);
-    });
-
     table.appendChild(thead);
     table.appendChild(tbody);
     resultsDiv.appendChild(table);
-}
\ No newline at end of file
+    return table;
+}
+
+function appendResultRow(table, headers, rowData) {
+    const row = document.createElement('tr');
+    headers.forEach(header => {
+        const td = document.createElement('td');
+        td.textContent = rowData[header];
+        row.appendChild(td);
+    });
+    table.tBodies[0].appendChild(row);
+}